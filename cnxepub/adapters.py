@@ -8,28 +8,42 @@
 from __future__ import unicode_literals
 import sys
 import base64
+import hashlib
 import io
+import json
 import logging
 import mimetypes
 import os
+import pickle
+import posixpath
+import re
+import tempfile
 import uuid
+import zipfile
+from functools import partial
+from xml.sax.saxutils import escape as xml_escape
 
-from copy import deepcopy
-
-import jinja2
 import lxml.html
 
 from lxml import etree
 
-from .epub import EPUB, Package, Item
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+from .epub import (
+    EPUB, Package, Item, read_digests, _item_location, _LazyFile,
+    EPUB_CONTAINER_XML_RELATIVE_PATH, EPUB_CONTAINER_XML_NAMESPACES,
+    EPUB_OPF_NAMESPACES,
+    )
 from .formatters import HTMLFormatter
 from .models import (
-    flatten_model, flatten_to_documents,
-    content_to_etree, etree_to_content,
+    flatten_model, flatten_to_documents, model_to_wire, model_from_wire,
+    content_to_etree,
     Binder, TranslucentBinder,
     Document, Resource, DocumentPointer, CompositeDocument,
     TRANSLUCENT_BINDER_ID,
-    INTERNAL_REFERENCE_TYPE,
     INLINE_REFERENCE_TYPE,
     )
 from .html_parsers import (parse_metadata, parse_navigation_html_to_tree,
@@ -37,18 +51,21 @@ from .html_parsers import (parse_metadata, parse_navigation_html_to_tree,
                            HTML_DOCUMENT_NAMESPACES)
 
 from .data_uri import DataURI
+from .utils import ThreadPoolExecutor
 
 
 logger = logging.getLogger('cnxepub')
 
 
 __all__ = (
-    'adapt_package', 'adapt_item',
+    'adapt_epub', 'adapt_package', 'adapt_item',
+    'AdaptationCache',
     'get_model_extensions',
     'make_epub', 'make_publication_epub',
     'BinderItem',
     'DocumentItem',
     'adapt_single_html',
+    'adapt_single_html_file',
     )
 
 
@@ -69,6 +86,206 @@ def adapt_package(package):
     return _node_to_model(tree, package)
 
 
+def adapt_epub(file, cache=None):
+    """Adapts each package of the EPUB ``file`` (a file-path to an
+    ``.epub`` file or to a directory, see ``.epub.EPUB.from_file``)
+    to a binder, returning them in a list.
+
+    When given an ``AdaptationCache`` as ``cache``, the binders are
+    loaded from it when the same EPUB has been adapted before,
+    otherwise they are adapted and then cached. Binders loaded from
+    the cache are made of plain models (see ``AdaptationCache``).
+    """
+    key = cache is not None and _epub_digest(file) or None
+    if key is not None:
+        binders = cache.get(key, file)
+        if binders is not None:
+            return binders
+    binders = [adapt_package(package) for package in EPUB.from_file(file)]
+    if key is not None:
+        cache.set(key, binders, file)
+    return binders
+
+
+def _epub_digest(file):
+    """Digest of the content of the EPUB ``file`` (an ``.epub`` file
+    or a directory) and the versions of this library and python.
+    """
+    from . import __version__
+    hasher = hashlib.new('sha1')
+    hasher.update('{} {}'.format(__version__,
+                                 sys.version_info[0]).encode('utf-8'))
+    if os.path.isdir(file):
+        filepaths = []
+        for root, dirs, files in os.walk(file):
+            dirs.sort()
+            filepaths.extend(os.path.join(root, name)
+                             for name in sorted(files))
+    else:
+        filepaths = [file]
+    for filepath in filepaths:
+        name = os.path.relpath(filepath, file)
+        hasher.update(b'\0' + name.encode('utf-8') + b'\0')
+        with io.open(filepath, 'rb') as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _epub_members(file):
+    """The archive paths of the items of the EPUB ``file`` (an ``.epub``
+    file or a directory), by the item names (see ``.epub.Item``).
+    """
+    if os.path.isdir(file):
+        def read(member):
+            with io.open(os.path.join(file, *member.split('/')), 'rb') as f:
+                return f.read()
+        return _read_epub_members(read)
+    with zipfile.ZipFile(file, 'r') as zf:
+        return _read_epub_members(zf.read)
+
+
+def _read_epub_members(read):
+    members = {}
+    container = etree.fromstring(read(EPUB_CONTAINER_XML_RELATIVE_PATH))
+    for opf_path in container.xpath(
+            '//ns:rootfile/@full-path',
+            namespaces=EPUB_CONTAINER_XML_NAMESPACES):
+        opf = etree.fromstring(read(opf_path))
+        base = posixpath.dirname(opf_path)
+        for href in opf.xpath('/opf:package/opf:manifest/opf:item/@href',
+                              namespaces=EPUB_OPF_NAMESPACES):
+            member = posixpath.normpath(posixpath.join(base, href))
+            members[posixpath.basename(member)] = member
+    return members
+
+
+def _open_epub_member(file, member):
+    """Open the ``member`` of the EPUB ``file`` (an ``.epub`` file
+    or a directory) for reading.
+    """
+    if os.path.isdir(file):
+        return io.open(os.path.join(file, *member.split('/')), 'rb')
+    with zipfile.ZipFile(file, 'r') as zf:
+        # The member keeps the archive open until it is closed.
+        return zf.open(member)
+
+
+def _plain_data(item):
+    """Copy of ``item`` (a wire form) with the strings within it,
+    such as lxml's smart strings, made plain strings.
+    """
+    if isinstance(item, dict):
+        return dict((_plain_data(key), _plain_data(value))
+                    for key, value in item.items())
+    if isinstance(item, list):
+        return [_plain_data(value) for value in item]
+    if isinstance(item, tuple):
+        return tuple(_plain_data(value) for value in item)
+    for string_type in (bytes, type(u'')):
+        if isinstance(item, string_type):
+            return string_type(item)
+    return item
+
+
+class _DataUnpickler(pickle.Unpickler):
+    """Unpickles plain data only (strings, numbers, lists, tuples and
+    dictionaries), refusing the classes and functions that a pickle
+    may otherwise import and call.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(
+            "{}.{} is not plain data".format(module, name))
+
+
+class AdaptationCache(object):
+    """A cache of the binders adapted from EPUBs (see ``adapt_epub``)
+    in ``directory`` on the local disk. Each EPUB's binders are kept
+    in one binary file, of their wire form (see
+    ``.models.model_to_wire``), with only the hash, media-type and
+    filename of their resources, along with the archive path of each.
+    The resources' data is read from the EPUB when it is used.
+
+    The files are read back as plain data, so they cannot run code,
+    but anyone who can write to the ``directory`` can change the
+    binders read from it. It should only be writable by those trusted
+    with the EPUBs themselves.
+
+    The binders read from the cache are made of ``.models.Binder``,
+    ``.models.Document`` and ``.models.DocumentPointer`` instances
+    rather than the ``BinderItem``, ``DocumentItem`` and
+    ``DocumentPointerItem`` instances that ``adapt_package`` makes,
+    as they are not adapted from the EPUB's items.
+    """
+
+    suffix = '.binders'
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key, file):
+        """Return the binders cached under ``key``, whose resources
+        are opened from the EPUB ``file`` (an ``.epub`` file
+        or a directory), or None when there are none.
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                wires, members = _DataUnpickler(f).load()
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # A partial or incompatible file, which is written over.
+            logger.warning("ignoring unreadable cached binders "
+                           "{}".format(key))
+            return None
+        file = os.path.abspath(file)
+
+        def open_resource(id):
+            return partial(_open_epub_member, file, members[id])
+
+        return [model_from_wire(wire, open_resource) for wire in wires]
+
+    def set(self, key, binders, file):
+        """Cache the ``binders`` adapted from the EPUB ``file``
+        (an ``.epub`` file or a directory) under ``key``.
+        Binders with resources that are not items of the EPUB
+        are not cached.
+        """
+        epub_members = _epub_members(file)
+        members = {}
+        for binder in binders:
+            for model in flatten_model(binder):
+                for resource in getattr(model, 'resources', []):
+                    if resource.id not in epub_members:
+                        logger.warning("not caching binders with resource "
+                                       "{} outside of the EPUB"
+                                       .format(resource.id))
+                        return
+                    members[resource.id] = epub_members[resource.id]
+                    # Computed now, so that it is cached with the binders.
+                    resource.hash
+        wires = [_plain_data(model_to_wire(binder, resource_data=False,
+                                           resource_paths=False))
+                 for binder in binders]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((wires, members), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
 def adapt_item(item, package, filename=None):
     """Adapts ``.epub.Item`` to a ``DocumentItem``.
 
@@ -92,37 +309,108 @@ def adapt_item(item, package, filename=None):
     return model
 
 
-def make_epub(binders, file):
-    """Creates an EPUB file from a binder(s)."""
+def make_epub(binders, file, previous=None, workers=1,
+              compresslevel=None, threads=1, incremental=False):
+    """Creates an EPUB file from a binder(s).
+
+    When ``incremental``, the digests of the documents and resources
+    are recorded in the EPUB, so that it can be rebuilt incrementally.
+    When given the ``previous`` EPUB built that way from the binder(s)
+    (a file-path or file-like object, which must not be ``file``),
+    documents and resources that have not changed since are copied
+    from it instead of being rendered and compressed again,
+    and digests are recorded again.
+
+    Documents are rendered across a pool of ``workers`` processes,
+    and several binders are packaged concurrently, when ``workers``
+    is greater than one (and the pool is available, i.e. not on
+    Python 2). The documents are still serialized in this process
+    to be sent to the pool, which bounds the speedup.
+
+    The archive is deflated at ``compresslevel`` using ``threads``
+    worker threads (see ``.epub.pack_epub``).
+    """
     if not isinstance(binders, (list, set, tuple,)):
         binders = [binders]
-    epub = EPUB([_make_package(binder) for binder in binders])
-    epub.to_file(epub, file)
+    digests = _previous_digests(previous, incremental)
+
+    def make_package(binder, executor):
+        return _make_package(binder, digests, executor)
 
+    epub = EPUB(_make_packages(binders, make_package, workers=workers))
+    epub.to_file(epub, file, compresslevel=compresslevel, threads=threads,
+                 previous=previous)
 
-def make_publication_epub(binders, publisher, publication_message, file):
+
+def make_publication_epub(binders, publisher, publication_message, file,
+                          previous=None, workers=1, compresslevel=None,
+                          threads=1, incremental=False):
     """Creates an epub file from a binder(s). Also requires
     publication information, meant to be used in a EPUB publication
-    request.
+    request. See ``make_epub`` for the use of ``previous``,
+    ``workers``, ``compresslevel``, ``threads`` and ``incremental``.
     """
     if not isinstance(binders, (list, set, tuple,)):
         binders = [binders]
-    packages = []
-    for binder in binders:
-        metadata = binder.metadata
-        binder.metadata = deepcopy(metadata)
-        binder.metadata.update({'publisher': publisher,
-                                'publication_message': publication_message})
-        packages.append(_make_package(binder))
-        binder.metadata = metadata
-    epub = EPUB(packages)
-    epub.to_file(epub, file)
+    digests = _previous_digests(previous, incremental)
+
+    def make_package(binder, executor):
+        # Only the binder itself is copied, its nodes are shared.
+        publication = binder.clone(deep=False)
+        publication.metadata.update({
+            'publisher': publisher,
+            'publication_message': publication_message})
+        return _make_package(publication, digests, executor,
+                             package_id=_package_id(binder))
+
+    epub = EPUB(_make_packages(binders, make_package, workers=workers))
+    epub.to_file(epub, file, compresslevel=compresslevel, threads=threads,
+                 previous=previous)
+
+
+def _previous_digests(previous, incremental):
+    """The digests of the items of the ``previous`` epub, or None
+    when the build is not incremental.
+    """
+    if previous is not None:
+        return read_digests(previous)
+    if incremental:
+        return {}
+    return None
+
+
+def _make_packages(binders, make_package, workers=1):
+    """Calls ``make_package(binder, executor)`` for each of the binders,
+    concurrently and with a process pool ``executor`` to render in
+    when there is more than one worker, otherwise serially with
+    ``None`` for the executor.
+    """
+    if workers > 1 and ProcessPoolExecutor is None:
+        logger.warning("packaging serially, as worker processes are "
+                       "not available on this python")
+    if workers <= 1 or ProcessPoolExecutor is None or not binders:
+        return [make_package(binder, None) for binder in binders]
+    with ProcessPoolExecutor(workers) as executor:
+        if len(binders) == 1:
+            return [make_package(binders[0], executor)]
+        # Start the worker processes before the threads, as forking
+        # while other threads run (e.g. in lxml) is unsafe.
+        for future in [executor.submit(os.getpid) for i in range(workers)]:
+            future.result()
+        with ThreadPoolExecutor(min(len(binders), workers)) as threads:
+            futures = [threads.submit(make_package, binder, executor)
+                       for binder in binders]
+            return [future.result() for future in futures]
 
 
 def get_model_extensions(binder):
+    return _get_model_extensions(flatten_model(binder))
+
+
+def _get_model_extensions(models):
     extensions = {}
     # Set model identifier file extensions.
-    for model in flatten_model(binder):
+    for model in models:
         if isinstance(model, (Binder, TranslucentBinder,)):
             continue
         ext = mimetypes.guess_extension(model.media_type, strict=False)
@@ -134,17 +422,77 @@ def get_model_extensions(binder):
     return extensions
 
 
-def _make_package(binder):
-    """Makes an ``.epub.Package`` from a  Binder'ish instance."""
-    package_id = binder.id
+def _model_digest(model):
+    """Digest of everything the rendering of ``model`` depends upon,
+    which is used to detect unchanged documents between builds.
+    """
+    from . import __version__
+    hasher = hashlib.new('sha1')
+    hasher.update(json.dumps([
+        __version__,
+        model.__class__.__name__,
+        model.metadata,
+        [[r.id, r.filename] for r in getattr(model, 'resources', [])],
+        ], sort_keys=True, default=str).encode('utf-8'))
+    content = getattr(model, 'content', None)
+    if content is not None:
+        hasher.update(content)
+    return hasher.hexdigest()
+
+
+def _package_id(binder):
+    if binder.id is None:
+        return hash(binder)
+    return binder.id
+
+
+def _make_package(binder, previous_digests=None, executor=None,
+                  package_id=None):
+    """Makes an ``.epub.Package`` from a  Binder'ish instance.
+    When given ``previous_digests``, the items carry the digests of
+    the documents and resources they are made from, and those with
+    a digest that matches the previous one are made into items
+    without data, which are reused from the previous epub.
+    Documents are rendered in the ``executor``, when one is given.
+    The package is named after the binder, unless given a ``package_id``.
+    """
+
+    def make_item(name, media_type, digest, render):
+        # The ``digest`` is only computed for incremental builds.
+        if previous_digests is None:
+            return Item(name, render(), media_type)
+        digest = digest()
+        item = Item(name, None, media_type, digest=digest)
+        if previous_digests.get(_item_location(item)) != digest:
+            item.data = render()
+        return item
+
+    def render_document(model):
+        if executor is None:
+            return io.BytesIO(bytes(HTMLFormatter(model)))
+        return executor.submit(_render_document,
+                               model_to_wire(model, resource_data=False))
+
+    def make_document_item(model):
+        return make_item(''.join([model.ident_hash, extensions[model.id]]),
+                         model.media_type, lambda: _model_digest(model),
+                         lambda: render_document(model))
+
     if package_id is None:
-        package_id = hash(binder)
+        package_id = _package_id(binder)
 
     package_name = "{}.opf".format(package_id)
 
-    extensions = get_model_extensions(binder)
-
-    template_env = jinja2.Environment(trim_blocks=True, lstrip_blocks=True)
+    models = list(flatten_model(binder))
+    extensions = _get_model_extensions(models)
+    # Index the resources up front, so references can be resolved
+    # in a single pass over each document.
+    resources = {}
+    for model in models:
+        for resource in getattr(model, 'resources', []):
+            resources[resource.id] = resource
+    # Finds the resources in unparsed documents, made on demand.
+    pattern = None
 
     # Build the package item list.
     items = []
@@ -158,24 +506,31 @@ def _make_package(binder):
                 'application/xhtml+xml',
                 is_navigation=True, properties=['nav'])
     items.append(item)
-    resources = {}
     # Roll through the model list again, making each one an item.
-    for model in flatten_model(binder):
+    for model in models:
         for resource in getattr(model, 'resources', []):
-            resources[resource.id] = resource
-            with resource.open() as data:
-                item = Item(resource.id, data, resource.media_type)
+            item = make_item(resource.id, resource.media_type,
+                             lambda: resource.hash,
+                             lambda: _LazyFile(resource.open))
             items.append(item)
 
         if isinstance(model, (Binder, TranslucentBinder,)):
             continue
         if isinstance(model, DocumentPointer):
-            content = bytes(HTMLFormatter(model))
             item = Item(''.join([model.ident_hash, extensions[model.id]]),
-                        io.BytesIO(content),
+                        render_document(model),
                         model.media_type)
             items.append(item)
             continue
+        # Documents that have not been parsed are left so, unless they
+        # may have references to bind or data uris.
+        if not model.is_loaded:
+            if pattern is None:
+                pattern = _references_pattern(resources)
+            if not _may_reference(model, pattern):
+                items.append(make_document_item(model))
+                continue
+        model.bind_references(resources, '../resources/{}')
         for reference in model.references:
             if reference.remote_type == INLINE_REFERENCE_TYPE:
                 # has side effects - converts ref type to INTERNAL w/
@@ -184,28 +539,57 @@ def _make_package(binder):
                 resource = _make_resource_from_inline(reference)
                 model.resources.append(resource)
                 resources[resource.id] = resource
-                with resource.open() as data:
-                    item = Item(resource.id, data, resource.media_type)
+                pattern = None
+                item = make_item(resource.id, resource.media_type,
+                                 lambda: resource.hash,
+                                 lambda: _LazyFile(resource.open))
                 items.append(item)
                 reference.bind(resource, '../resources/{}')
 
-            elif reference.remote_type == INTERNAL_REFERENCE_TYPE:
-                filename = os.path.basename(reference.uri)
-                resource = resources.get(filename)
-                if resource:
-                    reference.bind(resource, '../resources/{}')
+        items.append(make_document_item(model))
 
-        complete_content = bytes(HTMLFormatter(model))
-        item = Item(''.join([model.ident_hash, extensions[model.id]]),
-                    io.BytesIO(complete_content),
-                    model.media_type)
-        items.append(item)
+    # Collect the rendered documents, keeping the items in manifest order.
+    for item in items:
+        if hasattr(item.data, 'result'):
+            item.data = io.BytesIO(item.data.result())
 
     # Build the package.
     package = Package(package_name, items, binder.metadata)
     return package
 
 
+def _references_pattern(resources):
+    """A pattern of the names of the ``resources`` and of data uris,
+    to find them in the content of documents (see ``_may_reference``).
+    """
+    names = set([b'data:'])
+    for name in resources:
+        names.add(name.encode('utf-8'))
+        names.add(xml_escape(name, {'"': '&quot;'}).encode('utf-8'))
+    return re.compile(b'|'.join(re.escape(name) for name in names),
+                      re.IGNORECASE)
+
+
+def _may_reference(document, pattern):
+    """Whether the unparsed content of the ``document`` may have
+    references to resources or data uris, as found by the ``pattern``
+    (see ``_references_pattern``), without parsing it.
+    """
+    content = document._source
+    if content is None:
+        return True
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    return pattern.search(content) is not None
+
+
+def _render_document(wire):
+    """Renders a document or document pointer, after its references
+    have been bound, from its wire form (see ``models.model_to_wire``).
+    """
+    return bytes(HTMLFormatter(model_from_wire(wire)))
+
+
 def _make_resource_from_inline(reference):
     """Makes an ``models.Resource`` from a ``models.Reference``
        of type INLINE. That is, a data: uri"""
@@ -250,7 +634,7 @@ def _node_to_model(tree_or_item, package, parent=None,
             node = _node_to_model(item, package, parent=binder,
                                   lucent_id=lucent_id)
             if node.metadata['title'] != item['title']:
-                binder.set_title_for_node(node, item['title'])
+                binder.set_title_for_index(len(binder) - 1, item['title'])
         result = binder
     else:
         # It is a document.
@@ -325,30 +709,41 @@ class DocumentItem(Document):
 
         # Based on the reference list, make a best effort
         # to acquire resources.
-        resources = []
+        resources = {}
+        self.resources = []
         for ref in self.references:
             if ref.remote_type == 'external':
                 continue
             elif not ref.uri.find('../resources') >= 0:
                 continue
             name = os.path.basename(ref.uri)
-            try:
-                resource = adapt_item(package.grab_by_name(name), package)
-                ref.bind(resource, '../resources/{}')
-                resources.append(resource)
-            except KeyError:
-                # When resources are missing, the problem is pushed off
-                # to the rendering process, which will
-                # raise a missing reference exception when necessary.
-                pass
-        self.resources = resources
-
-
-def adapt_single_html(html):
+            resource = resources.get(name)
+            if resource is None:
+                try:
+                    resource = adapt_item(package.grab_by_name(name),
+                                          package)
+                except KeyError:
+                    # When resources are missing, the problem is pushed off
+                    # to the rendering process, which will
+                    # raise a missing reference exception when necessary.
+                    continue
+                resources[name] = resource
+                self.resources.append(resource)
+            ref.bind(resource, '../resources/{}')
+
+
+def adapt_single_html(html, id_map=None):
     """Adapts a single html document generated by
-    ``.formatters.SingleHTMLFormatter`` to a ``models.Binder``
+    ``.formatters.SingleHTMLFormatter`` to a ``models.Binder``.
+    The ``html`` may also be given as its parsed root element,
+    from which the pages are then moved into the documents.
+    When given a dictionary as ``id_map``, links are also fixed with
+    the ids in it, and it is filled with those of the pages.
     """
-    html_root = etree.fromstring(html)
+    if isinstance(html, etree._Element):
+        html_root = html
+    else:
+        html_root = etree.fromstring(html)
 
     metadata = parse_metadata(html_root.xpath('//*[@data-type="metadata"]')[0])
     id_ = metadata['cnx-archive-uri'] or 'book'
@@ -357,14 +752,139 @@ def adapt_single_html(html):
     nav_tree = parse_navigation_html_to_tree(html_root, id_)
 
     body = html_root.xpath('//xhtml:body', namespaces=HTML_DOCUMENT_NAMESPACES)
-    _adapt_single_html_tree(binder, body[0], nav_tree, top_metadata=metadata)
+    _adapt_single_html_tree(binder, body[0], nav_tree, top_metadata=metadata,
+                            id_map=id_map)
+
+    return binder
+
+
+def adapt_single_html_file(file, id_map=None):
+    """Adapts a single html document generated by
+    ``.formatters.SingleHTMLFormatter``, read from ``file``
+    (a binary file-like object or file-path), to a ``models.Binder``.
+    The ``id_map`` is used as in ``adapt_single_html``.
+
+    Unlike ``adapt_single_html``, the document is parsed incrementally.
+    Each page is adapted once it has been parsed and is then dropped
+    from the parsed tree, as are units and chapters once adapted.
+    The pages are kept as their content (see ``models.Document.unload``)
+    and are parsed one at a time again to fix their links, so only
+    the tree of a single page is held in memory at once.
+    The document must be well-formed XML.
+    """
+    # A dictionary to allow look up of a document and new id using the old
+    # html element id
+    if id_map is None:
+        id_map = {}
+    # The body, units and chapters being parsed, innermost last
+    frames = []
+    binder = None
+
+    def make_binder():
+        """Make the binder of the innermost frame, once its metadata
+        and title (which precede its units, chapters and pages) are parsed.
+        """
+        frame = frames[-1]
+        if frame.binder is not None:
+            return frame.binder
+        if len(frames) == 1:
+            html_root = frame.elem.getroottree().getroot()
+            metadata = parse_metadata(
+                html_root.xpath('//*[@data-type="metadata"]')[0])
+            id_ = metadata['cnx-archive-uri'] or 'book'
+            frame.top_metadata = metadata
+            frame.start(Binder(id_, metadata=metadata),
+                        parse_navigation_html_to_tree(html_root, id_))
+        else:
+            parent = frames[-2]
+            frame.top_metadata = parent.top_metadata
+            nav_entry = next(parent.nav_entries, None)
+            if nav_entry is None:
+                raise AdaptationError('Nav TOC does not match HTML structure')
+            frame.start(_adapt_single_html_binder(parent.binder, frame.elem,
+                                                  frame.top_metadata),
+                        nav_entry)
+        return frame.binder
+
+    for event, elem in etree.iterparse(file, events=('start', 'end')):
+        if not frames:
+            if event == 'start' and etree.QName(elem).localname == 'body':
+                frames.append(_SingleHTMLFrame(elem))
+            continue
+        frame = frames[-1]
+        if event == 'start':
+            if elem.getparent() is not frame.elem:
+                continue
+            data_type = elem.get('data-type')
+            if data_type in _BINDER_DATA_TYPES:
+                make_binder()
+                frames.append(_SingleHTMLFrame(elem))
+            elif data_type in _PAGE_DATA_TYPES:
+                make_binder()
+            elif (data_type == 'document-title' and len(frames) > 1 and
+                    frame.binder is None):
+                # The title of a unit or chapter, which is taken out of
+                # the tree as its binder is made.
+                pass
+            elif data_type not in ['metadata', None]:
+                raise AdaptationError('Unknown data-type for child node')
+        elif elem is frame.elem:
+            # The end of the body, a unit or a chapter
+            binder = make_binder()
+            _set_title_overrides(binder, frame.title_overrides)
+            frames.pop()
+            if not frames:
+                break
+            frames[-1].binder.append(binder)
+            frames[-1].elem.remove(elem)
+        elif (elem.getparent() is frame.elem and
+              elem.get('data-type') in _PAGE_DATA_TYPES):
+            next(frame.nav_entries, None)
+            # Moves the page out of the parsed tree.
+            document = _adapt_single_html_page(frame.binder, elem,
+                                               frame.top_metadata)
+            frame.binder.append(document)
+            _fix_generated_ids(document, id_map)  # also populates id_map
+            document.unload()
+
+    if binder is None:
+        raise AdaptationError('No body found in the single html')
+
+    # only fixup links after all pages
+    # processed for whole book, to allow for foward links
+    for page in flatten_to_documents(binder):
+        _fix_links(page, id_map)
+        page.unload()
 
     return binder
 
 
+class _SingleHTMLFrame(object):
+    """The state of adapting the body, a unit or a chapter
+    in ``adapt_single_html_file``.
+    """
+
+    def __init__(self, elem):
+        self.elem = elem
+        self.binder = None
+        self.top_metadata = None
+
+    def start(self, binder, nav_tree):
+        self.binder = binder
+        self.title_overrides = [i.get('title') for i in nav_tree['contents']]
+        # The navigation entries, consumed in step with the children of elem
+        self.nav_entries = iter(nav_tree['contents'])
+
+
+_BINDER_DATA_TYPES = ('unit', 'chapter', 'composite-chapter',)
+_PAGE_DATA_TYPES = ('page', 'composite-page',)
+
+
 def _adapt_single_html_tree(parent, elem, nav_tree, top_metadata,
                             id_map=None, depth=0):
     title_overrides = [i.get('title') for i in nav_tree['contents']]
+    # The navigation entries, consumed in step with the children of elem
+    nav_entries = iter(nav_tree['contents'])
 
     # A dictionary to allow look up of a document and new id using the old html
     # element id
@@ -372,207 +892,238 @@ def _adapt_single_html_tree(parent, elem, nav_tree, top_metadata,
     if id_map is None:
         id_map = {}
 
-    def fix_generated_ids(page, id_map):
-        """Fix element ids (remove auto marker) and populate id_map."""
-
-        content = content_to_etree(page.content)
-
-        new_ids = set()
-        suffix = 0
-        for element in content.xpath('.//*[@id]'):
-            id_val = element.get('id')
-            if id_val.startswith('auto_'):
-                new_val = id_val.split('_', 2)[-1]
-                # Did content from different pages w/ same original id
-                # get moved to the same page?
-                if new_val in new_ids:
-                    while (new_val + str(suffix)) in new_ids:
-                        suffix += 1
-                    new_val = new_val + str(suffix)
-            else:
-                new_val = id_val
-            new_ids.add(new_val)
-            element.set('id', new_val)
-            id_map['#{}'.format(id_val)] = (page, new_val)
-
-        id_map['#{}'.format(page.id)] = (page, '')
-        if page.id and '@' in page.id:
-            id_map['#{}'.format(page.id.split('@')[0])] = (page, '')
-
-        page.content = etree_to_content(content)
-
-    def fix_links(page, id_map):
-        """Remap all intra-book links, replace with value from id_map."""
-
-        content = content_to_etree(page.content)
-        for i in content.xpath('.//*[starts-with(@href, "#")]',
-                               namespaces=HTML_DOCUMENT_NAMESPACES):
-            ref_val = i.attrib['href']
-            if ref_val in id_map:
-                target_page, target = id_map[ref_val]
-                if page == target_page:
-                        i.attrib['href'] = '#{}'.format(target)
-                else:
-                    target_id = target_page.id.split('@')[0]
-                    if not target:  # link to page
-                        i.attrib['href'] = '/contents/{}'.format(target_id)
-                    else:
-                        i.attrib['href'] = '/contents/{}#{}'.format(
-                            target_id, target)
-            else:
-                logger.error('Bad href: {}'.format(ref_val))
-
-        page.content = etree_to_content(content)
-
-    def _compute_id(p, elem, key):
-        """Compute id and shortid from parent uuid and child attr"""
-        p_ids = [p.id.split('@')[0]]
-        if 'cnx-archive-uri' in p.metadata and p.metadata['cnx-archive-uri']:
-            p_ids.insert(0, p.metadata['cnx-archive-uri'].split('@')[0])
-
-        for p_id in p_ids:
-            try:
-                p_uuid = uuid.UUID(p_id)
-                break
-            except ValueError:
-                pass
-        else:  # Punt - no parent uuid, make one up for child
-            return str(uuid.uuid4())
-
-        uuid_key = elem.get('data-uuid-key', elem.get('class', key))
-        if (sys.version_info.major == 2):  # https://bugs.python.org/issue34145
-            uuid_key = uuid_key.encode('utf-8')
-        return str(uuid.uuid5(p_uuid, uuid_key))
-
-    def _compute_shortid(ident_hash):
-        """Compute shortId from uuid or ident_hash"""
-        ver = None
-        if '@' in ident_hash:
-            (id_str, ver) = ident_hash.split('@')
-        else:
-            id_str = ident_hash
-        try:
-            id_uuid = uuid.UUID(id_str)
-        except ValueError:
-            # id is not a uuid, no shortid
-            return None
-
-        shortid = (base64.urlsafe_b64encode(id_uuid.bytes)[:8]).decode('utf-8')
-        if ver:
-            return '@'.join((shortid, ver))
-        else:
-            return shortid
-
     # Adapt each <div data-type="unit|chapter|page|composite-page"> into
     # translucent binders, documents and composite documents
     for child in elem.getchildren():
         data_type = child.attrib.get('data-type')
 
-        if data_type in ('unit', 'chapter', 'composite-chapter',
-                         'page', 'composite-page'):
-            try:
-                # metadata munging for all node types, in one place
-                metadata = parse_metadata(
-                        child.xpath('./*[@data-type="metadata"]')[0])
-            except ValueError:
-                logger.exception(
-                    'Error when parsing metadata for {} (id: {}, parent: "{}")'
-                    .format(data_type, child.attrib.get('id'),
-                            parent.metadata.get('title')))
-                raise
-            except IndexError:
-                logger.exception(
-                    'Metadata (data-type="metadata") not found:\n{}...'
-                    .format(etree.tostring(child).decode('utf-8')[:800]))
-                raise
-
-            # Handle version, id and uuid from metadata
-            if not metadata.get('version'):
-                if data_type.startswith('composite-'):
-                    if top_metadata.get('version') is not None:
-                        metadata['version'] = top_metadata['version']
-                elif parent.metadata.get('version') is not None:
-                    metadata['version'] = parent.metadata['version']
-
-            uuid_key = child.get('data-uuid-key')
-            child_id = child.attrib.get('id')
-            id_ = metadata.get('cnx-archive-uri') or (child_id
-                                                      if not uuid_key
-                                                      else None)
-            if not id_:
-                id_ = _compute_id(parent, child, metadata.get('title'))
-                if metadata.get('version'):
-                    metadata['cnx-archive-uri'] = \
-                        '@'.join((id_, metadata['version']))
-                else:
-                    metadata['cnx-archive-uri'] = id_
-                metadata['cnx-archive-shortid'] = None
-
-            if (metadata.get('cnx-archive-uri') and
-                    not metadata.get('cnx-archive-shortid')):
-                metadata['cnx-archive-shortid'] = \
-                        _compute_shortid(metadata['cnx-archive-uri'])
-
-            shortid = metadata.get('cnx-archive-shortid')
-
-        if data_type in ['unit', 'chapter', 'composite-chapter']:
+        if data_type in _BINDER_DATA_TYPES:
             # All the non-leaf node types
-            title = lxml.html.HtmlElement(
-                        child.xpath('*[@data-type="document-title"]',
-                                    namespaces=HTML_DOCUMENT_NAMESPACES)[0]
-                        ).text_content().strip()
-            metadata.update({'title': title,
-                             'id': id_,
-                             'shortId': shortid,
-                             'type': data_type})
-            binder = Binder(id_, metadata=metadata)
+            binder = _adapt_single_html_binder(parent, child, top_metadata)
+            nav_entry = next(nav_entries, None)
+            if nav_entry is None:
+                raise AdaptationError('Nav TOC does not match HTML structure')
             # Recurse
-            _adapt_single_html_tree(binder, child,
-                                    nav_tree['contents'].pop(0),
+            _adapt_single_html_tree(binder, child, nav_entry,
                                     top_metadata=top_metadata,
                                     id_map=id_map, depth=depth+1)
             parent.append(binder)
-        elif data_type in ['page', 'composite-page']:
+        elif data_type in _PAGE_DATA_TYPES:
             # Leaf nodes
-            nav_tree['contents'].pop(0)
-            metadata_nodes = child.xpath("*[@data-type='metadata']",
-                                         namespaces=HTML_DOCUMENT_NAMESPACES)
-            for node in metadata_nodes:
-                child.remove(node)
-            for key in child.keys():
-                if key in ('itemtype', 'itemscope'):
-                    child.attrib.pop(key)
-
-            document_body = content_to_etree('')
-            document_body.append(child)
-            contents = etree.tostring(document_body)
-            model = {
-                'page': Document,
-                'composite-page': CompositeDocument,
-                }[child.attrib['data-type']]
-
-            document = model(id_, contents, metadata=metadata)
+            next(nav_entries, None)
+            document = _adapt_single_html_page(parent, child, top_metadata)
             parent.append(document)
 
-            fix_generated_ids(document, id_map)  # also populates id_map
+            _fix_generated_ids(document, id_map)  # also populates id_map
         elif data_type in ['metadata', None]:
             # Expected non-nodal child types
             pass
         else:  # Fall through - child is not a defined type
             raise AdaptationError('Unknown data-type for child node')
 
-    # Assign title overrides
+    _set_title_overrides(parent, title_overrides)
+
+    # only fixup links after all pages
+    # processed for whole book, to allow for foward links
+    if depth == 0:
+        for page in flatten_to_documents(parent):
+            _fix_links(page, id_map)
+
+
+def _adapt_single_html_binder(parent, child, top_metadata):
+    """Adapts a unit or chapter element to a binder, without its contents."""
+    data_type = child.attrib.get('data-type')
+    metadata, id_, shortid = _adapt_single_html_metadata(parent, child,
+                                                         top_metadata)
+    title = lxml.html.HtmlElement(
+                child.xpath('*[@data-type="document-title"]',
+                            namespaces=HTML_DOCUMENT_NAMESPACES)[0]
+                ).text_content().strip()
+    metadata.update({'title': title,
+                     'id': id_,
+                     'shortId': shortid,
+                     'type': data_type})
+    return Binder(id_, metadata=metadata)
+
+
+def _adapt_single_html_page(parent, child, top_metadata):
+    """Adapts a page or composite page element to a document,
+    moving the element into the document.
+    """
+    metadata, id_, shortid = _adapt_single_html_metadata(parent, child,
+                                                         top_metadata)
+    metadata_nodes = child.xpath("*[@data-type='metadata']",
+                                 namespaces=HTML_DOCUMENT_NAMESPACES)
+    for node in metadata_nodes:
+        child.remove(node)
+    for key in child.keys():
+        if key in ('itemtype', 'itemscope'):
+            child.attrib.pop(key)
+
+    # Move the page into its own body, which the document
+    # then works on directly.
+    document_body = content_to_etree('')
+    document_body.append(child)
+    etree.cleanup_namespaces(document_body)
+    model = {
+        'page': Document,
+        'composite-page': CompositeDocument,
+        }[child.attrib['data-type']]
+
+    return model(id_, document_body, metadata=metadata)
+
+
+def _adapt_single_html_metadata(parent, child, top_metadata):
+    """Parses the metadata of a unit, chapter or page element,
+    filling in the version, id and short id when missing.
+    Returns the metadata, id and short id.
+    """
+    data_type = child.attrib.get('data-type')
+    try:
+        # metadata munging for all node types, in one place
+        metadata = parse_metadata(
+                child.xpath('./*[@data-type="metadata"]')[0])
+    except ValueError:
+        logger.exception(
+            'Error when parsing metadata for {} (id: {}, parent: "{}")'
+            .format(data_type, child.attrib.get('id'),
+                    parent.metadata.get('title')))
+        raise
+    except IndexError:
+        logger.exception(
+            'Metadata (data-type="metadata") not found:\n{}...'
+            .format(etree.tostring(child).decode('utf-8')[:800]))
+        raise
+
+    # Handle version, id and uuid from metadata
+    if not metadata.get('version'):
+        if data_type.startswith('composite-'):
+            if top_metadata.get('version') is not None:
+                metadata['version'] = top_metadata['version']
+        elif parent.metadata.get('version') is not None:
+            metadata['version'] = parent.metadata['version']
+
+    uuid_key = child.get('data-uuid-key')
+    child_id = child.attrib.get('id')
+    id_ = metadata.get('cnx-archive-uri') or (child_id
+                                              if not uuid_key
+                                              else None)
+    if not id_:
+        id_ = _compute_id(parent, child, metadata.get('title'))
+        if metadata.get('version'):
+            metadata['cnx-archive-uri'] = \
+                '@'.join((id_, metadata['version']))
+        else:
+            metadata['cnx-archive-uri'] = id_
+        metadata['cnx-archive-shortid'] = None
+
+    if (metadata.get('cnx-archive-uri') and
+            not metadata.get('cnx-archive-shortid')):
+        metadata['cnx-archive-shortid'] = \
+                _compute_shortid(metadata['cnx-archive-uri'])
+
+    shortid = metadata.get('cnx-archive-shortid')
+    return metadata, id_, shortid
+
+
+def _set_title_overrides(parent, title_overrides):
+    """Assign title overrides"""
     if len(parent) != len(title_overrides):
         logger.error('Skipping title overrides -'
                      'mismatched numbers: parent: {}, titles: {}'.format(
                          len(parent), len(title_overrides)))
         raise AdaptationError('Nav TOC does not match HTML structure')
 
-    for i, node in enumerate(parent):
-        parent.set_title_for_node(node, title_overrides[i])
+    for i, title in enumerate(title_overrides):
+        parent.set_title_for_index(i, title)
 
-    # only fixup links after all pages
-    # processed for whole book, to allow for foward links
-    if depth == 0:
-        for page in flatten_to_documents(parent):
-            fix_links(page, id_map)
+
+def _fix_generated_ids(page, id_map):
+    """Fix element ids (remove auto marker) and populate id_map."""
+
+    content = page._xml
+
+    new_ids = set()
+    suffix = 0
+    for element in content.xpath('.//*[@id]'):
+        id_val = element.get('id')
+        if id_val.startswith('auto_'):
+            new_val = id_val.split('_', 2)[-1]
+            # Did content from different pages w/ same original id
+            # get moved to the same page?
+            if new_val in new_ids:
+                while (new_val + str(suffix)) in new_ids:
+                    suffix += 1
+                new_val = new_val + str(suffix)
+        else:
+            new_val = id_val
+        new_ids.add(new_val)
+        element.set('id', new_val)
+        id_map['#{}'.format(id_val)] = (page, new_val)
+
+    id_map['#{}'.format(page.id)] = (page, '')
+    if page.id and '@' in page.id:
+        id_map['#{}'.format(page.id.split('@')[0])] = (page, '')
+
+
+def _fix_links(page, id_map):
+    """Remap all intra-book links, replace with value from id_map."""
+
+    content = page._xml
+    for i in content.xpath('.//*[starts-with(@href, "#")]',
+                           namespaces=HTML_DOCUMENT_NAMESPACES):
+        ref_val = i.attrib['href']
+        if ref_val in id_map:
+            target_page, target = id_map[ref_val]
+            if page == target_page:
+                    i.attrib['href'] = '#{}'.format(target)
+            else:
+                target_id = target_page.id.split('@')[0]
+                if not target:  # link to page
+                    i.attrib['href'] = '/contents/{}'.format(target_id)
+                else:
+                    i.attrib['href'] = '/contents/{}#{}'.format(
+                        target_id, target)
+        else:
+            logger.error('Bad href: {}'.format(ref_val))
+
+
+def _compute_id(p, elem, key):
+    """Compute id and shortid from parent uuid and child attr"""
+    p_ids = [p.id.split('@')[0]]
+    if 'cnx-archive-uri' in p.metadata and p.metadata['cnx-archive-uri']:
+        p_ids.insert(0, p.metadata['cnx-archive-uri'].split('@')[0])
+
+    for p_id in p_ids:
+        try:
+            p_uuid = uuid.UUID(p_id)
+            break
+        except ValueError:
+            pass
+    else:  # Punt - no parent uuid, make one up for child
+        return str(uuid.uuid4())
+
+    uuid_key = elem.get('data-uuid-key', elem.get('class', key))
+    if (sys.version_info.major == 2):  # https://bugs.python.org/issue34145
+        uuid_key = uuid_key.encode('utf-8')
+    return str(uuid.uuid5(p_uuid, uuid_key))
+
+
+def _compute_shortid(ident_hash):
+    """Compute shortId from uuid or ident_hash"""
+    ver = None
+    if '@' in ident_hash:
+        (id_str, ver) = ident_hash.split('@')
+    else:
+        id_str = ident_hash
+    try:
+        id_uuid = uuid.UUID(id_str)
+    except ValueError:
+        # id is not a uuid, no shortid
+        return None
+
+    shortid = (base64.urlsafe_b64encode(id_uuid.bytes)[:8]).decode('utf-8')
+    if ver:
+        return '@'.join((shortid, ver))
+    else:
+        return shortid
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Benchmarks of the library's main operations, run as modules
+(e.g. ``python -m cnxepub.benchmarks.packaging``). The suite of
+them all is run with ``python -m cnxepub.benchmarks``.
+"""
+import base64
+import io
+import json
+from contextlib import contextmanager
+from timeit import default_timer
+
+from ..formatters import exercise_callback_factory
+from ..models import Binder, TranslucentBinder, Document, Resource
+
+
+__all__ = (
+    'make_binder', 'make_includes', 'timer',
+    )
+
+
+# A 1x1 pixel png
+PNG = base64.b64decode(
+    b'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9Q'
+    b'DwADhgGAWjR9awAAAABJRU5ErkJggg==')
+PAGE_CONTENT = u"""\
+<body xmlns="http://www.w3.org/1999/xhtml">
+  <h1>{title}</h1>
+  {paragraphs}
+</body>"""
+PARAGRAPH = u"""\
+<p id="p{index}">Paragraph {index} refers to
+  <a href="#p{index}">itself</a> and shows
+  <img src="../resources/{resource}" alt="image {index}"/>.</p>"""
+EXERCISE = u"""\
+<p id="e{index}"><a href="#ost/api/ex/{code}">[link]</a></p>"""
+EXERCISE_MATCH = '#ost/api/ex/'
+# The exercise every exercise link is replaced with
+# by the includes of ``make_includes``.
+EXERCISE_JSON = json.dumps({
+    'total_count': 1,
+    'items': [{
+        'stimulus_html': 'Consider a synthetic book.',
+        'questions': [{
+            'stem_html': 'How many pages does it have?',
+            'formats': ['multiple-choice'],
+            'answers': [
+                {'content_html': 'One', 'correctness': '0.0'},
+                {'content_html': 'Many', 'correctness': '1.0'},
+                ],
+            }],
+        }],
+    })
+
+
+def make_binder(chapters=10, pages=10, references=10, resources=5,
+                depth=1, exercises=0):
+    """Make a synthetic ``Binder`` of ``chapters`` chapters,
+    each containing ``pages`` pages. Every page has ``references``
+    paragraphs that link to themselves and reference one of
+    the ``resources`` images attached to the binder,
+    followed by ``exercises`` exercise links (see ``make_includes``).
+    Chapters are nested within ``depth - 1`` levels of units.
+    """
+    binder_resources = [
+        Resource('image-{}.png'.format(i), io.BytesIO(PNG), 'image/png',
+                 filename='image-{}.png'.format(i))
+        for i in range(resources)]
+    # With the publication metadata, so the epub of it can be read.
+    binder = Binder('book', metadata={'title': 'Book',
+                                      'license_url': 'http://my.license',
+                                      'version': '1',
+                                      'publisher': 'Benchmarks',
+                                      'publication_message': 'Synthetic'},
+                    resources=binder_resources)
+    for c in range(chapters):
+        chapter = TranslucentBinder(
+            metadata={'title': 'Chapter {}'.format(c)})
+        for p in range(pages):
+            title = 'Page {}.{}'.format(c, p)
+            paragraphs = [
+                PARAGRAPH.format(index=i,
+                                 resource='image-{}.png'.format(
+                                     i % max(resources, 1)))
+                for i in range(references)]
+            paragraphs.extend(
+                EXERCISE.format(index=i, code='ex-{}-{}-{}'.format(c, p, i))
+                for i in range(exercises))
+            content = PAGE_CONTENT.format(title=title,
+                                          paragraphs=u'\n'.join(paragraphs))
+            chapter.append(Document(
+                'page-{}-{}'.format(c, p), content.encode('utf-8'),
+                metadata={'title': title, 'version': '1',
+                          'license_url': 'http://my.license'}))
+        node = chapter
+        for level in range(depth - 1, 0, -1):
+            node = TranslucentBinder(
+                [node], metadata={'title': 'Unit {}.{}'.format(c, level)})
+        binder.append(node)
+    return binder
+
+
+class _ExerciseStore(object):
+    """Stands in for the memcache client of
+    ``exercise_callback_factory``, holding the same exercise
+    under every key, so that nothing is fetched.
+    """
+
+    def get(self, key):
+        return EXERCISE_JSON
+
+    def set(self, key, value):
+        pass
+
+
+def make_includes():
+    """Make the ``SingleHTMLFormatter`` includes that replace
+    the exercise links of ``make_binder`` with an exercise.
+    """
+    return [exercise_callback_factory(
+        EXERCISE_MATCH, 'http://localhost/api/exercises?q=tag:{itemCode}',
+        _ExerciseStore())]
+
+
+@contextmanager
+def timer(results, name):
+    """Record the seconds spent in the block as ``results[name]``."""
+    start = default_timer()
+    yield
+    results[name] = default_timer() - start
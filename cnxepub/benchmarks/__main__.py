@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import sys
+
+from .suite import main
+
+
+sys.exit(main())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Measures the time spent in each stage of collation, passing the
+single html between the stages as bytes and as a tree.
+Requires the 'collation' extra requirements.
+"""
+from __future__ import print_function
+import argparse
+import io
+import sys
+
+from . import make_binder, timer
+from ..adapters import adapt_single_html
+from ..collation import bake, easybake, reconstitute, _as_parsed
+from ..formatters import SingleHTMLFormatter
+
+
+RULESET = b"""\
+div[data-type='page'] p { class: baked; }
+div[data-type='page'] p::after {
+  content: "baked";
+  container: span;
+}
+div[data-type='page'] img { copy-to: figures; }
+div[data-type='chapter']::after {
+  content: pending(figures);
+  container: div;
+  class: figures;
+}
+"""
+
+
+def collate_bytes(binder, ruleset, results):
+    with timer(results, 'format'):
+        raw_html = io.BytesIO(bytes(SingleHTMLFormatter(binder)))
+    with timer(results, 'bake'):
+        collated_html = io.BytesIO()
+        easybake(ruleset, raw_html, collated_html)
+    with timer(results, 'adapt'):
+        collated_html.seek(0)
+        reconstitute(collated_html)
+
+
+def collate_tree(binder, ruleset, results):
+    with timer(results, 'format'):
+        html = SingleHTMLFormatter(binder).to_tree()
+    with timer(results, 'bake'):
+        bake(ruleset, html)
+        _as_parsed(html)
+    with timer(results, 'adapt'):
+        adapt_single_html(html)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--chapters', type=int, default=20,
+                        help='Number of chapters')
+    parser.add_argument('-p', '--pages', type=int, default=10,
+                        help='Pages per chapter')
+    parser.add_argument('-r', '--references', type=int, default=20,
+                        help='References per page')
+    parser.add_argument('--ruleset', type=argparse.FileType('rb'),
+                        help='Ruleset CSS to bake with')
+    args = parser.parse_args(argv)
+    ruleset = args.ruleset.read() if args.ruleset else RULESET
+
+    print('pipeline\tformat\tbake\tadapt\ttotal')
+    for name, collate in (('bytes', collate_bytes), ('tree', collate_tree)):
+        binder = make_binder(args.chapters, args.pages, args.references)
+        results = {}
+        collate(binder, ruleset, results)
+        stages = [results[stage] for stage in ('format', 'bake', 'adapt')]
+        print('\t'.join([name] + ['{:.3f}'.format(t)
+                                  for t in stages + [sum(stages)]]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
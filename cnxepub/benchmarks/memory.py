@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Measures the memory held by the models of a synthetic binder,
+per page and per reference. Only what Python allocates is traced,
+not the trees libxml2 holds for the pages, and only on Python 3,
+where allocations can be traced.
+
+For comparison, the same is reported for the models as they were
+before ``__slots__``, by swapping the documents and references for
+stand-ins that hold the same attributes in a ``__dict__``.
+"""
+from __future__ import print_function
+import argparse
+import gc
+import sys
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+from . import make_binder
+from ..models import flatten_to_documents, _parse_references
+
+
+class _DictBacked(object):
+    """Stand-in for a model instance without ``__slots__``,
+    holding the attributes of ``model`` in a ``__dict__``.
+    """
+
+    def __init__(self, model):
+        for name in _slot_names(type(model)):
+            if hasattr(model, name):
+                setattr(self, name, getattr(model, name))
+
+
+def _slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        names.extend(name for name in getattr(klass, '__slots__', ())
+                     if name != '__weakref__')
+    return names
+
+
+def _slotted_copy(model):
+    """Copy of ``model`` sharing its attribute values."""
+    copy = type(model).__new__(type(model))
+    for name in _slot_names(type(model)):
+        if hasattr(model, name):
+            setattr(copy, name, getattr(model, name))
+    return copy
+
+
+def _instances_size(models, make):
+    """Bytes allocated by ``make``-ing an instance for each of the
+    ``models``, whose attribute values are shared rather than copied.
+    """
+    gc.collect()
+    start = tracemalloc.get_traced_memory()[0]
+    instances = [make(model) for model in models]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - start
+    del instances
+    return size
+
+
+def measure(chapters, pages, references):
+    """Returns the bytes held per page by a binder of ``chapters``
+    chapters of ``pages`` pages each, with ``references`` paragraphs
+    per page, and the bytes held per reference in its pages.
+    These are followed by the same with dict-backed documents and
+    references (see ``_DictBacked``) in place of the slotted ones.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        binder = make_binder(chapters, pages, references)
+        documents = list(flatten_to_documents(binder))
+        gc.collect()
+        binder_size = tracemalloc.get_traced_memory()[0] - start
+
+        # Parse the references of every page again, keeping them
+        # alongside the pages' own.
+        start = tracemalloc.get_traced_memory()[0]
+        parsed = [_parse_references(document._xml)
+                  for document in documents]
+        gc.collect()
+        references_size = tracemalloc.get_traced_memory()[0] - start
+
+        # The rest of what the models hold is the same either way.
+        refs = [ref for page_refs in parsed for ref in page_refs]
+        documents_saving = (_instances_size(documents, _DictBacked) -
+                            _instances_size(documents, _slotted_copy))
+        references_saving = (_instances_size(refs, _DictBacked) -
+                             _instances_size(refs, _slotted_copy))
+    finally:
+        tracemalloc.stop()
+    # The pages hold as many references of their own as were parsed.
+    page_count = float(len(documents))
+    reference_count = float(max(len(refs), 1))
+    per_page = binder_size / page_count
+    per_reference = references_size / reference_count
+    return (per_page, per_reference,
+            per_page + (documents_saving + references_saving) / page_count,
+            per_reference + references_saving / reference_count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--chapters', type=int, default=50,
+                        help='Number of chapters')
+    parser.add_argument('-p', '--pages', type=int, default=100,
+                        help='Pages per chapter')
+    parser.add_argument('-r', '--references', type=int, default=20,
+                        help='Paragraphs, each with two references, '
+                             'per page')
+    args = parser.parse_args(argv)
+
+    if tracemalloc is None:
+        print('Memory cannot be traced on Python {}.'
+              .format(sys.version.split()[0]), file=sys.stderr)
+        return 1
+    sizes = measure(args.chapters, args.pages, args.references)
+    print('models\tpages\treferences\tbytes per page\tbytes per reference')
+    pages = args.chapters * args.pages
+    for models, (per_page, per_reference) in (('__slots__', sizes[:2]),
+                                              ('__dict__', sizes[2:])):
+        print('{}\t{}\t{}\t{:.0f}\t{:.0f}'.format(
+            models, pages, pages * args.references * 2,
+            per_page, per_reference))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
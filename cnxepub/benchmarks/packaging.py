@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Measures the cost of packaging binders of increasing size.
+The cost per page plus reference should stay level as the size grows.
+"""
+from __future__ import print_function
+import argparse
+import sys
+
+from . import make_binder, timer
+from ..adapters import _make_package
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--chapters', type=int, nargs='+',
+                        default=[5, 10, 20, 40],
+                        help='Numbers of chapters to benchmark')
+    parser.add_argument('-p', '--pages', type=int, default=10,
+                        help='Pages per chapter')
+    parser.add_argument('-r', '--references', type=int, default=20,
+                        help='References per page')
+    args = parser.parse_args(argv)
+
+    print('pages\treferences\tseconds\tus per page+reference')
+    for chapters in args.chapters:
+        binder = make_binder(chapters, args.pages, args.references)
+        results = {}
+        with timer(results, 'package'):
+            _make_package(binder)
+        pages = chapters * args.pages
+        references = pages * args.references * 2
+        print('{}\t{}\t{:.3f}\t{:.1f}'.format(
+            pages, references, results['package'],
+            results['package'] * 1e6 / (pages + references)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
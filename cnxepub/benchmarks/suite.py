@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""Times the library's main entry points on a synthetic book and
+records their throughput and peak memory as JSON, to be compared
+across commits. The peak memory is what python allocates (not the
+trees libxml2 holds) and is measured in a run of its own, as tracing
+slows the timed runs.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+from . import make_binder, make_includes
+from ..adapters import adapt_package, adapt_single_html, make_epub
+from ..epub import EPUB
+from ..formatters import SingleHTMLFormatter
+
+
+def measure(func, repeat=1):
+    """Call ``func`` ``repeat`` times, and once more while tracing
+    memory allocations. Returns the fastest time in seconds and the
+    peak of traced memory in bytes (None when it cannot be traced).
+    """
+    seconds = None
+    for i in range(repeat):
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def _read_epub(filepath):
+    epub = EPUB.from_file(filepath)
+    # Remove the directory the epub was extracted to.
+    shutil.rmtree(epub._root)
+    return epub
+
+
+def run(chapters=20, pages=10, references=20, resources=5, depth=1,
+        exercises=2, repeat=3):
+    """Benchmark each entry point on a binder made by ``make_binder``
+    with the given arguments. Returns the results by entry point,
+    each with its ``seconds``, ``pages_per_second`` and ``peak_bytes``,
+    or None for those that cannot be run (i.e. collation without
+    the 'collation' extra requirements).
+    """
+    binder = make_binder(chapters, pages, references, resources, depth,
+                         exercises)
+    page_count = chapters * pages
+    directory = tempfile.mkdtemp('-benchmarks')
+    epub = None
+    try:
+        epub_filepath = os.path.join(directory, 'book.epub')
+        make_epub(binder, epub_filepath)
+        epub = EPUB.from_file(epub_filepath)
+        html = bytes(SingleHTMLFormatter(binder, includes=make_includes()))
+
+        def collate():
+            from ..collation import collate
+            from .collation import RULESET
+            collate(binder, RULESET, includes=make_includes())
+
+        entry_points = [
+            ('make_epub', lambda: make_epub(binder, epub_filepath)),
+            ('EPUB.from_file', lambda: _read_epub(epub_filepath)),
+            ('adapt_package', lambda: adapt_package(epub[0])),
+            ('SingleHTMLFormatter',
+             lambda: bytes(SingleHTMLFormatter(binder,
+                                               includes=make_includes()))),
+            ('adapt_single_html', lambda: adapt_single_html(html)),
+            ('collate', collate),
+            ]
+        results = {}
+        for name, func in entry_points:
+            try:
+                seconds, peak = measure(func, repeat)
+            except ImportError:
+                results[name] = None
+                continue
+            results[name] = {
+                'seconds': seconds,
+                'pages_per_second': page_count / seconds,
+                'peak_bytes': peak,
+                }
+    finally:
+        shutil.rmtree(directory)
+        if epub is not None:
+            shutil.rmtree(epub._root)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--chapters', type=int, default=20,
+                        help='Number of chapters')
+    parser.add_argument('-p', '--pages', type=int, default=10,
+                        help='Pages per chapter')
+    parser.add_argument('-r', '--references', type=int, default=20,
+                        help='References per page')
+    parser.add_argument('--resources', type=int, default=5,
+                        help='Images referenced by the pages')
+    parser.add_argument('-d', '--depth', type=int, default=1,
+                        help='Levels of units and chapters above the pages')
+    parser.add_argument('-e', '--exercises', type=int, default=2,
+                        help='Exercises per page')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Runs to take the fastest time of')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='JSON file to write (default stdout)')
+    args = parser.parse_args(argv)
+
+    from .. import __version__
+    try:
+        parameters = dict((name, getattr(args, name))
+                          for name in ('chapters', 'pages', 'references',
+                                       'resources', 'depth', 'exercises',
+                                       'repeat'))
+        results = run(**parameters)
+        report = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'parameters': parameters,
+            'results': results,
+            }
+        json.dump(report, args.output, indent=2, sort_keys=True)
+        args.output.write('\n')
+    finally:
+        if args.output is not sys.stdout:
+            args.output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,10 +6,17 @@
 # See LICENCE.txt for details.
 # ###
 from __future__ import print_function
-import io
+import hashlib
+import os
+import tempfile
 import warnings
+from copy import deepcopy
 
 from lxml import etree
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 try:
     from cnxeasybake import Oven
 except ImportError:
@@ -20,8 +27,10 @@ except ImportError:
                   ImportWarning)
     raise
 
-from .adapters import adapt_single_html
+from .adapters import adapt_single_html, adapt_single_html_file
 from .formatters import SingleHTMLFormatter
+from .html_parsers import HTML_DOCUMENT_NAMESPACES
+from .models import Binder, flatten_to_documents
 
 
 # XXX (1-Mar-2016) Not the final resting place.
@@ -34,13 +43,48 @@ def easybake(ruleset, in_html, out_html):
 
     """
     html = etree.parse(in_html)
+    bake(ruleset, html)
+    out_html.write(etree.tostring(html))
+
+
+def bake(ruleset, html):
+    """Bakes ``html``, an lxml element or element tree, in place
+    with ``ruleset``, a string containing the ruleset CSS.
+    """
     oven = Oven(ruleset)
     oven.bake(html)
-    out_html.write(etree.tostring(html))
 
 
-def reconstitute(html):
-    """Given a file-like object as ``html``, reconstruct it into models."""
+def _as_parsed(html):
+    """Make the baked ``html`` tree the same as it would be after
+    serializing and parsing it: elements made without a namespace take
+    the default namespace of their parent and empty text is dropped.
+    """
+    for elem in html.iter(tag=etree.Element):
+        if not elem.tag.startswith('{'):
+            parent = elem.getparent()
+            namespace = parent is not None and parent.nsmap.get(None)
+            if namespace:
+                elem.tag = '{{{}}}{}'.format(namespace, elem.tag)
+        if elem.text == '':
+            elem.text = None
+        if elem.tail == '':
+            elem.tail = None
+
+
+def reconstitute(html, streaming=False):
+    """Given a file-like object as ``html``, reconstruct it into models.
+    When ``streaming`` (``html`` being opened in binary mode),
+    XHTML is reconstructed as it is parsed,
+    so memory use is bounded by the largest page rather than the whole
+    document (see ``adapters.adapt_single_html_file``).
+    """
+    if streaming:
+        try:
+            return adapt_single_html_file(html)
+        except etree.XMLSyntaxError:
+            # Not XHTML, parse it in whole as HTML.
+            html.seek(0)
     try:
         htree = etree.parse(html)
     except etree.XMLSyntaxError:
@@ -51,29 +95,400 @@ def reconstitute(html):
     return adapt_single_html(xhtml)
 
 
-def collate(binder, ruleset=None, includes=None):
+def collate(binder, ruleset=None, includes=None, cache=None,
+            sharded=False, global_ruleset=None, workers=None):
     """Given a ``Binder`` as ``binder``, collate the content into a new set
     of models.
     Returns the collated binder.
 
-    """
-    html_formatter = SingleHTMLFormatter(binder, includes)
-    raw_html = io.BytesIO(bytes(html_formatter))
-    collated_html = io.BytesIO()
+    When given a ``CollationCache`` as ``cache``, the baked html is
+    looked up in it before baking and stored in it after. It is keyed
+    by the single html with the includes applied, so changes to the
+    included content are not missed, though they are always fetched.
+    The collation state of a sharded collation (see ``recollate``)
+    is taken from that html again, rather than cached.
+
+    When ``sharded``, each top-level unit or chapter (and each run of
+    top-level pages) is baked on its own, across a pool of ``workers``
+    processes, which suits rulesets that only move content within
+    a chapter. The ``global_ruleset`` is then baked over the whole
+    book, e.g. to build the table of contents.
 
+    """
     if ruleset is None:
         # No ruleset found, so no cooking necessary.
         return binder
 
-    easybake(ruleset, raw_html, collated_html)
+    html = SingleHTMLFormatter(binder, includes).to_tree()
+    if cache is not None:
+        key = _collation_key(ruleset, etree.tostring(html),
+                             sharded, global_ruleset)
+        cached = cache.open(key)
+        if cached is not None:
+            state = None
+            if sharded and global_ruleset is None:
+                state = _collation_state(ruleset, html, _take_shards(html))
+            with cached:
+                return _adapt_collated(cached, state)
+
+    # The single html is baked and adapted as a tree, without
+    # serializing and parsing it between the steps.
+    state = None
+    if sharded:
+        shards = _take_shards(html)
+        if global_ruleset is None:
+            state = _collation_state(ruleset, html, shards)
+        _bake_shards(ruleset, shards, workers)
+    else:
+        bake(ruleset, html)
+    _as_parsed(html)
+    if global_ruleset is not None:
+        bake(global_ruleset, html)
+        _as_parsed(html)
+    if cache is not None:
+        cache.set(key, etree.tostring(html))
+    collated_binder = _adapt_collated(html, state)
+
+    return collated_binder
 
-    collated_html.seek(0)
-    collated_binder = reconstitute(collated_html)
 
+def recollate(collated, binder, ruleset, includes=None, workers=None,
+              global_ruleset=None):
+    """Given the ``collated`` binder, from a sharded ``collate`` of an
+    earlier version of ``binder`` with the same ``ruleset``, collate
+    ``binder`` again, baking only the shards (see ``collate``) whose
+    source changed since. The units, chapters and pages of the other
+    shards are cloned from ``collated`` (see ``Binder.clone``),
+    so that changing either binder later leaves the other as it is.
+    Returns the collated binder.
+
+    Links are only fixed in the rebaked pages, so links from the
+    other pages to ids that went away are left as they were.
+    When anything outside of the shards changed (e.g. the book's
+    metadata or its table of contents, which has the title of every
+    page, so retitling any page changes it), ``collated`` was not
+    collated sharded, or the rebaked shards do not make as many
+    units, chapters and pages as their source, the whole book is
+    collated again. As the ``global_ruleset`` is baked over the
+    whole book, the book is always collated whole when given one.
+
+    """
+    html = SingleHTMLFormatter(binder, includes).to_tree()
+    shards = _take_shards(html)
+    state = _collation_state(ruleset, html, shards)
+
+    previous = getattr(collated, 'collation_state', None)
+    if previous is None or global_ruleset is not None or \
+            previous['book'] != state['book'] or \
+            len(previous['shards']) != len(state['shards']):
+        return _collate_shards(html, shards, state, ruleset,
+                               global_ruleset, workers)
+
+    changed = [shard != previous_shard for shard, previous_shard
+               in zip(state['shards'], previous['shards'])]
+    # Leave the unchanged shards and their table of contents entries
+    # out of the html, so that only the changed ones are adapted.
+    nav = html.xpath('//xhtml:nav', namespaces=HTML_DOCUMENT_NAMESPACES)[0]
+    nav_entries = nav.xpath('xhtml:ol/xhtml:li',
+                            namespaces=HTML_DOCUMENT_NAMESPACES)
+    changed_shards = []
+    reused_pages = set()
+    offset = 0
+    for (placeholder, shard_html), is_changed, (digest, count) \
+            in zip(shards, changed, state['shards']):
+        if is_changed:
+            changed_shards.append((placeholder, shard_html))
+        else:
+            placeholder.getparent().remove(placeholder)
+            for nav_entry in nav_entries[offset:offset + count]:
+                nav_entry.getparent().remove(nav_entry)
+            for index in range(offset, offset + count):
+                reused_pages.update(
+                    id(page)
+                    for page in flatten_to_documents(collated[index]))
+        offset += count
+
+    _bake_shards(ruleset, changed_shards, workers)
+    _as_parsed(html)
+    # Links in the rebaked pages are fixed with the ids of the reused
+    # pages and their own.
+    id_map = dict((key, value)
+                  for key, value in previous['id_map'].items()
+                  if id(value[0]) in reused_pages)
+    rebaked = adapt_single_html(html, id_map=id_map)
+    if len(rebaked) != sum(count for is_changed, (digest, count)
+                           in zip(changed, state['shards']) if is_changed):
+        # The ruleset added or removed top-level nodes, so the rebaked
+        # nodes cannot be told apart to be spliced in.
+        html = SingleHTMLFormatter(binder, includes).to_tree()
+        shards = _take_shards(html)
+        return _collate_shards(html, shards, state, ruleset,
+                               global_ruleset, workers)
+
+    # Splice the rebaked and the clones of the reused nodes together.
+    collated_binder = Binder(rebaked.id, metadata=rebaked.metadata)
+    clones = {}
+    offset = rebaked_offset = 0
+    for is_changed, (digest, count) in zip(changed, state['shards']):
+        if is_changed:
+            source, start = rebaked, rebaked_offset
+            rebaked_offset += count
+        else:
+            source, start = collated, offset
+        for index in range(start, start + count):
+            node = source[index]
+            if not is_changed:
+                clone = node.clone()
+                clones.update(
+                    (id(page), page_clone) for page, page_clone
+                    in zip(flatten_to_documents(node),
+                           flatten_to_documents(clone)))
+                node = clone
+            collated_binder.append(node)
+            collated_binder.set_title_for_index(
+                len(collated_binder) - 1, source.get_title_for_index(index))
+        offset += count
+    # The ids of the reused pages are now those of their clones.
+    state['id_map'] = dict(
+        (key, (clones.get(id(page), page), target))
+        for key, (page, target) in id_map.items())
+    collated_binder.collation_state = state
+
+    return collated_binder
+
+
+def _collate_shards(html, shards, state, ruleset, global_ruleset=None,
+                    workers=None):
+    """Bakes all of the ``shards`` taken from the single ``html``,
+    then the whole of it with the ``global_ruleset``, if any.
+    Returns the collated binder, with the collation ``state`` on it
+    when there is no ``global_ruleset``.
+    """
+    _bake_shards(ruleset, shards, workers)
+    _as_parsed(html)
+    if global_ruleset is not None:
+        bake(global_ruleset, html)
+        _as_parsed(html)
+        state = None
+    return _adapt_collated(html, state)
+
+
+def _adapt_collated(html, state=None):
+    """Adapts the collated single ``html`` (a tree, or a file read
+    from the cache) to a binder, keeping the collation ``state``
+    on it for ``recollate``.
+    """
+    id_map = {}
+    if isinstance(html, etree._Element):
+        collated_binder = adapt_single_html(html, id_map=id_map)
+    else:
+        collated_binder = adapt_single_html_file(html, id_map=id_map)
+    if state is not None and \
+            len(collated_binder) == sum(count for digest, count
+                                        in state['shards']):
+        state['id_map'] = id_map
+        collated_binder.collation_state = state
     return collated_binder
 
 
+def _collation_state(ruleset, html, shards):
+    """Digests of the single ``html``, with its ``shards`` taken out,
+    and of each of the shards, along with the number of top-level
+    nodes in each.
+    """
+    def digest(*values):
+        hasher = hashlib.new('sha1')
+        for value in values:
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8')
+            hasher.update(value)
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    shard_states = []
+    for placeholder, shard_html in shards:
+        body = shard_html[-1]
+        shard_states.append((digest(etree.tostring(shard_html)), len(body)))
+    return {'book': digest(ruleset, etree.tostring(html)),
+            'shards': shard_states}
+
+
+def _take_shards(html):
+    """Swaps each shard of the single ``html`` out of its body for a
+    placeholder. Returns the placeholders paired with the shards,
+    each made into a document of its own.
+    """
+    shards = []
+    for shard in _split_shards(html):
+        placeholder = etree.Comment()
+        shard[0].addprevious(placeholder)
+        shards.append((placeholder, _make_shard_html(html, shard)))
+    return shards
+
+
+def _bake_shards(ruleset, shards, workers=None):
+    """Bakes each of the ``shards`` (see ``_take_shards``) on its own,
+    in a pool of ``workers`` processes, and puts them back in place of
+    their placeholders.
+    """
+    if len(shards) > 1 and ProcessPoolExecutor is not None and \
+            workers != 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_bake_shard, ruleset,
+                                       etree.tostring(shard_html))
+                       for placeholder, shard_html in shards]
+            baked = [etree.fromstring(future.result()) for future in futures]
+    else:
+        baked = []
+        for placeholder, shard_html in shards:
+            bake(ruleset, shard_html)
+            baked.append(shard_html)
+
+    for (placeholder, shard_html), baked_html in zip(shards, baked):
+        body = baked_html.xpath('//xhtml:body',
+                                namespaces=HTML_DOCUMENT_NAMESPACES)[0]
+        for elem in list(body):
+            placeholder.addprevious(elem)
+        placeholder.getparent().remove(placeholder)
+
+
+def _split_shards(html):
+    """Splits the body of the single ``html`` into its top-level units
+    and chapters and the runs of top-level pages between them.
+    """
+    body = html.xpath('//xhtml:body', namespaces=HTML_DOCUMENT_NAMESPACES)[0]
+    shards = []
+    in_pages = False
+    for child in body.iterchildren(tag=etree.Element):
+        data_type = child.get('data-type')
+        if data_type in ('unit', 'chapter', 'composite-chapter',):
+            shards.append([child])
+            in_pages = False
+        elif data_type in ('page', 'composite-page',):
+            if not in_pages:
+                shards.append([])
+            shards[-1].append(child)
+            in_pages = True
+        else:
+            in_pages = False
+    return shards
+
+
+def _make_shard_html(html, shard):
+    """Makes a document of the single ``html``'s head and the ``shard``
+    elements, which are moved into its body.
+    """
+    head, body = html.xpath('//xhtml:head|//xhtml:body',
+                            namespaces=HTML_DOCUMENT_NAMESPACES)
+    shard_html = etree.Element(html.tag, dict(html.attrib), nsmap=html.nsmap)
+    shard_html.append(deepcopy(head))
+    shard_body = etree.SubElement(shard_html, body.tag, dict(body.attrib))
+    for elem in shard:
+        shard_body.append(elem)
+    return shard_html
+
+
+def _bake_shard(ruleset, html):
+    """Bakes a shard given as bytes, in a worker process."""
+    html = etree.fromstring(html)
+    bake(ruleset, html)
+    return etree.tostring(html)
+
+
+def _collation_key(ruleset, html, sharded=False, global_ruleset=None):
+    """Digest of what the collation of the single ``html``,
+    with its includes applied, depends upon.
+    """
+    from . import __version__
+    hasher = hashlib.new('sha1')
+
+    def update(value):
+        if not isinstance(value, bytes):
+            value = u'{}'.format(value).encode('utf-8')
+        hasher.update(value)
+        hasher.update(b'\0')
+
+    update(__version__)
+    update(ruleset)
+    update(sharded)
+    update(global_ruleset)
+    hasher.update(html)
+    return hasher.hexdigest()
+
+
+class CollationCache(object):
+    """A cache of baked single html in ``directory`` on the local disk.
+    When the files in it grow over ``max_size`` (in bytes), the least
+    recently used ones are removed.
+    """
+
+    suffix = '.xhtml'
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def open(self, key):
+        """Open the html cached under ``key`` for reading,
+        or return None when there is none.
+        """
+        path = self._path(key)
+        try:
+            file = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        # Mark it as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return file
+
+    def set(self, key, html):
+        """Cache the ``html`` bytes under ``key``."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(html)
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        """Remove the least recently used files until those left
+        take up at most ``max_size`` bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            size -= entry_size
+
+
 __all__ = (
+    'CollationCache',
     'collate',
+    'recollate',
     'reconstitute',
     )
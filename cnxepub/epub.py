@@ -7,13 +7,24 @@
 # ###
 import os
 import io
+import json
+import mimetypes
+import mmap
+import shutil
+import struct
 import tempfile
+import threading
 import zipfile
+import zlib
 from collections import Sequence
+from contextlib import contextmanager
+from functools import partial
 
 import jinja2
 from lxml import etree
 
+from .utils import ThreadPoolExecutor
+
 
 __all__ = ('EPUB', 'Package', 'Item',)
 
@@ -26,6 +37,10 @@ EPUB_CONTAINER_XML_RELATIVE_PATH = "META-INF/container.xml"
 EPUB_CONTAINER_XML_NAMESPACES = {
     'ns': "urn:oasis:names:tc:opendocument:xmlns:container"
     }
+# ./META-INF/cnx-epub-digests.json
+# Maps archive paths to digests of the models the items were made from,
+# used to reuse unchanged items when rebuilding an EPUB.
+EPUB_DIGESTS_RELATIVE_PATH = "META-INF/cnx-epub-digests.json"
 # ./*.opf
 EPUB_OPF_NAMESPACES = {
     'opf': "http://www.idpf.org/2007/opf",
@@ -105,19 +120,357 @@ class MissingMetadataError(Exception):
     """
 
 
-def pack_epub(directory, file):
+# Media-types of files that are already compressed.
+# These are stored in the archive rather than deflated again.
+STORED_MEDIA_TYPES = (
+    'application/epub+zip',
+    'application/gzip',
+    'application/zip',
+    'audio/mp4',
+    'audio/mpeg',
+    'audio/ogg',
+    'font/woff',
+    'font/woff2',
+    'image/gif',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+    'video/mp4',
+    'video/ogg',
+    'video/quicktime',
+    'video/webm',
+    )
+# Timestamp given to every archive entry, to make archives reproducible.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_CHUNK_SIZE = 64 * 1024
+# Files of at least this size are memory mapped when read,
+# rather than copied into memory.
+MMAP_MIN_SIZE = 1024 * 1024
+# Files over this size are only deflated when they are text, as other
+# large payloads seldom compress and are deflated in memory.
+DEFLATE_MAX_SIZE = 16 * 1024 * 1024
+
+
+class _ZipWriter(object):
+    """Writes a zip archive from members that have already been compressed.
+    ``zipfile.ZipFile`` compresses members itself while holding a lock,
+    which rules out compressing them in parallel.
+    As with ``zipfile.ZipFile``, the Zip64 extensions are used for
+    members, offsets and member counts over the limits of a plain zip
+    archive (``zipfile.ZIP64_LIMIT`` and ``zipfile.ZIP_FILECOUNT_LIMIT``).
+    """
+    _file_header = struct.Struct('<4s2B4HL2L2H')
+    _central_dir = struct.Struct('<4s4B4HL2L5H2L')
+    _end_archive = struct.Struct('<4s4H2LH')
+    _end_archive64 = struct.Struct('<4sQ2H2L4Q')
+    _end_archive64_locator = struct.Struct('<4sLQL')
+
+    def __init__(self, file):
+        if hasattr(file, 'write'):
+            self._fp = file
+            self._close_fp = False
+        else:
+            self._fp = open(file, 'wb')
+            self._close_fp = True
+        self._offset = 0
+        self._entries = []
+        year, month, day, hour, minute, second = ZIP_DATE_TIME
+        self._dos_date = (year - 1980) << 9 | month << 5 | day
+        self._dos_time = hour << 11 | minute << 5 | second // 2
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._close_fp:
+            self._fp.close()
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._offset += len(data)
+
+    def write_member(self, name, compress_type, crc, file_size, data):
+        """Write the member ``name`` containing ``data``, which has already
+        been compressed using ``compress_type``.
+        The ``crc`` and ``file_size`` are those of the uncompressed data.
+        """
+        self.write_header(name, compress_type, crc, len(data), file_size)
+        self._write(data)
+
+    def write_header(self, name, compress_type, crc, compress_size,
+                     file_size):
+        """Write the local header of a member, whose ``compress_size``
+        bytes of data must be written directly afterwards.
+        """
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        filename = name
+        # Flag non-ascii filenames as being utf-8 encoded.
+        flag_bits = 0x800 if max(bytearray(filename) or [0]) > 127 else 0
+        self._entries.append((filename, flag_bits, compress_type, crc,
+                              compress_size, file_size, self._offset))
+        extra = b''
+        version = 20
+        if max(compress_size, file_size) > zipfile.ZIP64_LIMIT:
+            extra = struct.pack('<2H2Q', 1, 16, file_size, compress_size)
+            compress_size = file_size = 0xffffffff
+            version = 45
+        self._write(self._file_header.pack(
+            b'PK\003\004', version, 0, flag_bits, compress_type,
+            self._dos_time, self._dos_date, crc, compress_size, file_size,
+            len(filename), len(extra)))
+        self._write(filename)
+        self._write(extra)
+
+    def copy_member(self, zip_file, zinfo):
+        """Copy the member described by ``zinfo`` from the open
+        ``zip_file`` without decompressing it.
+        """
+        fp = zip_file.fp
+        fp.seek(zinfo.header_offset)
+        header = fp.read(self._file_header.size)
+        if header[:4] != b'PK\003\004':
+            raise zipfile.BadZipfile(
+                "Bad local header for '{}'".format(zinfo.filename))
+        header = self._file_header.unpack(header)
+        fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+        self.write_header(zinfo.filename, zinfo.compress_type, zinfo.CRC,
+                          zinfo.compress_size, zinfo.file_size)
+        remaining = zinfo.compress_size
+        while remaining > 0:
+            chunk = fp.read(min(ZIP_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipfile(
+                    "Truncated data for '{}'".format(zinfo.filename))
+            remaining -= len(chunk)
+            self._write(chunk)
+
+    def write_stored_file(self, name, filepath):
+        """Store the file at ``filepath`` as ``name`` without compressing it.
+        The file is read in chunks rather than loaded into memory.
+        """
+        crc = 0
+        file_size = 0
+        with open(filepath, 'rb') as fb:
+            for chunk in iter(lambda: fb.read(ZIP_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+            self.write_header(name, zipfile.ZIP_STORED, crc & 0xffffffff,
+                              file_size, file_size)
+            fb.seek(0)
+            for chunk in iter(lambda: fb.read(ZIP_CHUNK_SIZE), b''):
+                self._write(chunk)
+
+    def close(self):
+        """Write the central directory."""
+        central_dir_offset = self._offset
+        for (filename, flag_bits, compress_type, crc, compress_size,
+             file_size, header_offset) in self._entries:
+            # Values over the limit are given in the Zip64 extra field.
+            extra = []
+            if max(compress_size, file_size) > zipfile.ZIP64_LIMIT:
+                extra.extend([file_size, compress_size])
+                compress_size = file_size = 0xffffffff
+            if header_offset > zipfile.ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = 0xffffffff
+            extra = extra and struct.pack(
+                '<2H{}Q'.format(len(extra)), 1, 8 * len(extra),
+                *extra) or b''
+            version = extra and 45 or 20
+            self._write(self._central_dir.pack(
+                b'PK\001\002', version, 3, version, 0, flag_bits,
+                compress_type, self._dos_time, self._dos_date, crc,
+                compress_size, file_size, len(filename), len(extra), 0, 0,
+                0, 0o100644 << 16, header_offset))
+            self._write(filename)
+            self._write(extra)
+        count = len(self._entries)
+        central_dir_size = self._offset - central_dir_offset
+        if count > zipfile.ZIP_FILECOUNT_LIMIT or \
+                max(central_dir_offset, central_dir_size) > \
+                zipfile.ZIP64_LIMIT:
+            end_archive64_offset = self._offset
+            self._write(self._end_archive64.pack(
+                b'PK\006\006', self._end_archive64.size - 12, 45, 45, 0, 0,
+                count, count, central_dir_size, central_dir_offset))
+            self._write(self._end_archive64_locator.pack(
+                b'PK\006\007', 0, end_archive64_offset, 1))
+            count = min(count, 0xffff)
+            central_dir_size = min(central_dir_size, 0xffffffff)
+            central_dir_offset = min(central_dir_offset, 0xffffffff)
+        self._write(self._end_archive.pack(
+            b'PK\005\006', 0, 0, count, count,
+            central_dir_size, central_dir_offset, 0))
+        if self._close_fp:
+            self._fp.close()
+
+
+def _deflate_file(filepath, compresslevel):
+    """Deflate the file at ``filepath``.
+    Returns the crc, size and raw deflate stream of the file.
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    crc = 0
+    file_size = 0
+    compressed = []
+    with open(filepath, 'rb') as fb:
+        for chunk in iter(lambda: fb.read(ZIP_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            compressed.append(compressor.compress(chunk))
+    compressed.append(compressor.flush())
+    return crc & 0xffffffff, file_size, b''.join(compressed)
+
+
+class _Deflation(object):
+    """The deflation of a file (see ``_deflate_file``) run in a thread,
+    with its ``result`` (or error) waited upon by the archive writer.
+    """
+
+    def __init__(self, filepath, compresslevel):
+        self.filepath = filepath
+        self.compresslevel = compresslevel
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = _deflate_file(self.filepath, self.compresslevel)
+        except Exception as exc:
+            self._error = exc
+        finally:
+            self._done.set()
+
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _is_text(media_type):
+    return media_type is not None and (
+        media_type.startswith('text/') or media_type.endswith('xml') or
+        media_type in ('application/javascript', 'application/json',))
+
+
+def _is_stored(archive_path, filepath=None, media_type=None):
+    """Determine if the file at ``archive_path`` should be stored
+    in the archive without compression. That is any audio, image
+    or video that is not xml (e.g. svg), and any file at ``filepath``
+    that is larger than ``DEFLATE_MAX_SIZE`` and is not text.
+    The ``media_type`` is guessed from the extension when not given.
+    """
+    if archive_path == EPUB_MIMETYPE_RELATIVE_PATH:
+        # The mimetype file must not be compressed.
+        return True
+    if media_type is None:
+        media_type = mimetypes.guess_type(archive_path)[0]
+    if media_type in STORED_MEDIA_TYPES:
+        return True
+    if _is_text(media_type):
+        return False
+    if media_type is not None and \
+            media_type.split('/')[0] in ('audio', 'image', 'video',):
+        return True
+    return filepath is not None and \
+        os.path.getsize(filepath) > DEFLATE_MAX_SIZE
+
+
+def pack_epub(directory, file, compresslevel=None, threads=1,
+              previous=None, reuse=(), media_types=None):
     """Pack the given ``directory`` into an epub (i.e. zip) archive
     given as ``file``, which can be a file-path or file-like object.
+    The archive paths listed in ``reuse`` are copied, still compressed,
+    from the ``previous`` epub (a file-path or file-like object)
+    rather than read from the ``directory``.
+
+    The ``mimetype`` file is written first. It and media (see
+    ``_is_stored``, which is given the media type of each archive path
+    found in ``media_types``) are stored, while all other files are deflated
+    at ``compresslevel`` (zlib's default when ``None``)
+    using ``threads`` worker threads. Each deflated file is written
+    out as soon as it and those before it are done, with only a few
+    deflated ahead of the writer.
+    Entries are ordered by path and carry a fixed timestamp,
+    so packing the same directory twice produces identical archives.
+    """
+    if compresslevel is None:
+        compresslevel = zlib.Z_DEFAULT_COMPRESSION
+    if media_types is None:
+        media_types = {}
+    base_path = os.path.abspath(directory)
+    archive_paths = []
+    for root, dirs, filenames in os.walk(base_path):
+        # Strip the absolute path
+        archive_path = os.path.relpath(root, base_path)
+        for filename in filenames:
+            archival_filepath = os.path.normpath(
+                os.path.join(archive_path, filename))
+            archive_paths.append(archival_filepath.replace(os.sep, '/'))
+    reuse = set(reuse)
+    archive_paths.extend(reuse.difference(archive_paths))
+    archive_paths.sort(key=lambda p: (p != EPUB_MIMETYPE_RELATIVE_PATH, p))
+
+    # The files to deflate, which are deflated in parallel
+    # in archive order, keeping at most ``window`` ahead of the writer.
+    deflations = iter([
+        (i, _Deflation(os.path.join(base_path, archive_path), compresslevel))
+        for i, archive_path in enumerate(archive_paths)
+        if archive_path not in reuse and not _is_stored(
+            archive_path, os.path.join(base_path, archive_path),
+            media_types.get(archive_path))])
+    window = max(threads, 1) * 2
+    pending = {}
+
+    previous_zip = reuse and zipfile.ZipFile(previous, 'r') or None
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+
+            def deflate_next():
+                for i, deflation in deflations:
+                    pending[i] = deflation
+                    executor.submit(deflation.run)
+                    break
+
+            for _ in range(window):
+                deflate_next()
+            with _ZipWriter(file) as zippy:
+                for i, archive_path in enumerate(archive_paths):
+                    if archive_path in reuse:
+                        zippy.copy_member(previous_zip,
+                                          previous_zip.getinfo(archive_path))
+                    elif i in pending:
+                        crc, file_size, data = pending.pop(i).result()
+                        deflate_next()
+                        zippy.write_member(archive_path, zipfile.ZIP_DEFLATED,
+                                           crc, file_size, data)
+                    else:
+                        zippy.write_stored_file(
+                            archive_path,
+                            os.path.join(base_path, archive_path))
+    finally:
+        if previous_zip is not None:
+            previous_zip.close()
+
+
+def read_digests(file):
+    """Read the item digests recorded in the given epub ``file``
+    (a file-path or file-like object).
+    Returns a dictionary of archive paths to digests,
+    which is empty when the epub does not contain digests.
     """
-    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as zippy:
-        base_path = os.path.abspath(directory)
-        for root, dirs, filenames in os.walk(directory):
-            # Strip the absolute path
-            archive_path = os.path.relpath(root, base_path)
-            for filename in filenames:
-                filepath = os.path.join(root, filename)
-                archival_filepath = os.path.join(archive_path, filename)
-                zippy.write(filepath, archival_filepath)
+    with zipfile.ZipFile(file, 'r') as zf:
+        try:
+            digests = zf.read(EPUB_DIGESTS_RELATIVE_PATH)
+        except KeyError:
+            return {}
+    return json.loads(digests.decode('utf-8'))
 
 
 def unpack_epub(file, directory):
@@ -182,15 +535,29 @@ class EPUB(Sequence):
         return cls(packages=packages, root=root)
 
     @staticmethod
-    def to_file(epub, file):
-        """Export to ``file``, which is a *file* or *file-like object*."""
+    def to_file(epub, file, compresslevel=None, threads=1, previous=None):
+        """Export to ``file``, which is a *file* or *file-like object*.
+        The ``compresslevel`` and ``threads`` are passed on to ``pack_epub``.
+        Items without data are copied from the ``previous`` epub,
+        where they must exist under the same name.
+        """
         directory = tempfile.mkdtemp('-epub')
         # Write out the contents to the filesystem.
         package_filenames = []
+        digests = {}
+        media_types = {}
+        reuse = []
         for package in epub:
             opf_filepath = Package.to_file(package, directory)
             opf_filename = os.path.basename(opf_filepath)
             package_filenames.append(opf_filename)
+            for item in package:
+                location = _item_location(item)
+                media_types[location] = item.media_type
+                if item.digest is not None:
+                    digests[location] = item.digest
+                if item.data is None:
+                    reuse.append(location)
 
         # Create the container.xml
         container_xml_filepath = os.path.join(directory,
@@ -201,12 +568,19 @@ class EPUB(Sequence):
         with open(container_xml_filepath, 'w') as fb:
             xml = template.render(package_filenames=package_filenames)
             fb.write(xml)
+        if digests:
+            digests_filepath = os.path.join(directory,
+                                            EPUB_DIGESTS_RELATIVE_PATH)
+            with open(digests_filepath, 'w') as fb:
+                json.dump(digests, fb, indent=2, sort_keys=True)
         # Write the mimetype file.
         with open(os.path.join(directory, 'mimetype'), 'w') as fb:
             fb.write("application/epub+zip")
 
         # Pack everything up
-        pack_epub(directory, file=file)
+        pack_epub(directory, file=file, compresslevel=compresslevel,
+                  threads=threads, previous=previous, reuse=reuse,
+                  media_types=media_types)
 
     # ABC methods for MutableSequence
     def __getitem__(self, k):
@@ -391,15 +765,14 @@ class Package(Sequence):
         # Write the items to the filesystem
         locations = {}  # Used when rendering
         for item in package:
-            if item.media_type == 'application/xhtml+xml':
-                base = os.path.join(directory, 'contents')
-            else:
-                base = os.path.join(directory, 'resources')
-            filename = item.name
-            filepath = os.path.join(base, filename)
-            locations[item] = os.path.relpath(filepath, directory)
+            location = _item_location(item)
+            locations[item] = location
+            if item.data is None:
+                # Reused from a previous epub when packed.
+                continue
+            filepath = os.path.join(directory, location)
             with open(filepath, 'wb') as item_file:
-                item_file.write(item.data.read())
+                shutil.copyfileobj(item.data, item_file, ZIP_CHUNK_SIZE)
 
         # Write the OPF
         template = jinja2.Template(OPF_TEMPLATE,
@@ -430,20 +803,118 @@ class Package(Sequence):
         return len(self._items)
 
 
-class Item:
-    """Package item"""
+def _item_location(item):
+    """The archive path of the given ``item``."""
+    if item.media_type == 'application/xhtml+xml':
+        base = 'contents'
+    else:
+        base = 'resources'
+    return '/'.join([base, item.name])
+
+
+class _LazyFile(object):
+    """A readable, seekable stream of the file-like object given by
+    ``open()``, a context manager (e.g. ``.models.Resource.open``).
+    It is only entered while the stream is read: on the first read,
+    until the end is read or the stream is closed. Reading again
+    enters it again, at the position the stream was left at.
+    """
+
+    def __init__(self, open):
+        self._open = open
+        self._context = None
+        self._file = None
+        self._position = 0
+
+    def _get_file(self):
+        if self._file is None:
+            context = self._open()
+            self._file = context.__enter__()
+            self._context = context
+            if self._position:
+                self._file.seek(self._position)
+        return self._file
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        data = self._get_file().read(size)
+        self._position += len(data)
+        if not data or size < 0:
+            self.close()
+        return data
+
+    def seek(self, offset, whence=0):
+        if self._file is not None or whence == 2:
+            file = self._get_file()
+            file.seek(offset, whence)
+            self._position = file.tell()
+        elif whence == 1:
+            self._position += offset
+        else:
+            self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        context = self._context
+        self._file = self._context = None
+        if context is not None:
+            context.__exit__(None, None, None)
+
+
+@contextmanager
+def _open_mapped(filepath):
+    """Open the file at ``filepath`` memory mapped."""
+    with open(filepath, 'rb') as fb:
+        data = mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        data.close()
+
+
+class Item(object):
+    """Package item.
+    The ``data`` is a file-like object (e.g. a ``_LazyFile``).
+    The ``digest`` identifies the model the item was made from.
+    """
+    __slots__ = ('name', 'data', 'media_type', 'is_navigation', 'properties',
+                 'digest',)
 
     def __init__(self, name, data=None, media_type=None,
-                 is_navigation=False, properties=None, **kwargs):
+                 is_navigation=False, properties=None, digest=None,
+                 **kwargs):
         self.name = name
         self.data = data
         self.media_type = media_type
         self.is_navigation = bool(is_navigation)
         self.properties = properties or []
+        self.digest = digest
 
     @classmethod
     def from_file(cls, filepath, **kwargs):
+        """Create the item from the file at ``filepath``. Files other
+        than documents are memory mapped when they are at least
+        ``MMAP_MIN_SIZE`` bytes, so that large media are paged in
+        as they are read, and only while they are read
+        (see ``_LazyFile``). Documents are parsed several times over
+        when adapted, so they are kept in a ``BytesIO``, which lxml
+        parses without moving its position.
+        """
         name = os.path.basename(filepath)
-        with open(filepath, 'rb') as fb:
-            data = io.BytesIO(fb.read())
+        if kwargs.get('media_type') != 'application/xhtml+xml' and \
+                os.path.getsize(filepath) >= MMAP_MIN_SIZE:
+            data = _LazyFile(partial(_open_mapped, filepath))
+        else:
+            with open(filepath, 'rb') as fb:
+                data = io.BytesIO(fb.read())
         return cls(name, data, **kwargs)
@@ -21,8 +21,7 @@ from copy import deepcopy
 import requests
 
 from .models import (
-    model_to_tree, content_to_etree, etree_to_content,
-    flatten_to_documents,
+    model_to_tree, etree_to_content,
     Binder, TranslucentBinder,
     Document, DocumentPointer, CompositeDocument, utf8)
 from .html_parsers import HTML_DOCUMENT_NAMESPACES
@@ -95,6 +94,7 @@ class HTMLFormatter(object):
         self.model = model
         self.extensions = extensions
         self.generate_ids = generate_ids
+        self._root = None
 
     def _generate_ids(self, document, content):
         """Generate unique ids for html elements in page content so that it's
@@ -172,6 +172,14 @@ class HTMLFormatter(object):
             if href.startswith('#') and href[1:] in old_id_to_new_id:
                 a.attrib['href'] = '#{}'.format(old_id_to_new_id[href[1:]])
 
+    def _read_xml(self):
+        """The document's tree, read once, as a document that has
+        not been parsed is parsed on each read.
+        """
+        if self._root is None:
+            self._root = self.model._read_xml()
+        return self._root
+
     @property
     def _content(self):
         if isinstance(self.model, TranslucentBinder):
@@ -181,8 +189,11 @@ class HTMLFormatter(object):
             return tree_to_html(
                 model_to_tree(self.model), self.extensions).decode('utf-8')
         elif isinstance(self.model, Document):
-            _html = content_to_etree(self.model.content)
+            # Work from the document's tree rather than reparsing
+            # its serialized content, copying it only when modified.
+            _html = self._read_xml()
             if self.generate_ids:
+                _html = deepcopy(_html)
                 self._generate_ids(self.model, _html)
 
             return etree_to_content(_html, strip_root_node=True)
@@ -190,20 +201,13 @@ class HTMLFormatter(object):
     @property
     def _template(self):
         if isinstance(self.model, DocumentPointer):
-            return jinja2.Template(DOCUMENT_POINTER_TEMPLATE,
-                                   trim_blocks=True, lstrip_blocks=True)
-
-        def isdict(v):
-            return isinstance(v, dict)
-
-        template_env = jinja2.Environment(trim_blocks=True, lstrip_blocks=True)
-        return template_env.from_string(HTML_DOCUMENT,
-                                        globals={'isdict': isdict})
+            return _compiled_template(DOCUMENT_POINTER_TEMPLATE)
+        return _compiled_template(HTML_DOCUMENT)
 
     @property
     def _template_args(self):
         if isinstance(self.model, Document):
-            root = self.model._xml
+            root = self._read_xml()
         else:
             root = {}
         return {
@@ -306,19 +310,19 @@ class SingleHTMLFormatter(object):
             self.included = True
 
         # Rewrite absolute-path links that are intra-binder
-        page_ids = [page.id for page in flatten_to_documents(self.binder)]
-        page_uuids = {id.split('@')[0]: id for id in page_ids}
         for link in self.root.xpath('//*[@href]'):
             href = link.get('href')
             if href.startswith('/contents/'):
                 link_uuid = re.split('@|#', href[10:])[0]
-                if link_uuid in page_uuids:
+                page = self.binder.get_node(link_uuid)
+                if isinstance(page, Document) and \
+                        page.id.split('@')[0] == link_uuid:
                     if '#' in href:
                         fragment = href[href.index('#'):].replace('#', '_')
                         link.set('href', '#auto_{}{}'.format(
-                            page_uuids[link_uuid], fragment))
+                            page.id, fragment))
                     else:
-                        link.set('href', '#{}'.format(page_uuids[link_uuid]))
+                        link.set('href', '#{}'.format(page.id))
         self.built = True
 
     def __unicode__(self):
@@ -336,32 +340,83 @@ class SingleHTMLFormatter(object):
                                               pretty_print=True,
                                               encoding='utf-8'))
 
+    def to_tree(self):
+        """Build and return the root element, with the same layout and
+        namespaces as the serialized single html. This modifies the
+        formatter's ``root`` in place, rather than reparsing it.
+        """
+        if not self.built:
+            self.build()
+        _pretty_print(self.root)
+        etree.cleanup_namespaces(self.root, top_nsmap=_TOP_NSMAP)
+        return self.root
+
+
+def _isdict(v):
+    return isinstance(v, dict)
+
+
+_compiled_templates = {}
+
+
+def _compiled_template(source):
+    """Compile the template ``source`` on first use only,
+    since compiling costs far more than rendering.
+    """
+    try:
+        return _compiled_templates[source]
+    except KeyError:
+        template_env = jinja2.Environment(trim_blocks=True,
+                                          lstrip_blocks=True)
+        template = template_env.from_string(source,
+                                            globals={'isdict': _isdict})
+        _compiled_templates[source] = template
+        return template
+
+
+def _pretty_print(elem, level=1):
+    """Lay out the tree in place, as ``pretty_print`` would when
+    serializing it. Elements with text content are left as they are.
+    """
+    children = list(elem)
+    if not children or elem.text is not None or \
+            any(child.tail is not None for child in children):
+        return
+    indent = '\n' + '  ' * level
+    elem.text = indent
+    for child in children:
+        _pretty_print(child, level + 1)
+        child.tail = indent
+    children[-1].tail = '\n' + '  ' * (level - 1)
+
 
 def _fix_namespaces(html):
     # Get rid of unused namespaces and put them all in the root tag
-    nsmap = {None: u"http://www.w3.org/1999/xhtml",
-             u"m": u"http://www.w3.org/1998/Math/MathML",
-             u"epub": u"http://www.idpf.org/2007/ops",
-             u"rdf": u"http://www.w3.org/1999/02/22-rdf-syntax-ns#",
-             u"dc": u"http://purl.org/dc/elements/1.1/",
-             u"lrmi": u"http://lrmi.net/the-specification",
-             u"bib": u"http://bibtexml.sf.net/",
-             u"data":
-                 u"http://www.w3.org/TR/html5/dom.html#custom-data-attribute",
-             u"qml": u"http://cnx.rice.edu/qml/1.0",
-             u"datadev": u"http://dev.w3.org/html5/spec/#custom",
-             u"mod": u"http://cnx.rice.edu/#moduleIds",
-             u"md": u"http://cnx.rice.edu/mdml",
-             u"c": u"http://cnx.rice.edu/cnxml"
-             }
     root = etree.fromstring(html)
 
     # lxml has a built in function to do this without destroying comments
-    etree.cleanup_namespaces(root, top_nsmap=nsmap)
+    etree.cleanup_namespaces(root, top_nsmap=_TOP_NSMAP)
 
     return etree.tostring(root, pretty_print=True, encoding='utf-8')
 
 
+_TOP_NSMAP = {None: u"http://www.w3.org/1999/xhtml",
+              u"m": u"http://www.w3.org/1998/Math/MathML",
+              u"epub": u"http://www.idpf.org/2007/ops",
+              u"rdf": u"http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+              u"dc": u"http://purl.org/dc/elements/1.1/",
+              u"lrmi": u"http://lrmi.net/the-specification",
+              u"bib": u"http://bibtexml.sf.net/",
+              u"data":
+                  u"http://www.w3.org/TR/html5/dom.html#custom-data-attribute",
+              u"qml": u"http://cnx.rice.edu/qml/1.0",
+              u"datadev": u"http://dev.w3.org/html5/spec/#custom",
+              u"mod": u"http://cnx.rice.edu/#moduleIds",
+              u"md": u"http://cnx.rice.edu/mdml",
+              u"c": u"http://cnx.rice.edu/cnxml"
+              }
+
+
 def _replace_tex_math(exercise_id, node, mml_url, mc_client=None, retry=0):
     """call mml-api service to replace TeX math in body of node with mathml"""
 
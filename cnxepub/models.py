@@ -8,6 +8,12 @@
 import io
 import hashlib
 import mimetypes
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
 try:
     from collections.abc import MutableSequence
 except ImportError:
@@ -17,6 +23,7 @@ try:
 except ImportError:
     from urlparse import urlparse
 from contextlib import contextmanager
+from copy import deepcopy
 
 from lxml import etree
 
@@ -28,6 +35,7 @@ __all__ = (
     'ATTRIBUTED_ROLE_KEYS',
     'flatten_tree_to_ident_hashes', 'model_to_tree',
     'flatten_model', 'flatten_to', 'flatten_to_documents',
+    'model_to_wire', 'model_from_wire',
     'Binder', 'TranslucentBinder',
     'Document', 'CompositeDocument', 'DocumentPointer',
     'Resource',
@@ -35,8 +43,18 @@ __all__ = (
     )
 
 
+IS_PY3 = sys.version_info.major == 3
+if IS_PY3:
+    string_types = (str,)
+else:
+    string_types = (basestring,)  # noqa: F821
+
 mimetypes.init()
 RESOURCE_HASH_TYPE = 'sha1'
+# Bytes read at a time when hashing or copying resource data
+RESOURCE_HASH_CHUNK_SIZE = 64 * 1024
+# Unseekable resource streams larger than this are spooled to disk
+SPOOL_MAX_SIZE = 1024 * 1024
 TRANSLUCENT_BINDER_ID = 'subcol'
 INTERNAL_REFERENCE_TYPE = 'internal'
 EXTERNAL_REFERENCE_TYPE = 'external'
@@ -71,23 +89,73 @@ XHTML_NS = {'x': 'http://www.w3.org/1999/xhtml'}
 
 
 def utf8(item):
+    """Decode the utf-8 encoded strings in ``item``, looking into lists
+    and dictionaries, which are only copied when something in them
+    needed decoding.
+    """
+    if isinstance(item, bytes):
+        return item.decode('utf-8')
+    if isinstance(item, _Metadata):
+        return item
     if isinstance(item, list):
-        return [utf8(i) for i in item]
+        for i, value in enumerate(item):
+            if utf8(value) is not value:
+                return item[:i] + [utf8(v) for v in item[i:]]
+        return item
     if isinstance(item, dict):
-        return {utf8(k): utf8(v) for k, v in item.items()}
-    try:
-        return item.decode('utf-8')
-    except (UnicodeEncodeError, AttributeError):
-        # py2 and py3 errs, respectively, for when fed an encoded string
+        for key, value in item.items():
+            if utf8(key) is not key or utf8(value) is not value:
+                return {utf8(k): utf8(v) for k, v in item.items()}
         return item
+    return item
+
+
+class _Metadata(dict):
+    """The metadata of a model, which ``utf8`` has been through,
+    as have the keys and values since set in it.
+    """
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        super(_Metadata, self).__setitem__(utf8(key), utf8(value))
+
+    def setdefault(self, key, default=None):
+        return super(_Metadata, self).setdefault(utf8(key), utf8(default))
+
+    def update(self, *args, **kwargs):
+        super(_Metadata, self).update(utf8(dict(*args, **kwargs)))
+
+
+def _model_metadata(metadata):
+    """A copy of the ``metadata`` for a model to keep, with its strings
+    decoded. The lists and dictionaries within are shared.
+    """
+    return _Metadata(utf8(metadata) if metadata else ())
+
+
+# Parsers are kept per thread, as they cannot be shared between threads.
+_parsers = threading.local()
+_BODY_TAGS = ('body', '{http://www.w3.org/1999/xhtml}body',)
+
+
+def _xml_parser():
+    parser = getattr(_parsers, 'xml_parser', None)
+    if parser is None:
+        parser = _parsers.xml_parser = etree.XMLParser(ns_clean=True)
+    return parser
 
 
 def content_to_etree(content):
     if not content:  # Allow building empty models
         return etree.XML('<body xmlns="http://www.w3.org/1999/xhtml" />')
-    xml_parser = etree.XMLParser(ns_clean=True)
-    tree = etree.XML(content, xml_parser)
-    # Determine if we've been fed a full XHTML page, with a <body> tag:
+    tree = etree.XML(content, _xml_parser())
+    # Determine if we've been fed a full XHTML page, with a <body> tag,
+    # which is most often the root or one of its children.
+    if tree.tag in _BODY_TAGS:
+        return tree
+    for child in tree:
+        if child.tag in _BODY_TAGS:
+            return child
     bods = tree.xpath('//*[self::body|self::x:body]',
                       namespaces={'x': 'http://www.w3.org/1999/xhtml'})
     if bods:
@@ -120,8 +188,8 @@ def model_to_tree(model, title=None, lucent_id=TRANSLUCENT_BINDER_ID):
     tree = {'id': id, 'title': title, 'shortId': shortid}
     if hasattr(model, '__iter__'):
         contents = tree['contents'] = []
-        for node in model:
-            item = model_to_tree(node, model.get_title_for_node(node),
+        for i, node in enumerate(model):
+            item = model_to_tree(node, model.get_title_for_index(i),
                                  lucent_id=lucent_id)
             contents.append(item)
     return tree
@@ -130,17 +198,19 @@ def model_to_tree(model, title=None, lucent_id=TRANSLUCENT_BINDER_ID):
 def flatten_tree_to_ident_hashes(item_or_tree,
                                  lucent_id=TRANSLUCENT_BINDER_ID):
     """Flatten a tree to id and version values (ident_hash)."""
-    if 'contents' in item_or_tree:
-        tree = item_or_tree
-        if tree['id'] != lucent_id:
-            yield tree['id']
-        for i in tree['contents']:
-            # yield from flatten_tree_to_ident_hashs(i, lucent_id)
-            for x in flatten_tree_to_ident_hashes(i, lucent_id):
-                yield x
-    else:
-        item = item_or_tree
-        yield item['id']
+    # Walk the tree with a stack of the nodes left to visit,
+    # rather than by recursion.
+    stack = [item_or_tree]
+    while stack:
+        item_or_tree = stack.pop()
+        if 'contents' in item_or_tree:
+            tree = item_or_tree
+            if tree['id'] != lucent_id:
+                yield tree['id']
+            stack.extend(reversed(tree['contents']))
+        else:
+            item = item_or_tree
+            yield item['id']
 
 
 def flatten_model(model):
@@ -148,12 +218,27 @@ def flatten_model(model):
     This is used to flatten a ``Binder``'ish model down to a list
     of contained models.
     """
-    yield model
     if isinstance(model, (TranslucentBinder, Binder,)):
-        for m in model:
-            # yield from flatten_model(m)
-            for x in flatten_model(m):
-                yield x
+        for m in model._flatten():
+            yield m
+    else:
+        yield model
+
+
+def _walk_model(model):
+    """Walk the model depth first, as ``flatten_model`` does,
+    returning the list of models and the list of binders among them.
+    """
+    models = []
+    binders = []
+    stack = [model]
+    while stack:
+        model = stack.pop()
+        models.append(model)
+        if isinstance(model, (TranslucentBinder, Binder,)):
+            binders.append(model)
+            stack.extend(reversed(model._nodes))
+    return models, binders
 
 
 def flatten_to_documents(model, include_pointers=False):
@@ -201,13 +286,15 @@ def _discover_uri_type(uri):
     return type_
 
 
-def _parse_references(xml):
-    """Parse the references to ``Reference`` instances."""
+def _parse_references(xml, document=None):
+    """Parse the references to ``Reference`` instances,
+    of the ``document`` whose tree ``xml`` is, if any.
+    """
     references = []
     ref_finder = HTMLReferenceFinder(xml)
     for elm, uri_attr in ref_finder:
         type_ = _discover_uri_type(elm.get(uri_attr))
-        references.append(Reference(elm, type_, uri_attr))
+        references.append(Reference(elm, type_, uri_attr, document))
     return references
 
 
@@ -215,8 +302,10 @@ class Reference(object):
     """A reference within a ``Document`` model, either internal or external.
     This depends on an xml element tree, to provide binds for uri and name.
     """
+    __slots__ = ('elm', 'remote_type', '_uri_attr', '_bound_model',
+                 '_uri_template', '_document',)
 
-    def __init__(self, elm, remote_type, uri_attr):
+    def __init__(self, elm, remote_type, uri_attr, document=None):
         self.elm = elm
         try:
             assert remote_type in REFERENCE_REMOTE_TYPES
@@ -227,6 +316,9 @@ class Reference(object):
         self._uri_attr = uri_attr
         self._bound_model = None
         self._uri_template = None
+        # The document whose tree the element is in, which copies
+        # the tree before it is changed, when shared with a clone.
+        self._document = document
 
     @property
     def is_bound(self):
@@ -239,13 +331,13 @@ class Reference(object):
 
     def _get_uri(self):
         if self.is_bound:
-            # Update the value before returning.
-            self._set_uri_from_bound_model()
+            return self._uri_template.format(self._bound_model.id)
         return self.elm.get(self._uri_attr)
 
     def _set_uri(self, value):
         if self.is_bound:
             raise ValueError("URI is bound to an object. Unbind first.")
+        self._unshare()
         self.elm.set(self._uri_attr, value)
 
     uri = property(_get_uri, _set_uri)
@@ -258,19 +350,30 @@ class Reference(object):
     def _set_uri_from_bound_model(self):
         """Using the bound model, set the uri."""
         value = self._uri_template.format(self._bound_model.id)
+        self._unshare()
         self.elm.set(self._uri_attr, value)
 
+    def _unshare(self):
+        """Move the element over to a copy of the document's tree,
+        when it is shared with a clone, before changing it.
+        """
+        if self._document is not None and self._document._is_shared():
+            self._document._unshare()
+
     def bind(self, model, template="{}"):
         """Bind the ``model`` to the reference. This uses the model's
         ``id`` attribute and the given ``template`` to
         dynamically produce a uri when accessed.
+        The uri is written to the element when the document
+        is serialized.
         """
         self._bound_model = model
         self._uri_template = template
-        self._set_uri_from_bound_model()
 
     def unbind(self):
         """Unbind the model from the reference."""
+        if self.is_bound:
+            self._set_uri_from_bound_model()
         self._bound_model = None
         self._uri_template = None
 
@@ -329,37 +432,174 @@ class TranslucentBinder(MutableSequence):
     This is used only represent ``Binder`` behavior
     without being a persistent piece of data.
     """
+    __slots__ = ('_nodes', 'metadata', '_title_overrides', '_node_indexes',
+                 '_changes', '_flattened', '_lookup', '_lookups',)
     id = None
     ident_hash = None
 
     def __init__(self, nodes=None, metadata=None,
                  title_overrides=None):
         self._nodes = nodes or []
-        self.metadata = utf8(metadata or {})
+        self.metadata = _model_metadata(metadata)
         if title_overrides is not None:
             if len(self._nodes) != len(title_overrides):
                 raise ValueError(
                     "``title_overrides`` should be the same length as "
                     "``nodes``. {} != {}"
                     .format(len(self._nodes), len(title_overrides)))
-            self._title_overrides = utf8(title_overrides)
+            self._title_overrides = list(utf8(title_overrides))
         else:
             self._title_overrides = [None] * len(self._nodes)
+        # Maps ``id(node)`` to the node's first index; built on demand
+        # and dropped whenever the nodes change.
+        self._node_indexes = None
+        # Counts the changes to the nodes, so that the flattened models
+        # (see ``_flatten``) can tell when they are out of date.
+        self._changes = 0
+        self._flattened = None
+        # The lookup of nodes by id (see ``get_node``), built on demand,
+        # and the lookups this binder is within, which are updated
+        # whenever the nodes change.
+        self._lookup = None
+        self._lookups = None
 
     @property
     def ident_hash(self):
         return None
 
+    def __getstate__(self):
+        # The caches are keyed by ``id(node)``, so they are left out of
+        # copies (and pickles), which build their own on demand.
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in self.__class__.__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state.update(_node_indexes=None, _flattened=None, _lookup=None,
+                     _lookups=None)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @property
     def is_translucent(self):
         return self.__class__ is TranslucentBinder
 
+    def _index(self, node):
+        """Index of the first occurrence of ``node``."""
+        if self._node_indexes is None:
+            node_indexes = {}
+            for i, n in enumerate(self._nodes):
+                node_indexes.setdefault(id(n), i)
+            self._node_indexes = node_indexes
+        index = self._node_indexes.get(id(node))
+        if index is None or index >= len(self._nodes) or \
+                self._nodes[index] is not node:
+            # Not a node of this binder, or the nodes have been
+            # changed behind our back.
+            self._node_indexes = None
+            return self._nodes.index(node)
+        return index
+
+    def _flatten(self):
+        """The list of this binder's models, as given by ``flatten_model``.
+        It is kept until this binder or any binder within it changes.
+        """
+        if self._flattened is not None:
+            models, changes = self._flattened
+            if all(binder._changes == binder_changes and
+                   len(binder._nodes) == length
+                   for binder, binder_changes, length in changes):
+                return models
+        models, binders = _walk_model(self)
+        changes = [(binder, binder._changes, len(binder._nodes))
+                   for binder in binders]
+        self._flattened = (models, changes)
+        return models
+
+    def _changed(self, removed=(), added=()):
+        self._node_indexes = None
+        self._changes += 1
+        if self._lookups:
+            for lookup in list(self._lookups):
+                lookup.update(self, removed, added)
+
+    def _get_lookup(self):
+        lookup = self._lookup
+        if lookup is None or lookup.stale:
+            lookup = self._lookup = _NodeLookup(self)
+        return lookup
+
+    def get_node(self, key, default=None):
+        """Find the first node (depth first, this binder included) whose
+        id, ident_hash, uuid or short id is ``key``.
+        The lookup is built on first use and updated as the binders
+        within this one change; changes to the ids of the nodes
+        themselves are not seen.
+        """
+        return self._get_lookup().nodes.get(key, default)
+
+    def get_parent(self, node):
+        """The binder within this one that ``node`` is in,
+        or None when ``node`` is this binder.
+        """
+        path = self.get_path(node)
+        return path[-1] if path else None
+
+    def get_path(self, node):
+        """The binders from this one down to the one ``node`` is in."""
+        try:
+            found, path, keys = self._get_lookup().paths[id(node)]
+        except KeyError:
+            found = None
+        if found is not node:
+            raise ValueError('{!r} is not within the binder'.format(node))
+        return list(path)
+
+    def clone(self, deep=True):
+        """A copy of this binder, whose metadata and nodes can be changed
+        without changing this binder. When ``deep``, the binders,
+        documents and document pointers within are cloned too
+        (see ``Document.clone``), otherwise they are shared.
+        """
+        cls = self.__class__
+        clone = cls.__new__(cls)
+        if hasattr(self, '__dict__'):
+            clone.__dict__.update(self.__dict__)
+        nodes = self._nodes
+        if deep:
+            nodes = [node.clone() for node in nodes]
+        TranslucentBinder.__init__(clone, list(nodes), self.metadata,
+                                   self._title_overrides)
+        return clone
+
+    def bind_references(self, resources, template='{}'):
+        """Bind the references of all the documents within,
+        as ``Document.bind_references`` does.
+        Returns the references that were bound.
+        """
+        bound = []
+        for document in flatten_to_documents(self):
+            bound.extend(document.bind_references(resources, template))
+        return bound
+
     def set_title_for_node(self, node, title):
-        index = self._nodes.index(node)
+        index = self._index(node)
         self._title_overrides[index] = title
 
     def get_title_for_node(self, node):
-        index = self._nodes.index(node)
+        index = self._index(node)
+        return self._title_overrides[index]
+
+    def set_title_for_index(self, index, title):
+        """Like ``set_title_for_node``, for the node at ``index``,
+        without searching for the node.
+        """
+        self._title_overrides[index] = title
+
+    def get_title_for_index(self, index):
         return self._title_overrides[index]
 
     # ABC methods for MutableSequence
@@ -367,11 +607,21 @@ class TranslucentBinder(MutableSequence):
         return self._nodes[i]
 
     def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            v = list(v)
+            removed, added = self._nodes[i], v
+        else:
+            removed, added = [self._nodes[i]], [v]
         self._nodes[i] = v
+        self._changed(removed, added)
 
     def __delitem__(self, i):
+        removed = self._nodes[i]
+        if not isinstance(i, slice):
+            removed = [removed]
         del self._nodes[i]
         del self._title_overrides[i]
+        self._changed(removed)
 
     def __len__(self):
         return len(self._nodes)
@@ -379,12 +629,110 @@ class TranslucentBinder(MutableSequence):
     def insert(self, i, v):
         self._nodes.insert(i, v)
         self._title_overrides.insert(i, None)
+        self._changed(added=[v])
+
+
+class _NodeLookup(object):
+    """Look up of the nodes within a binder by id, ident_hash, uuid
+    and short id, along with the path of binders to each.
+    """
+
+    def __init__(self, binder):
+        self.stale = False
+        self.nodes = {}
+        # Maps ``id(node)`` to the node, its path and its keys.
+        self.paths = {}
+        # The keys of more than one node and the nodes found more than
+        # once, for which the first (depth first) is only known by
+        # building the lookup again.
+        self.shared_keys = set()
+        self.repeated = set()
+        self._add(binder, ())
+
+    def _add(self, node, path):
+        """Add the ``node`` and the nodes within it to the lookup.
+        Returns whether any of them was already in it, or shares
+        a key with one that was.
+        """
+        clashes = False
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            keys = tuple(self._keys(node))
+            if id(node) in self.paths:
+                self.repeated.add(id(node))
+                clashes = True
+            else:
+                self.paths[id(node)] = (node, path, keys)
+            for key in keys:
+                if self.nodes.setdefault(key, node) is not node:
+                    self.shared_keys.add(key)
+                    clashes = True
+            if isinstance(node, TranslucentBinder):
+                if node._lookups is None:
+                    node._lookups = weakref.WeakSet()
+                node._lookups.add(self)
+                path = path + (node,)
+                stack.extend((child, path) for child in reversed(node._nodes))
+        return clashes
+
+    def _remove(self, node):
+        """Remove the ``node`` and the nodes within it from the lookup.
+        Returns False when that cannot be done in place.
+        """
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if id(node) in self.repeated or id(node) not in self.paths:
+                return False
+            node, path, keys = self.paths.pop(id(node))
+            for key in keys:
+                if key in self.shared_keys:
+                    return False
+                self.nodes.pop(key, None)
+            if isinstance(node, TranslucentBinder):
+                node._lookups.discard(self)
+                stack.extend(node._nodes)
+        return True
+
+    def update(self, binder, removed, added):
+        """Update the lookup for the nodes ``removed`` from and ``added``
+        to the ``binder`` within, marking it stale instead when the first
+        of the nodes with a key, or the first place of a node, may have
+        changed.
+        """
+        if self.stale:
+            return
+        if id(binder) in self.repeated or id(binder) not in self.paths:
+            self.stale = True
+            return
+        if not all(self._remove(node) for node in removed):
+            self.stale = True
+            return
+        path = self.paths[id(binder)][1] + (binder,)
+        for node in added:
+            if self._add(node, path):
+                self.stale = True
+                return
+
+    @staticmethod
+    def _keys(node):
+        metadata = node.metadata
+        for key in (node.id, node.ident_hash,
+                    metadata.get('cnx-archive-uri'),
+                    metadata.get('shortId'),
+                    metadata.get('cnx-archive-shortid'),):
+            if key:
+                yield key
+                if '@' in key:
+                    yield key.split('@')[0]
 
 
 class Binder(TranslucentBinder):
     """An object that has metadata and contains
     ``Binder``, ``Resource``, ``TranslucentBinder`` and ``Document`` instances.
     """
+    __slots__ = ('_id', 'resources', 'collation_state',)
 
     def __init__(self, id, nodes=None, metadata=None, title_overrides=None,
                  resources=None):
@@ -392,6 +740,12 @@ class Binder(TranslucentBinder):
         self.id = id
         self.resources = resources or []
 
+    def clone(self, deep=True):
+        clone = super(Binder, self).clone(deep)
+        clone._id = self._id
+        clone.resources = list(self.resources)
+        return clone
+
     @property
     def id(self):
         return self._id
@@ -440,35 +794,197 @@ class Binder(TranslucentBinder):
         self.metadata[key] = value
 
 
+class _Sharers(weakref.WeakSet):
+    """The documents sharing a tree, which are clones of one another.
+    Documents leave it as they let go of the tree or are dropped.
+    """
+
+    def __deepcopy__(self, memo):
+        # The copies of the documents, which share the copy of the
+        # tree, join the copy (see ``Document.__setstate__``).
+        return _Sharers()
+
+
 class Document(object):
     """An HTML document noted as ``content`` on the instance,
     which can contain ``Resource`` instances.
+    The ``data`` may also be a ``<body>`` element, which is then
+    used as the document's tree without being copied.
+
+    When ``lazy``, the content is kept as it is given and only parsed
+    once the tree or the references are needed. Reading the ``content``
+    of a document that has not been parsed, or rendering it with
+    ``.formatters.HTMLFormatter``, does not keep the tree.
+    See also ``unload`` and ``clone``.
     """
+    __slots__ = ('_tree', '_shared', '_source', '_source_is_content',
+                 '_references', 'metadata', 'resources', '_id',
+                 '__weakref__',)
     media_type = 'application/xhtml+xml'
 
     def __init__(self, id, data, metadata=None, resources=None,
-                 reference_resolver=None):
-        self._xml = None
-        if hasattr(data, 'read'):
-            self.content = utf8(data.read())
+                 reference_resolver=None, lazy=False):
+        self._tree = None
+        # The documents the tree is shared with (clones of one another),
+        # shared between them, as the tree is until they change it.
+        self._shared = None
+        self._source = None
+        self._source_is_content = False
+        self._references = None
+        if isinstance(data, etree._Element):
+            self._xml = data
+            self._references = _parse_references(self._xml, self)
         else:
-            self.content = utf8(data)
-        self._references = _parse_references(self._xml)
-        self.metadata = utf8(metadata or {})
+            if hasattr(data, 'read'):
+                data = data.read()
+            if lazy:
+                self._source = data
+            else:
+                self.content = data
+        self.metadata = _model_metadata(metadata)
         self.resources = resources or []
         self.id = id
 
+    @property
+    def _xml(self):
+        """The document's ``<body>`` element, parsed on first use
+        and copied when shared with a clone, as it may be changed.
+        """
+        if self._tree is None and self._source is not None:
+            self._tree = content_to_etree(self._source)
+            self._source = None
+            self._references = _parse_references(self._tree, self)
+        elif self._is_shared():
+            self._unshare()
+        return self._tree
+
+    @_xml.setter
+    def _xml(self, value):
+        self._release()
+        self._tree = value
+        self._source = None
+
+    def _read_xml(self):
+        """The document's ``<body>`` element, with the bound references
+        written to it, for reading only: it may be shared with a clone.
+        A document that has not been parsed is parsed for the reader
+        alone, and is left so.
+        """
+        if self._tree is None:
+            if self._source is not None:
+                return content_to_etree(self._source)
+            return self._xml
+        # Only copies a shared tree when there is something to write.
+        self._write_references()
+        return self._tree
+
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in self.__class__.__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if name != '__weakref__' and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if self._shared is not None:
+            self._shared.add(self)
+
+    def _is_shared(self):
+        """Whether the tree is shared with a clone."""
+        if self._shared is None:
+            return False
+        if len(self._shared) > 1:
+            return True
+        # The clones have all let go of the tree, or been dropped.
+        self._shared = None
+        return False
+
+    def _release(self):
+        """Let go of the tree shared with clones."""
+        if self._shared is not None:
+            self._shared.discard(self)
+            self._shared = None
+
+    def _unshare(self):
+        """Copy the tree shared with a clone, moving the references,
+        along with their bindings, over to the copy.
+        """
+        tree = deepcopy(self._tree)
+        references = _parse_references(tree, self)
+        if self._references is not None:
+            for reference, copied in zip(self._references, references):
+                reference.elm = copied.elm
+            references = self._references
+        self._release()
+        self._tree = tree
+        self._references = references
+
+    def clone(self):
+        """A copy of this document, which shares the tree (or content)
+        with it until either of them changes it. The metadata is
+        copied, but not the lists and dictionaries in it.
+        """
+        cls = self.__class__
+        clone = cls.__new__(cls)
+        if hasattr(self, '__dict__'):
+            clone.__dict__.update(self.__dict__)
+        # Write out the bound references, to be seen by the clone.
+        self._write_references()
+        clone._tree = self._tree
+        clone._source = self._source
+        clone._source_is_content = self._source_is_content
+        clone._references = None
+        clone._shared = None
+        if self._tree is not None:
+            if self._shared is None:
+                self._shared = _Sharers([self])
+            self._shared.add(clone)
+            clone._shared = self._shared
+        clone.metadata = _model_metadata(self.metadata)
+        clone.resources = list(self.resources)
+        clone._id = self._id
+        return clone
+
+    @property
+    def is_loaded(self):
+        """Whether the content has been parsed to a tree."""
+        return self._tree is not None
+
+    def unload(self):
+        """Drop the tree, keeping the content, which is parsed again
+        when needed. References bound to models are written out
+        and forgotten.
+        """
+        if self._tree is None:
+            return
+        self._source = etree_to_content(self._read_xml())
+        self._source_is_content = True
+        self._release()
+        self._tree = None
+        self._references = None
+
     def _content__get(self):
         """Produce the content from the data.
         This is used to write out reference changes that may have
         taken place.
         """
-        return etree_to_content(self._xml)
+        if self._tree is None and self._source is not None:
+            if not self._source_is_content:
+                # Serialize as it would be from the tree,
+                # without keeping the tree.
+                self._source = etree_to_content(
+                    content_to_etree(self._source))
+                self._source_is_content = True
+            return self._source
+        return etree_to_content(self._read_xml())
 
     def _content__set(self, value):
         self._xml = content_to_etree(value)
         # reload the references after a content update
-        self._references = _parse_references(self._xml)
+        self._references = _parse_references(self._xml, self)
 
     def _content__del(self):
         self._xml = content_to_etree('')
@@ -530,18 +1046,68 @@ class Document(object):
         """Reference points in the document.
         These could be resources, other documents, external links, etc.
         """
-        if self._references is None:
+        if self._is_shared():
+            # References of their own, to the tree shared with a clone,
+            # which is copied before they change it.
+            if self._references is None:
+                self._references = _parse_references(self._tree, self)
+        elif self._xml is None:
             return []
+        elif self._references is None:
+            # A clone, which no longer shares its tree.
+            self._references = _parse_references(self._tree, self)
         return self._references
 
+    def bind_references(self, resources, template='{}'):
+        """Bind each internal reference to the resource named by
+        the file name of its uri in ``resources``, a mapping of
+        file names to resources, using the ``template``.
+        Returns the references that were bound.
+        """
+        bound = []
+        for reference in self.references:
+            if reference.remote_type != INTERNAL_REFERENCE_TYPE:
+                continue
+            resource = resources.get(os.path.basename(reference.uri))
+            if resource is not None:
+                reference.bind(resource, template)
+                bound.append(reference)
+        return bound
+
+    def _has_bound(self):
+        return any(reference.is_bound
+                   for reference in self._references or [])
+
+    def _write_references(self):
+        """Write the uris of the bound references to the tree."""
+        if not self._has_bound():
+            return
+        if self._is_shared():
+            self._unshare()
+        for reference in self._references:
+            if reference.is_bound:
+                reference._set_uri_from_bound_model()
+
 
 class DocumentPointer(object):
+    __slots__ = ('ident_hash', 'id', 'metadata',)
     media_type = 'application/xhtml+xml'
 
     def __init__(self, ident_hash, metadata=None):
         self.ident_hash = ident_hash
         self.id = ident_hash
-        self.metadata = utf8(metadata or {})
+        self.metadata = _model_metadata(metadata)
+
+    def clone(self):
+        """A copy of this document pointer, with its own metadata."""
+        cls = self.__class__
+        clone = cls.__new__(cls)
+        if hasattr(self, '__dict__'):
+            clone.__dict__.update(self.__dict__)
+        clone.ident_hash = self.ident_hash
+        clone.id = self.id
+        clone.metadata = _model_metadata(self.metadata)
+        return clone
 
     @classmethod
     def from_uri(cls, uri):
@@ -553,37 +1119,211 @@ class DocumentPointer(object):
 
 class CompositeDocument(Document):
     """A Document created during the collation process."""
+    __slots__ = ()
 
 
 class Resource(object):
     """A binary object used within the context of the ``Document``.
     It is typically referenced within the documents HTML content.
+
+    The ``data`` can be given as a file path, a readable file-like object
+    or a callable that returns a readable file-like object
+    (e.g. ``functools.partial(zipfile.ZipFile(...).open, name)``).
+    Nothing is read until the data is opened or the ``hash`` is requested,
+    at which point the hash is computed in chunks of
+    ``RESOURCE_HASH_CHUNK_SIZE`` bytes.
+    Streams that cannot seek are spooled to a temporary file on first use.
+    Files and the results of the callable are opened anew each time
+    the resource is opened, and closed once it is done with.
     """
+    __slots__ = ('id', '_data', '_filepath', '_opener', 'media_type',
+                 '_hash', '_filename',)
 
     def __init__(self, id, data, media_type, filename=None):
         self.id = id
-        if not isinstance(data, io.BytesIO):
-            raise ValueError("Data must be an io.BytesIO instance. "
+        self._data = None
+        self._filepath = None
+        self._opener = None
+        if isinstance(data, string_types):
+            self._filepath = data
+        elif hasattr(data, 'read'):
+            self._data = data
+        elif callable(data):
+            self._opener = data
+        else:
+            raise ValueError("Data must be a file path, a readable file-like "
+                             "object or a callable returning one. "
                              "'{}' was given.".format(type(data)))
-        self._data = data
         self.media_type = media_type
-
-        self._hash = hashlib.new(RESOURCE_HASH_TYPE,
-                                 self._data.read()).hexdigest()
-        if not filename:
-            # Create a filename from the hash and media-type.
-            filename = "{}{}".format(
-                self._hash, mimetypes.guess_extension(self.media_type))
-        self.filename = filename
-
-        self._data.seek(0)
+        self._hash = None
+        self._filename = filename
+
+    def _get_data(self):
+        """Retrieve the seekable data handle given as a stream."""
+        data = self._data
+        if not _is_seekable(data):
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            shutil.copyfileobj(data, spool, RESOURCE_HASH_CHUNK_SIZE)
+            data = spool
+            self._data = data
+        return data
 
     @property
     def hash(self):
+        if self._hash is None:
+            hasher = hashlib.new(RESOURCE_HASH_TYPE)
+            with self.open() as data:
+                while True:
+                    chunk = data.read(RESOURCE_HASH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+            self._hash = hasher.hexdigest()
         return self._hash
 
+    @property
+    def filename(self):
+        if not self._filename:
+            # Create a filename from the hash and media-type.
+            self._filename = "{}{}".format(
+                self.hash, mimetypes.guess_extension(self.media_type))
+        return self._filename
+
+    @filename.setter
+    def filename(self, value):
+        self._filename = value
+
     @contextmanager
     def open(self):
-        self._data.seek(0)
-        yield self._data
-        self._data.seek(0)
+        if self._data is None:
+            # Files are opened for this use only and closed after it.
+            if self._filepath is not None:
+                data = io.open(self._filepath, 'rb')
+            else:
+                data = self._opener()
+            try:
+                yield data
+            finally:
+                if hasattr(data, 'close'):
+                    data.close()
+            return
+        data = self._get_data()
+        data.seek(0)
+        yield data
+        data.seek(0)
+
+
+def _is_seekable(data):
+    """Determine if the file-like ``data`` can be rewound."""
+    seekable = getattr(data, 'seekable', None)
+    if seekable is not None:
+        return seekable()
+    return hasattr(data, 'seek')
+
+
+def model_to_wire(model, resource_data=True, resource_paths=True):
+    """Given a binder, document, document pointer or resource as
+    ``model``, make a compact form of it, of tuples, dictionaries,
+    strings and bytes, to be sent (pickled) to another process,
+    where ``model_from_wire`` makes the model again.
+
+    Documents are given as their content (or as the data they were
+    given, when not parsed yet), with the references bound to their
+    resources noted, so that they are bound again.
+    Resources backed by a file are given as its path (unless not
+    ``resource_paths``), others as their data, or without any data
+    when not ``resource_data``.
+    """
+    if isinstance(model, Resource):
+        path = data = None
+        if model._filepath is not None and resource_paths:
+            path = model._filepath
+        elif resource_data:
+            with model.open() as file:
+                # Read in chunks, as memory mapped data cannot
+                # be read whole on python 2.
+                data = b''.join(iter(
+                    lambda: file.read(RESOURCE_HASH_CHUNK_SIZE), b''))
+        return ('resource', model.id, model.media_type, model.filename,
+                model._hash, path, data)
+    if isinstance(model, DocumentPointer):
+        return ('document-pointer', model.ident_hash, dict(model.metadata))
+    if isinstance(model, Document):
+        kind = isinstance(model, CompositeDocument) and \
+            'composite-document' or 'document'
+        if model.is_loaded or model._source is None:
+            content = model.content
+        else:
+            # The content is parsed on the other end, not here.
+            content = model._source
+        resource_indexes = dict((id(resource), i)
+                                for i, resource in enumerate(model.resources))
+        bound = []
+        for i, reference in enumerate(model._references or []):
+            if reference.is_bound and \
+                    id(reference.bound_model) in resource_indexes:
+                bound.append((i, resource_indexes[id(reference.bound_model)],
+                              reference._uri_template))
+        resources = [
+            model_to_wire(resource, resource_data, resource_paths)
+            for resource in model.resources]
+        return (kind, model.id, content, dict(model.metadata), resources,
+                bound)
+    if isinstance(model, TranslucentBinder):
+        if isinstance(model, Binder):
+            kind, id_ = 'binder', model.id
+            resources = [
+                model_to_wire(resource, resource_data, resource_paths)
+                for resource in model.resources]
+        else:
+            kind, id_, resources = 'translucent-binder', None, []
+        nodes = [model_to_wire(node, resource_data, resource_paths)
+                 for node in model]
+        return (kind, id_, dict(model.metadata), list(model._title_overrides),
+                nodes, resources)
+    raise TypeError("Cannot make a wire form of {!r}".format(model))
+
+
+def model_from_wire(wire, open_resource=None):
+    """Make the model again from the ``wire`` form given by
+    ``model_to_wire``. Resources given without any data are opened
+    by calling ``open_resource(id)`` for a callable that opens them
+    (see ``Resource``), when given, otherwise they are left empty.
+    """
+    kind = wire[0]
+    if kind == 'resource':
+        kind, id_, media_type, filename, hash_, path, data = wire
+        if path is not None:
+            data = path
+        elif data is None and open_resource is not None:
+            data = open_resource(id_)
+        else:
+            data = io.BytesIO(data or b'')
+        resource = Resource(id_, data, media_type, filename)
+        resource._hash = hash_
+        return resource
+    if kind == 'document-pointer':
+        kind, ident_hash, metadata = wire
+        return DocumentPointer(ident_hash, metadata)
+    if kind in ('document', 'composite-document',):
+        kind, id_, content, metadata, resources, bound = wire
+        cls = kind == 'document' and Document or CompositeDocument
+        resources = [model_from_wire(resource, open_resource)
+                     for resource in resources]
+        # Only parse the content when there are references to bind.
+        document = cls(id_, content, metadata, resources=resources,
+                       lazy=not bound)
+        if bound:
+            references = document.references
+            for i, resource_index, template in bound:
+                references[i].bind(resources[resource_index], template)
+        return document
+    if kind in ('binder', 'translucent-binder',):
+        kind, id_, metadata, title_overrides, nodes, resources = wire
+        nodes = [model_from_wire(node, open_resource) for node in nodes]
+        if kind == 'binder':
+            return Binder(id_, nodes, metadata, title_overrides,
+                          [model_from_wire(resource, open_resource)
+                           for resource in resources])
+        return TranslucentBinder(nodes, metadata, title_overrides)
+    raise ValueError("Unknown wire form: {!r}".format(kind))
@@ -11,7 +11,9 @@ Ensures safe parsing for specific elements.
 """
 from __future__ import print_function
 import argparse
+import copy
 import logging
+import shutil
 import sys
 from pprint import pformat
 import cnxepub
@@ -60,9 +62,15 @@ def main(argv=None):
         zin = ZipFile(args.input, 'r')
         for res in zin.namelist():
             if res.startswith('resources'):
-                zres = zin.open(res)
-                zi = zin.getinfo(res)
-                zout.writestr(zi, zres.read(), ZIP_DEFLATED)
+                zi = copy.copy(zin.getinfo(res))
+                zi.compress_type = ZIP_DEFLATED
+                if sys.version_info >= (3, 6):
+                    # Copy in chunks, rather than reading the whole
+                    # resource into memory.
+                    with zin.open(res) as zres, zout.open(zi, 'w') as zdst:
+                        shutil.copyfileobj(zres, zdst)
+                else:
+                    zout.writestr(zi, zin.read(res))
         zout.close()
 
     # TODO Check for documents that have no identifier.
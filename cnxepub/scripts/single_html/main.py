@@ -32,14 +32,14 @@ logger = logging.getLogger('single_html')
 
 
 def single_html(epub_file_path, html_out=sys.stdout, mathjax_version=None,
-                numchapters=None, includes=None):
+                numchapters=None, includes=None, cache_dir=None):
     """Generate complete book HTML."""
-    epub = cnxepub.EPUB.from_file(epub_file_path)
-    if len(epub) != 1:
+    cache = cache_dir and cnxepub.AdaptationCache(cache_dir) or None
+    binders = cnxepub.adapt_epub(epub_file_path, cache)
+    if len(binders) != 1:
         raise Exception('Expecting an epub with one book')
 
-    package = epub[0]
-    binder = cnxepub.adapt_package(package)
+    binder = binders[0]
     partcount.update({}.fromkeys(parts, 0))
     partcount['book'] += 1
 
@@ -115,6 +115,10 @@ def main(argv=None):
                         type=int, const=2, nargs='?', metavar='num_chapters',
                         help="Create subset of complete book "
                         "(default 2 chapters plus extras)")
+    parser.add_argument('--cache-dir', metavar='cache_dir',
+                        help="Keep the book adapted from the epub in this "
+                             "directory, to reuse on later runs. Anyone "
+                             "who can write to it can change the book")
 
     args = parser.parse_args(argv)
 
@@ -146,4 +150,4 @@ def main(argv=None):
         includes = None
 
     single_html(args.epub_file_path, args.html_out, mathjax_version,
-                args.numchapters, includes)
+                args.numchapters, includes, args.cache_dir)
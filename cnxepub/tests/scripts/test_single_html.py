@@ -152,3 +152,19 @@ class SingleHTMLTestCase(unittest.TestCase):
         self.root = etree.fromstring(stdout)
         self.assertEqual(2, len(self.xpath('xhtml:body/*[@data-type="unit"]')))
         self.assertEqual(3, len(self.xpath('//*[@data-type="chapter"]')))
+
+    def test_w_cache_dir(self):
+        import shutil
+        cache_dir = tempfile.mkdtemp('-cache')
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        with captured_output() as (out, err):
+            self.target([self.epub_path])
+        expected = out.getvalue()
+
+        for i in range(2):
+            with captured_output() as (out, err):
+                self.target(['--cache-dir', cache_dir, self.epub_path])
+            self.assertEqual(err.getvalue(), '')
+            self.assertMultiLineEqual(expected, out.getvalue())
+            self.assertEqual(1, len(os.listdir(cache_dir)))
@@ -17,6 +17,10 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # python 2
+    ProcessPoolExecutor = None
 
 from lxml import etree
 
@@ -226,6 +230,9 @@ class EPUBAdaptationTestCase(unittest.TestCase):
                 namespaces={'xhtml': "http://www.w3.org/1999/xhtml"})[0]
             elm = etree.SubElement(body, "img")
             elm.set('src', internal_uri)
+            # Only references to the resources directory are bound.
+            elm = etree.SubElement(body, "img")
+            elm.set('src', "other/openstax.png")
         with open(item_filepath, 'wb') as fb:
             fb.write(etree.tostring(xml))
         item = self.make_item(item_filepath, media_type='application/xhtml+xml')
@@ -244,7 +251,7 @@ class EPUBAdaptationTestCase(unittest.TestCase):
         document = adapt_item(item, package)
 
         # Check resource discovery.
-        self.assertEqual([internal_uri],
+        self.assertEqual([internal_uri, "other/openstax.png"],
                          [ref.uri for ref in document.references])
         # Check the resource was discovered.
         self.assertEqual(['openstax.png'],
@@ -253,6 +260,7 @@ class EPUBAdaptationTestCase(unittest.TestCase):
         ref = list(document.references)[0]
         res = list(document.resources)[0]
         self.assertEqual(ref._bound_model, res)
+        self.assertFalse(document.references[1].is_bound)
 
     def test_to_document_pointer(self):
         """Adapts an ``Item`` to a ``DocumentPointerItem``.
@@ -275,6 +283,76 @@ class EPUBAdaptationTestCase(unittest.TestCase):
         self.assertEqual(pointer.metadata['title'], 'Pointer')
 
 
+class AdaptationCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.book_path = os.path.join(TEST_DATA_DIR, 'book')
+
+    def resources(self, binders):
+        from ..models import flatten_model
+        resources = {}
+        for binder in binders:
+            for model in flatten_model(binder):
+                for resource in getattr(model, 'resources', []):
+                    with resource.open() as data:
+                        resources[resource.id] = (
+                            resource.hash, resource.media_type,
+                            resource.filename, data.read())
+        return resources
+
+    def check_cache(self, file):
+        from ..adapters import adapt_epub, AdaptationCache
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        cache = AdaptationCache(cache_dir)
+
+        adapted = adapt_epub(file, cache)
+        with mock.patch('cnxepub.adapters.adapt_package') as adapt_package:
+            cached = adapt_epub(file, cache)
+            self.assertFalse(adapt_package.called)
+
+        expected = self.resources(adapted)
+        self.assertEqual(expected, self.resources(cached))
+        self.assertIn('cover.png', expected)
+        # Only the resources' hashes are cached, not their data.
+        cache_files = os.listdir(cache_dir)
+        self.assertEqual(len(cache_files), 1)
+        with open(os.path.join(cache_dir, cache_files[0]), 'rb') as f:
+            cached_data = f.read()
+        for hash, media_type, filename, data in expected.values():
+            self.assertIn(hash.encode('ascii'), cached_data)
+            self.assertNotIn(data, cached_data)
+
+    def test_directory(self):
+        self.check_cache(self.book_path)
+
+    def test_plain_data_only(self):
+        import pickle
+        from ..adapters import adapt_epub, AdaptationCache, _epub_digest
+        from ..models import Binder
+        cache = AdaptationCache(os.path.join(self.tmpdir, 'cache'))
+        key = _epub_digest(self.book_path)
+        # Classes (or functions) are not loaded from the cache.
+        with open(cache._path(key), 'wb') as f:
+            pickle.dump(([Binder('book')], {}), f)
+        with mock.patch('cnxepub.adapters.logger') as logger:
+            self.assertEqual(cache.get(key, self.book_path), None)
+        self.assertTrue(logger.warning.called)
+
+        binders = adapt_epub(self.book_path, cache)
+        self.assertEqual(type(binders[0]).__name__, 'BinderItem')
+        # The binders read from the cache are plain models.
+        binders = cache.get(key, self.book_path)
+        self.assertEqual(type(binders[0]), Binder)
+
+    def test_epub_file(self):
+        from ..epub import pack_epub
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        pack_epub(self.book_path, epub_filepath)
+        self.check_cache(epub_filepath)
+
+
 @mock.patch('mimetypes.guess_extension', new=random_extension)
 class ModelsToEPUBTestCase(unittest.TestCase):
 
@@ -656,6 +734,193 @@ class ModelsToEPUBTestCase(unittest.TestCase):
         self.assertEqual(len(list(flatten_model(binder))), 4)
 
 
+class IncrementalEPUBTestCase(unittest.TestCase):
+
+    def make_binder(self, id='rock'):
+        from ..models import Binder, Document, Resource
+        with open(os.path.join(TEST_DATA_DIR, 'cover.png'), 'rb') as f:
+            cover = Resource('cover.png', io.BytesIO(f.read()), 'image/png',
+                             filename='cover.png')
+        binder = Binder(id, metadata={'title': "Kraken",
+                                      'license_url': "http://my.license"},
+                        resources=[cover])
+        binder.append(Document('ingress', io.BytesIO(
+            b'<body><p>Hello.</p><img src="../resources/cover.png"/></body>'),
+            metadata={'title': 'entrée', 'version': 'draft'}))
+        binder.append(Document('egress', io.BytesIO(b'<body><p>Bye.</p></body>'),
+                               metadata={'title': 'egress', 'version': 'draft'}))
+        return binder
+
+    def test_rebuild(self):
+        """Rebuild an EPUB, reusing the unchanged items of a previous one."""
+        binder = self.make_binder()
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        first = os.path.join(tmpdir, 'first.epub')
+        second = os.path.join(tmpdir, 'second.epub')
+        from ..adapters import make_epub, HTMLFormatter
+        make_epub(binder, first, incremental=True)
+
+        binder[1].content = b'<body><p>Farewell.</p></body>'
+        with mock.patch('cnxepub.adapters.HTMLFormatter') as formatter:
+            formatter.side_effect = HTMLFormatter
+            make_epub(binder, second, previous=first)
+        # Only the navigation document and the changed document are rendered.
+        self.assertEqual([c[0][0] for c in formatter.call_args_list],
+                         [binder, binder[1]])
+
+        import zipfile
+        with zipfile.ZipFile(first) as zf1, zipfile.ZipFile(second) as zf2:
+            self.assertIsNone(zf2.testzip())
+            self.assertEqual(zf1.namelist(), zf2.namelist())
+            for name in zf1.namelist():
+                if 'egress' in name or 'digests' in name:
+                    self.assertNotEqual(zf1.read(name), zf2.read(name))
+                else:
+                    self.assertEqual(zf1.read(name), zf2.read(name))
+            egress = [n for n in zf2.namelist() if 'egress' in n][0]
+            self.assertIn(b'<p>Farewell.</p>', zf2.read(egress))
+
+    def test_workers(self):
+        """Render in worker processes, making the same EPUB."""
+        from ..models import DocumentPointer
+        binders = [self.make_binder('rock'), self.make_binder('roll')]
+        binders[1].append(DocumentPointer('pointer@1', {
+            'title': 'Pointer',
+            'cnx-archive-uri': 'pointer@1',
+            'url': 'https://cnx.org/contents/pointer@1'}))
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        serial = os.path.join(tmpdir, 'serial.epub')
+        parallel = os.path.join(tmpdir, 'parallel.epub')
+        from ..adapters import make_epub
+        make_epub(binders, serial)
+        make_epub(binders, parallel, workers=2)
+
+        with open(serial, 'rb') as f1, open(parallel, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def check_lazy_documents(self, workers):
+        from ..models import Document
+        binder = self.make_binder()
+        ingress, egress = binder[0], binder[1]
+        binder[0] = Document('ingress', ingress.content,
+                             metadata=ingress.metadata, lazy=True)
+        binder[1] = Document('egress', egress.content,
+                             metadata=egress.metadata, lazy=True)
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filepath = os.path.join(tmpdir, 'book.epub')
+        from ..adapters import make_epub
+        make_epub(binder, filepath, workers=workers)
+        # Only the document referencing the cover is parsed,
+        # the other is rendered from its data without keeping a tree.
+        self.assertTrue(binder[0].is_loaded)
+        self.assertFalse(binder[1].is_loaded)
+
+        import zipfile
+        with zipfile.ZipFile(filepath) as zf:
+            names = zf.namelist()
+            ingress = [n for n in names if 'ingress' in n][0]
+            egress = [n for n in names if 'egress' in n][0]
+            self.assertIn(b'src="../resources/cover.png"', zf.read(ingress))
+            self.assertIn(b'<p>Bye.</p>', zf.read(egress))
+
+    def test_lazy_documents(self):
+        """Unparsed documents are only parsed to bind their references."""
+        self.check_lazy_documents(workers=1)
+
+    @unittest.skipIf(ProcessPoolExecutor is None,
+                     'Worker processes are not available.')
+    def test_lazy_documents_w_workers(self):
+        self.check_lazy_documents(workers=2)
+
+    @unittest.skipIf(ProcessPoolExecutor is None,
+                     'Worker processes are not available.')
+    def test_workers_forwarded(self):
+        """Both entry points hand the worker pool to the package builder."""
+        from ..adapters import (
+            make_epub, make_publication_epub, _make_package)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filepath = os.path.join(tmpdir, 'book.epub')
+        builds = [
+            lambda: make_epub(self.make_binder(), filepath, workers=2),
+            lambda: make_publication_epub(self.make_binder(), 'Ursula',
+                                          'Published', filepath, workers=2),
+            ]
+        for build in builds:
+            with mock.patch('cnxepub.adapters._make_package') as make_package:
+                make_package.side_effect = _make_package
+                build()
+            executor = make_package.call_args[0][2]
+            self.assertIsNotNone(executor)
+
+    @unittest.skipIf(ProcessPoolExecutor is None,
+                     'Worker processes are not available.')
+    def test_workers_started_first(self):
+        """The worker processes are started before the threads
+        packaging several binders.
+        """
+        from ..adapters import _make_packages
+        processes = []
+
+        def make_package(binder, executor):
+            processes.append(len(executor._processes))
+            return binder
+
+        binders = [self.make_binder('rock'), self.make_binder('roll')]
+        self.assertEqual(binders,
+                         _make_packages(binders, make_package, workers=2))
+        self.assertEqual([2, 2], processes)
+
+    @unittest.skipIf(ProcessPoolExecutor is not None,
+                     'Worker processes are available.')
+    def test_workers_unavailable(self):
+        """Without worker processes, the packaging is serial."""
+        from ..adapters import _make_packages
+        with mock.patch('cnxepub.adapters.logger') as logger:
+            packages = _make_packages([1, 2], lambda b, e: (b, e),
+                                      workers=2)
+        self.assertEqual([(1, None), (2, None)], packages)
+        self.assertTrue(logger.warning.called)
+
+    def test_workers_without_binders(self):
+        """Without binders an empty EPUB is made, as when serial."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filepath = os.path.join(tmpdir, 'empty.epub')
+        from ..adapters import make_epub
+        make_epub([], filepath, workers=2)
+
+        import zipfile
+        with zipfile.ZipFile(filepath) as zf:
+            self.assertIn('META-INF/container.xml', zf.namelist())
+
+    def test_compression(self):
+        """The compression level and threads reach the packing."""
+        binder = self.make_binder()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        from ..adapters import make_epub
+        import zipfile
+        sizes = []
+        for compresslevel in (0, 9):
+            filepath = os.path.join(tmpdir, '{}.epub'.format(compresslevel))
+            make_epub(binder, filepath, compresslevel=compresslevel,
+                      threads=2)
+            with zipfile.ZipFile(filepath) as zf:
+                # Digests are only recorded for incremental builds.
+                self.assertNotIn('META-INF/cnx-epub-digests.json',
+                                 zf.namelist())
+                sizes.append(sum(i.compress_size for i in zf.infolist()
+                                 if i.filename.startswith('contents/')))
+        self.assertGreater(sizes[0], sizes[1])
+
+
 class HTMLAdaptationTestCase(unittest.TestCase):
     page_path = os.path.join(TEST_DATA_DIR, 'desserts-single-page.xhtml')
     maxDiff = None
@@ -738,6 +1003,33 @@ Pointer.
     </div>
   </div></body>''')
 
+    def test_wide_chapter_title_overrides(self):
+        """Title overrides are assigned by position in a wide chapter."""
+        from ..adapters import adapt_single_html
+        from ..formatters import SingleHTMLFormatter
+        from ..models import Binder, Document, TranslucentBinder
+
+        metadata = self.base_metadata.copy()
+        binder = Binder(metadata['title'], metadata=metadata)
+        chapter = TranslucentBinder(metadata={'title': 'Pies'})
+        for i in range(50):
+            page_metadata = metadata.copy()
+            page_metadata['title'] = 'Pie'
+            chapter.append(Document(
+                'pie-{}'.format(i),
+                io.BytesIO(b'<body><p>Pie</p></body>'),
+                metadata=page_metadata))
+            chapter.set_title_for_index(i, '{}. Pie'.format(i))
+        binder.append(chapter)
+
+        adapted_binder = adapt_single_html(str(SingleHTMLFormatter(binder)))
+
+        adapted_chapter = adapted_binder[0]
+        self.assertEqual(len(adapted_chapter), 50)
+        self.assertEqual(
+            [adapted_chapter.get_title_for_index(i) for i in range(50)],
+            ['{}. Pie'.format(i) for i in range(50)])
+
     def test_to_binder(self):
         from ..adapters import adapt_single_html
         from ..models import model_to_tree
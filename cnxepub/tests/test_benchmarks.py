@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2026, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class SuiteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_make_binder(self):
+        from ..benchmarks import make_binder
+        from ..models import flatten_to_documents, model_to_tree
+
+        binder = make_binder(chapters=2, pages=3, references=1,
+                             depth=3, exercises=2)
+        tree = model_to_tree(binder)
+        unit = tree['contents'][0]
+        self.assertEqual('Unit 0.1', unit['title'])
+        self.assertEqual('Unit 0.2', unit['contents'][0]['title'])
+        self.assertEqual('Chapter 0',
+                         unit['contents'][0]['contents'][0]['title'])
+        documents = list(flatten_to_documents(binder))
+        self.assertEqual(6, len(documents))
+        self.assertEqual(2, documents[0].content.count(b'#ost/api/ex/'))
+
+    def test_main(self):
+        from ..benchmarks.suite import main
+
+        output = os.path.join(self.tmpdir, 'results.json')
+        main(['-c', '2', '-p', '2', '-r', '2', '-n', '1', '-o', output])
+        with open(output) as f:
+            report = json.load(f)
+
+        self.assertEqual(2, report['parameters']['chapters'])
+        self.assertEqual(
+            sorted(['make_epub', 'EPUB.from_file', 'adapt_package',
+                    'SingleHTMLFormatter', 'adapt_single_html', 'collate']),
+            sorted(report['results']))
+        result = report['results']['adapt_package']
+        self.assertGreater(result['seconds'], 0)
+        self.assertAlmostEqual(4 / result['seconds'],
+                               result['pages_per_second'])
+
+    def test_memory(self):
+        from ..benchmarks.memory import measure, tracemalloc
+        if tracemalloc is None:
+            raise unittest.SkipTest('Memory cannot be traced.')
+
+        per_page, per_reference, dict_per_page, dict_per_reference = \
+            measure(chapters=2, pages=5, references=5)
+        self.assertGreater(per_page, 0)
+        self.assertGreater(per_reference, 0)
+        # The dict-backed models hold more than the slotted ones.
+        self.assertGreater(dict_per_page, per_page)
+        self.assertGreater(dict_per_reference, per_reference)
@@ -7,6 +7,10 @@
 # ###
 import os
 import io
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 try:
     from unittest import mock
@@ -20,6 +24,25 @@ from .test_models import BaseModelTestCase
 
 here = os.path.abspath(os.path.dirname(__file__))
 TEST_DATA_DIR = os.path.join(here, 'data')
+# Prints the peak memory (in kB) used to adapt the single html file
+# given as the first argument, streaming it when the second is 'True'.
+# The peak is read from linux's /proc, as the peak rusage of a process
+# is that of its parent when higher.
+PEAK_MEMORY_SCRIPT = """\
+import sys
+from cnxepub.adapters import adapt_single_html, adapt_single_html_file
+def peak():
+    with open('/proc/self/status') as f:
+        return int([line.split()[1] for line in f
+                    if line.startswith('VmHWM:')][0])
+base = peak()
+if sys.argv[2] == 'True':
+    adapt_single_html_file(sys.argv[1])
+else:
+    with open(sys.argv[1], 'rb') as f:
+        adapt_single_html(f.read())
+print(peak() - base)
+"""
 
 
 class ReconstituteTestCase(unittest.TestCase):
@@ -39,6 +62,50 @@ class ReconstituteTestCase(unittest.TestCase):
             desserts = reconstitute(html)
         self.check_desserts(desserts)
 
+    def test_xhtml_streaming(self):
+        page_path = os.path.join(TEST_DATA_DIR, 'desserts-single-page.xhtml')
+        with open(page_path, 'rb') as html:
+            from cnxepub.collation import reconstitute
+            desserts = reconstitute(html, streaming=True)
+        self.check_desserts(desserts)
+
+    def test_html_streaming(self):
+        page_path = os.path.join(TEST_DATA_DIR, 'desserts-single-page.html')
+        with open(page_path, 'rb') as html:
+            from cnxepub.collation import reconstitute
+            desserts = reconstitute(html, streaming=True)
+        self.check_desserts(desserts)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'),
+                         'Peak memory cannot be measured.')
+    def test_streaming_peak_memory(self):
+        """Streaming holds a page's tree in memory, not the book's."""
+        from ..benchmarks import make_binder
+        from ..formatters import SingleHTMLFormatter
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        page_path = os.path.join(tmpdir, 'book.xhtml')
+        binder = make_binder(chapters=20, pages=20, references=5)
+        with open(page_path, 'wb') as f:
+            f.write(bytes(SingleHTMLFormatter(binder)))
+
+        def peak_memory(streaming):
+            # Measured in a process of its own, as the peak stays.
+            output = subprocess.check_output(
+                [sys.executable, '-c', PEAK_MEMORY_SCRIPT, page_path,
+                 str(streaming)],
+                cwd=os.path.dirname(os.path.dirname(here)))
+            return int(output)
+
+        self.assertLess(peak_memory(True), peak_memory(False) / 2)
+
+        from cnxepub.collation import reconstitute
+        with open(page_path, 'rb') as html:
+            book = reconstitute(html, streaming=True)
+        from ..models import flatten_to_documents
+        self.assertFalse(any(document.is_loaded
+                             for document in flatten_to_documents(book)))
+
     def check_desserts(self, desserts):
         """Assertions for the desserts model"""
         from ..models import model_to_tree
@@ -212,11 +279,10 @@ class CollateTestCase(BaseModelTestCase):
                                       filename='ruleset.css')
         binder.resources.append(resource)
 
-        def mock_easybake(ruleset, in_html, out_html):
+        def mock_bake(ruleset, html):
             from lxml import etree
-            html = etree.parse(in_html)
             # Add in a composite-page with title "Composite One" here.
-            body = html.getroot().xpath(
+            body = html.xpath(
                 '//xhtml:body',
                 namespaces={'xhtml': 'http://www.w3.org/1999/xhtml'})[0]
             comp_elm = etree.SubElement(body, 'div')
@@ -243,14 +309,13 @@ class CollateTestCase(BaseModelTestCase):
             </div>"""))
             etree.SubElement(comp_elm, 'p').text = "composite document"
             # Add the composite-page to the table-of-contents.
-            toc = html.getroot().xpath(
+            toc = html.xpath(
                 "//xhtml:*[@id='toc']/xhtml:ol",
                 namespaces={'xhtml': 'http://www.w3.org/1999/xhtml'})[0]
             etree.SubElement(toc, 'li').append(etree.fromstring('<a>Composite One</a>'))
-            out_html.write(etree.tostring(html))
 
-        with mock.patch('cnxepub.collation.easybake') as easybake:
-            easybake.side_effect = mock_easybake
+        with mock.patch('cnxepub.collation.bake') as bake:
+            bake.side_effect = mock_bake
             fake_ruleset = 'div::after {contents: "test"}'
             collated_binder = self.target(binder, fake_ruleset)
 
@@ -358,3 +423,281 @@ nav#toc:pass(30)::after {
         self.assertEqual(len(collated_binder), 3)
         self.assertEqual(collated_binder[2].metadata['title'],
                          'Document One')
+
+    def test_with_cache(self):
+        binder = self.make_binder(
+            '8d75ea29',
+            metadata={'version': '3', 'title': "Book One",
+                      'license_url': 'http://my.license'},
+            nodes=[
+                self.make_document(
+                    id="e78d4f90",
+                    content=b"<body><p>document one</p></body>",
+                    metadata={'version': '3',
+                              'title': "Document One",
+                              'license_url': 'http://my.license'})])
+        ruleset = b"p { class: baked; }"
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        from cnxepub.collation import CollationCache, bake
+        cache = CollationCache(cache_dir)
+
+        with mock.patch('cnxepub.collation.bake') as mocked_bake:
+            mocked_bake.side_effect = bake
+            collated = self.target(binder, ruleset, cache=cache)
+            cached = self.target(binder, ruleset, cache=cache)
+            self.assertEqual(mocked_bake.call_count, 1)
+            # A different ruleset misses the cache.
+            self.target(binder, b"p { class: cooked; }", cache=cache)
+            self.assertEqual(mocked_bake.call_count, 2)
+
+        self.assertIn(b'class="baked"', collated[0].content)
+        self.assertEqual(collated[0].content, cached[0].content)
+        self.assertEqual(collated[0].metadata, cached[0].metadata)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_with_cache_and_includes(self):
+        binder = self.make_binder(
+            '8d75ea29',
+            metadata={'version': '3', 'title': "Book One",
+                      'license_url': 'http://my.license'},
+            nodes=[
+                self.make_document(
+                    id="e78d4f90",
+                    content=b"<body><p>document one</p>"
+                            b"<a href=\"#ost/api/ex/1\">exercise</a>"
+                            b"</body>",
+                    metadata={'version': '3',
+                              'title': "Document One",
+                              'license_url': 'http://my.license'})])
+        ruleset = b"p { class: baked; }"
+        exercise = {'text': 'first'}
+
+        def include_exercise(elem):
+            elem.text = exercise['text']
+
+        includes = [('//xhtml:a[@href="#ost/api/ex/1"]', include_exercise)]
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        from cnxepub.collation import CollationCache, bake
+        cache = CollationCache(cache_dir)
+
+        with mock.patch('cnxepub.collation.bake') as mocked_bake:
+            mocked_bake.side_effect = bake
+            self.target(binder, ruleset, includes=includes, cache=cache)
+            self.target(binder, ruleset, includes=includes, cache=cache)
+            self.assertEqual(mocked_bake.call_count, 1)
+            # Included content that changed misses the cache.
+            exercise['text'] = 'second'
+            collated = self.target(binder, ruleset, includes=includes,
+                                   cache=cache)
+            self.assertEqual(mocked_bake.call_count, 2)
+
+        self.assertIn(b'>second</a>', collated[0].content)
+
+    def test_cache_eviction(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        from cnxepub.collation import CollationCache
+        cache = CollationCache(cache_dir, max_size=10)
+
+        cache.set('a', b'aaaaa')
+        os.utime(os.path.join(cache_dir, 'a.xhtml'), (1, 1))
+        cache.set('b', b'bbbbb')
+        os.utime(os.path.join(cache_dir, 'b.xhtml'), (2, 2))
+        # Using 'a' makes 'b' the least recently used.
+        cache.open('a').close()
+        cache.set('c', b'ccccc')
+
+        self.assertIsNone(cache.open('b'))
+        with cache.open('a') as f:
+            self.assertEqual(f.read(), b'aaaaa')
+        with cache.open('c') as f:
+            self.assertEqual(f.read(), b'ccccc')
+
+    def test_sharded(self):
+        from cnxepub.models import flatten_to_documents
+
+        def make_binder():
+            binder = self.make_binder(
+                '8d75ea29',
+                metadata={'version': '3', 'title': "Book One",
+                          'license_url': 'http://my.license'})
+            for c in range(2):
+                chapter = self.make_binder(
+                    metadata={'title': 'Chapter {}'.format(c)})
+                for p in range(2):
+                    # Link each page to the first page of the other chapter
+                    content = ('<body><p>Page <a href="/contents/page-{}-0">'
+                               'other</a></p></body>'.format(1 - c))
+                    chapter.append(self.make_document(
+                        id='page-{}-{}'.format(c, p),
+                        content=content.encode('utf-8'),
+                        metadata={'version': '1', 'title': 'Page',
+                                  'license_url': 'http://my.license'}))
+                binder.append(chapter)
+            return binder
+
+        ruleset = b"div[data-type='page'] > p { class: baked; }"
+        # Numbering the pages needs the whole book.
+        global_ruleset = b"""\
+div[data-type='page'] { counter-increment: page; }
+div[data-type='page'] > p::before { content: counter(page); container: span; }
+"""
+        collated_binder = self.target(make_binder(), ruleset)
+        sharded_binder = self.target(make_binder(), ruleset, sharded=True,
+                                     global_ruleset=global_ruleset)
+
+        self.assertEqual(len(sharded_binder), 2)
+        pages = list(flatten_to_documents(sharded_binder))
+        self.assertEqual([page.id for page in pages],
+                         [page.id for page
+                          in flatten_to_documents(collated_binder)])
+        self.assertEqual(
+            pages[3].content,
+            b'<body xmlns="http://www.w3.org/1999/xhtml"><div data-type="page" '
+            b'id="page-1-1"><p id="0" class="baked"><span>4</span>Page '
+            b'<a href="/contents/page-0-0">other</a></p>\n  </div></body>')
+
+    def test_recollate(self):
+        from cnxepub.collation import bake, recollate
+        from cnxepub.formatters import SingleHTMLFormatter
+        from cnxepub.models import flatten_to_documents
+
+        def make_binder(edited_content=None):
+            binder = self.make_binder(
+                '8d75ea29',
+                metadata={'version': '3', 'title': "Book One",
+                          'license_url': 'http://my.license',
+                          'cnx-archive-uri':
+                              'bad183c3-8776-4a6d-bb02-3b11e0c26aaf'})
+            for c in range(3):
+                chapter = self.make_binder(
+                    metadata={'title': 'Chapter {}'.format(c)})
+                for p in range(2):
+                    # Link each page to the first page of the next chapter
+                    content = ('<body><p id="p">Page <a href="/contents/'
+                               'page-{}-0#p">next</a></p></body>'
+                               .format((c + 1) % 3))
+                    if (c, p) == (1, 1) and edited_content is not None:
+                        content = edited_content
+                    chapter.append(self.make_document(
+                        id='page-{}-{}'.format(c, p),
+                        content=content.encode('utf-8'),
+                        metadata={'version': '1', 'title': 'Page',
+                                  'license_url': 'http://my.license'}))
+                binder.append(chapter)
+            return binder
+
+        ruleset = b"div[data-type='page'] > p { class: baked; }"
+        collated_binder = self.target(make_binder(), ruleset, sharded=True)
+        edited_content = ('<body><p id="p">Edited <a href="/contents/'
+                          'page-0-1#p">previous</a></p></body>')
+
+        baked = []
+
+        def mock_bake(ruleset, html):
+            baked.append(html.xpath('//*[@data-type="chapter"]/@id'))
+            bake(ruleset, html)
+
+        with mock.patch('cnxepub.collation.bake', mock_bake):
+            recollated_binder = recollate(collated_binder,
+                                          make_binder(edited_content),
+                                          ruleset, workers=1)
+        # Only the edited chapter is baked again, the others are cloned.
+        self.assertEqual(len(baked), 1)
+        self.assertEqual(recollated_binder[0][0].content,
+                         collated_binder[0][0].content)
+        self.assertEqual(recollated_binder[2][1].content,
+                         collated_binder[2][1].content)
+
+        expected_binder = self.target(make_binder(edited_content), ruleset,
+                                      sharded=True)
+        self.assertEqual(
+            etree.tostring(SingleHTMLFormatter(recollated_binder).to_tree()),
+            etree.tostring(SingleHTMLFormatter(expected_binder).to_tree()))
+        pages = list(flatten_to_documents(recollated_binder))
+        self.assertEqual(
+            pages[3].content,
+            b'<body xmlns="http://www.w3.org/1999/xhtml"><div data-type="page" '
+            b'id="page-1-1"><p id="p" class="baked">Edited '
+            b'<a href="/contents/page-0-1#p">previous</a></p>\n  </div></body>')
+
+        # Links in pages rebaked again still reach the reused pages.
+        with mock.patch('cnxepub.collation.bake', mock_bake):
+            rerecollated_binder = recollate(
+                recollated_binder,
+                make_binder(edited_content.replace('Edited', 'Again')),
+                ruleset, workers=1)
+        self.assertEqual(len(baked), 2)
+        pages = list(flatten_to_documents(rerecollated_binder))
+        self.assertIn(b'Again <a href="/contents/page-0-1#p">',
+                      pages[3].content)
+
+        # Changing the clones leaves the earlier collation as it was.
+        recollated_binder[0][0].metadata['title'] = 'Changed'
+        recollated_binder[0][0].content = b'<body><p>Changed</p></body>'
+        self.assertEqual(collated_binder[0][0].metadata['title'], 'Page')
+        self.assertNotIn(b'Changed', collated_binder[0][0].content)
+
+        # Changing the table of contents collates the whole book again.
+        binder = make_binder()
+        binder[0][0].metadata['title'] = 'Retitled'
+        with mock.patch('cnxepub.collation.bake', mock_bake):
+            recollated_binder = recollate(recollated_binder, binder,
+                                          ruleset, workers=1)
+        self.assertEqual(len(baked), 5)
+        self.assertEqual(recollated_binder[0].get_title_for_index(0),
+                         'Retitled')
+
+        # The global ruleset is baked over the whole book.
+        global_ruleset = b"""\
+div[data-type='page'] { counter-increment: page; }
+div[data-type='page'] > p::before { content: counter(page); container: span; }
+"""
+        with mock.patch('cnxepub.collation.bake', mock_bake):
+            recollated_binder = recollate(
+                collated_binder, make_binder(edited_content), ruleset,
+                workers=1, global_ruleset=global_ruleset)
+        self.assertEqual(len(baked), 9)
+        pages = list(flatten_to_documents(recollated_binder))
+        self.assertIn(b'<span>4</span>Edited', pages[3].content)
+
+        # Rebaked shards that do not make as many nodes as their source
+        # collate the whole book again.
+        from cnxepub.adapters import adapt_single_html
+        from cnxepub.models import TranslucentBinder
+
+        def mock_adapt_single_html(html, id_map=None):
+            binder = adapt_single_html(html, id_map=id_map)
+            binder.append(TranslucentBinder(metadata={'title': 'Extra'}))
+            return binder
+
+        with mock.patch('cnxepub.collation.bake', mock_bake), \
+                mock.patch('cnxepub.collation.adapt_single_html',
+                           mock_adapt_single_html):
+            recollated_binder = recollate(collated_binder,
+                                          make_binder(edited_content),
+                                          ruleset, workers=1)
+        self.assertEqual(len(baked), 13)
+        self.assertEqual(len(recollated_binder), 4)
+        self.assertFalse(recollated_binder[0] is collated_binder[0])
+
+        # Collations read from the cache are recollated as incrementally.
+        from cnxepub.collation import CollationCache
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = CollationCache(cache_dir)
+        self.target(make_binder(), ruleset, sharded=True, cache=cache)
+        cached_binder = self.target(make_binder(), ruleset, sharded=True,
+                                    cache=cache)
+        with mock.patch('cnxepub.collation.bake', mock_bake):
+            recollated_binder = recollate(cached_binder,
+                                          make_binder(edited_content),
+                                          ruleset, workers=1)
+        self.assertEqual(len(baked), 14)
+        self.assertEqual(
+            etree.tostring(SingleHTMLFormatter(recollated_binder).to_tree()),
+            etree.tostring(SingleHTMLFormatter(expected_binder).to_tree()))
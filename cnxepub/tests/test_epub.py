@@ -286,6 +286,60 @@ class WritePackageTestCase(testing.EPUBTestCase):
 
         self.assertEqual(parser.metadata, package_metadata)
 
+    def test_to_file_w_mapped_items(self):
+        """Items of large files are memory mapped while they are read
+        and written out in chunks, as are the resources adapted from them.
+        """
+        import hashlib
+        import mmap
+        import zipfile
+        try:
+            from unittest import mock
+        except ImportError:
+            import mock
+        from ..epub import EPUB, _LazyFile
+        from ..adapters import adapt_package, make_epub
+
+        book_path = os.path.join(TEST_DATA_DIR, 'book')
+        with mock.patch('cnxepub.epub.MMAP_MIN_SIZE', 1):
+            package = EPUB.from_file(book_path)[0]
+        mapped = [item for item in package
+                  if isinstance(item.data, _LazyFile)]
+        self.assertEqual(['image/png', 'image/png'],
+                         [item.media_type for item in mapped])
+        # Nothing is mapped until it is read.
+        self.assertEqual([None, None], [item.data._file for item in mapped])
+
+        with mock.patch('mmap.mmap', wraps=mmap.mmap) as mapping:
+            package.to_file(package, self.tmpdir)
+        self.assertEqual(mapping.call_count, 2)
+        # The mappings are closed once written.
+        self.assertEqual([None, None], [item.data._file for item in mapped])
+        name = 'e3d625fe893b3f1f9aaef3bdf6bfa15c.png'
+        with open(os.path.join(book_path, 'resources', name), 'rb') as f:
+            expected = f.read()
+        with open(os.path.join(self.tmpdir, 'resources', name), 'rb') as f:
+            self.assertEqual(expected, f.read())
+
+        with mock.patch('cnxepub.epub.MMAP_MIN_SIZE', 1):
+            binder = adapt_package(EPUB.from_file(book_path)[0])
+        resource = binder.resources[0]
+        self.assertEqual('cover.png', resource.id)
+        with open(os.path.join(book_path, 'resources', 'cover.png'),
+                  'rb') as f:
+            expected = f.read()
+        self.assertEqual(hashlib.sha1(expected).hexdigest(), resource.hash)
+
+        # The items made from resources are streams of their data.
+        from ..adapters import _make_package
+        item = _make_package(binder).grab_by_name('cover.png')
+        self.assertEqual(expected, item.data.read())
+
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        make_epub(binder, epub_filepath)
+        with zipfile.ZipFile(epub_filepath) as zf:
+            self.assertEqual(expected, zf.read('resources/cover.png'))
+
 
 class WriteEPUBTestCase(testing.EPUBTestCase):
     """Output the ``EPUB`` to the filesystem"""
@@ -384,3 +438,211 @@ class WriteEPUBTestCase(testing.EPUBTestCase):
         expected_string = 'full-path="{}"'.format(package_name)
         self.assertTrue(container_xml.find(expected_string) >= 0,
                         container_xml)
+
+    def test_to_file_w_extensionless_media(self):
+        """Media named without an extension is stored by its media-type."""
+        import io
+        book_path = os.path.join(TEST_DATA_DIR, 'book')
+        from ..epub import Item
+        items = [
+            Item.from_file(
+                os.path.join(book_path, 'content',
+                             '9b0903d2-13c4-4ebe-9ffe-1ee79db28482@1.6.xhtml'),
+                media_type='application/xhtml+xml',
+                is_navigation=True, properties=['nav']),
+            Item('d6b8e1c0f3a9', io.BytesIO(os.urandom(5000)),
+                 media_type='image/jpeg'),
+            Item('8f1f2ac4e7b0', io.BytesIO(b'0' * 5000),
+                 media_type='text/plain'),
+            ]
+        from ..epub import Package
+        package = Package('book.opf', items, {
+            'publisher': "Connexions",
+            'publication_message': "Publishing media.",
+            'title': "Media",
+            'identifier': "org.cnx.contents.media",
+            'language': 'en-us',
+            'license_text': "CC BY 3.0",
+            'license_url': "http://creativecommons.org/licenses/by/3.0/",
+            })
+
+        from ..epub import EPUB
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        EPUB.to_file(EPUB(packages=[package]), epub_filepath)
+
+        import zipfile
+        with zipfile.ZipFile(epub_filepath) as zf:
+            image = zf.getinfo('resources/d6b8e1c0f3a9')
+            text = zf.getinfo('resources/8f1f2ac4e7b0')
+        self.assertEqual(image.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(image.compress_size, 5000)
+        self.assertEqual(text.compress_type, zipfile.ZIP_DEFLATED)
+
+
+class PackEPUBTestCase(testing.EPUBTestCase):
+    """Pack a directory into an EPUB archive"""
+
+    @property
+    def target(self):
+        from ..epub import pack_epub
+        return pack_epub
+
+    def test_pack(self):
+        book_path = self.copy(os.path.join(TEST_DATA_DIR, 'book'))
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        self.target(book_path, epub_filepath, threads=4)
+
+        import zipfile
+        with zipfile.ZipFile(epub_filepath) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = zf.infolist()
+        names = [i.filename for i in infos]
+        # The mimetype file must be first and stored.
+        self.assertEqual(names[0], 'mimetype')
+        self.assertEqual(names[1:], sorted(names[1:]))
+        compress_types = {i.filename: i.compress_type for i in infos}
+        self.assertEqual(compress_types['mimetype'], zipfile.ZIP_STORED)
+        self.assertEqual(
+            compress_types['resources/e3d625fe893b3f1f9aaef3bdf6bfa15c.png'],
+            zipfile.ZIP_STORED)
+        self.assertEqual(
+            compress_types['content/e78d4f90-e078-49d2-beac-e95e8be70667@3'
+                           '.xhtml'],
+            zipfile.ZIP_DEFLATED)
+        self.assertEqual(set(i.date_time for i in infos),
+                         set([(1980, 1, 1, 0, 0, 0)]))
+
+        # Round trip through the reader.
+        from ..epub import EPUB
+        epub = EPUB.from_file(epub_filepath)
+        self.assertEqual(len(epub[0]), 4)
+
+    def test_reproducible(self):
+        book_path = self.copy(os.path.join(TEST_DATA_DIR, 'book'))
+        first = os.path.join(self.tmpdir, 'first.epub')
+        second = os.path.join(self.tmpdir, 'second.epub')
+        self.target(book_path, first, compresslevel=9)
+        os.utime(os.path.join(book_path, 'mimetype'), (0, 0))
+        self.target(book_path, second, compresslevel=9, threads=3)
+
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_stored_media(self):
+        book_path = self.copy(os.path.join(TEST_DATA_DIR, 'book'))
+        for name in ('movie.m4v', 'picture.svg', 'data.bin'):
+            with open(os.path.join(book_path, 'resources', name), 'wb') as f:
+                f.write(b'0' * 1000)
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        try:
+            from unittest import mock
+        except ImportError:
+            import mock
+        with mock.patch('cnxepub.epub.DEFLATE_MAX_SIZE', 100):
+            self.target(book_path, epub_filepath)
+
+        import zipfile
+        with zipfile.ZipFile(epub_filepath) as zf:
+            self.assertIsNone(zf.testzip())
+            compress_types = dict((i.filename, i.compress_type)
+                                  for i in zf.infolist())
+        # Media and large binary files are stored, while svg is text.
+        self.assertEqual(compress_types['resources/movie.m4v'],
+                         zipfile.ZIP_STORED)
+        self.assertEqual(compress_types['resources/data.bin'],
+                         zipfile.ZIP_STORED)
+        self.assertEqual(compress_types['resources/picture.svg'],
+                         zipfile.ZIP_DEFLATED)
+
+    def test_deflate_error(self):
+        book_path = self.copy(os.path.join(TEST_DATA_DIR, 'book'))
+        epub_filepath = os.path.join(self.tmpdir, 'book.epub')
+        try:
+            from unittest import mock
+        except ImportError:
+            import mock
+        with mock.patch('cnxepub.epub._deflate_file') as deflate_file:
+            deflate_file.side_effect = MemoryError()
+            with self.assertRaises(MemoryError):
+                self.target(book_path, epub_filepath, threads=2)
+
+
+class ZipWriterTestCase(testing.EPUBTestCase):
+    """Write zip archives from members compressed beforehand"""
+
+    def write_archive(self, filepath, previous=None):
+        import zlib
+        import zipfile
+        from ..epub import _ZipWriter, _deflate_file
+        data = b'deflated ' * 100
+        with open(os.path.join(self.tmpdir, 'data'), 'wb') as f:
+            f.write(data)
+        with _ZipWriter(filepath) as zippy:
+            zippy.write_stored_file('mimetype', os.path.join(
+                TEST_DATA_DIR, 'book', 'mimetype'))
+            crc, file_size, deflated = _deflate_file(
+                os.path.join(self.tmpdir, 'data'), zlib.Z_BEST_COMPRESSION)
+            zippy.write_member(u'contents/d\xe9flated.txt',
+                               zipfile.ZIP_DEFLATED, crc, file_size, deflated)
+            zippy.write_member('resources/stored.txt', zipfile.ZIP_STORED,
+                               zlib.crc32(b'stored') & 0xffffffff, 6,
+                               b'stored')
+            if previous is not None:
+                with zipfile.ZipFile(previous) as zf:
+                    zippy.copy_member(
+                        zf, zf.getinfo(u'contents/d\xe9flated.txt'))
+        return data
+
+    def check_archive(self, filepath, data, names):
+        import zipfile
+        with zipfile.ZipFile(filepath) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(names, zf.namelist())
+            infos = zf.infolist()
+            self.assertEqual(zipfile.ZIP_DEFLATED, infos[1].compress_type)
+            self.assertLess(infos[1].compress_size, infos[1].file_size)
+            # Non-ascii names are flagged as utf-8.
+            self.assertEqual(0x800, infos[1].flag_bits & 0x800)
+            self.assertEqual(data, zf.read(names[1]))
+            self.assertEqual(b'stored', zf.read('resources/stored.txt'))
+            self.assertEqual(b'application/epub+zip',
+                             zf.read('mimetype').strip())
+            if len(names) > 3:
+                self.assertEqual(data, zf.read(names[3]))
+
+    def test_write(self):
+        names = ['mimetype', u'contents/d\xe9flated.txt',
+                 'resources/stored.txt']
+        first = os.path.join(self.tmpdir, 'first.zip')
+        data = self.write_archive(first)
+        self.check_archive(first, data, names)
+
+        # Members are copied from another archive as they are.
+        second = os.path.join(self.tmpdir, 'second.zip')
+        self.write_archive(second, previous=first)
+        self.check_archive(second, data, names + [names[1]])
+
+    def test_zip64(self):
+        """Members, offsets and counts over the limits are written
+        with the Zip64 extensions.
+        """
+        try:
+            from unittest import mock
+        except ImportError:
+            import mock
+        names = ['mimetype', u'contents/d\xe9flated.txt',
+                 'resources/stored.txt']
+        first = os.path.join(self.tmpdir, 'first.zip')
+        second = os.path.join(self.tmpdir, 'second.zip')
+        with mock.patch('zipfile.ZIP64_LIMIT', 5), \
+                mock.patch('zipfile.ZIP_FILECOUNT_LIMIT', 2):
+            data = self.write_archive(first)
+            self.write_archive(second, previous=first)
+
+        for filepath in (first, second):
+            with open(filepath, 'rb') as f:
+                content = f.read()
+            self.assertIn(b'PK\006\006', content)
+            self.assertIn(b'PK\006\007', content)
+        self.check_archive(first, data, names)
+        self.check_archive(second, data, names + [names[1]])
@@ -709,6 +709,18 @@ class HTMLFormatterTestCase(unittest.TestCase):
         formatted = str(HTMLFormatter(document, generate_ids=True))
         self.assertIn(expected_content, formatted)
 
+    def test_lazy_document(self):
+        from ..models import Document
+        from ..formatters import HTMLFormatter
+
+        document = Document('ingress', b'<body><p>Hello.</p></body>',
+                            metadata=self.base_metadata.copy(), lazy=True)
+        html = bytes(HTMLFormatter(document))
+
+        self.assertIn(b'<p>Hello.</p>', html)
+        # The document is parsed for rendering only.
+        self.assertFalse(document.is_loaded)
+
 
 @mock.patch('mimetypes.guess_extension', last_extension)
 class SingleHTMLFormatterTestCase(unittest.TestCase):
@@ -880,6 +892,15 @@ class SingleHTMLFormatterTestCase(unittest.TestCase):
                 html,
                 unicode(SingleHTMLFormatter(self.desserts)).encode('utf-8'))
 
+    def test_to_tree(self):
+        from ..formatters import SingleHTMLFormatter
+
+        html = bytes(SingleHTMLFormatter(self.desserts))
+        tree = SingleHTMLFormatter(self.desserts).to_tree()
+        self.assertMultiLineEqual(
+            html.decode('utf-8'),
+            etree.tostring(tree, encoding='utf-8').decode('utf-8') + '\n')
+
     @mock.patch('requests.get', mocked_requests_get)
     def test_includes_callback(self):
         from ..formatters import SingleHTMLFormatter
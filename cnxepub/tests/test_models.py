@@ -76,6 +76,32 @@ class ModelAttributesTestCase(BaseModelTestCase):
         self.assertEqual(binder.ident_hash, '456@2')
         self.assertEqual(binder.metadata['version'], '2')
 
+    def test_binder_title_overrides(self):
+        binder = self.make_binder('8d75ea29@3')
+        apple = self.make_document('apple')
+        lemon = self.make_document('lemon')
+        binder.extend([apple, lemon, apple])
+
+        binder.set_title_for_node(apple, 'Apple')
+        binder.set_title_for_index(2, 'Apple (again)')
+        self.assertEqual(binder.get_title_for_node(apple), 'Apple')
+        self.assertEqual(binder.get_title_for_node(lemon), None)
+        self.assertEqual(binder.get_title_for_index(2), 'Apple (again)')
+
+        # Titles follow their nodes as the binder changes.
+        binder.insert(0, lemon)
+        binder.set_title_for_node(lemon, 'Lemon')
+        self.assertEqual(binder.get_title_for_index(0), 'Lemon')
+        self.assertEqual(binder.get_title_for_index(2), None)
+        self.assertEqual(binder.get_title_for_node(apple), 'Apple')
+        del binder[1]
+        self.assertEqual(binder.get_title_for_node(apple), 'Apple (again)')
+        binder[1] = apple
+        self.assertEqual(binder.get_title_for_node(apple), None)
+
+        with self.assertRaises(ValueError):
+            binder.get_title_for_node(self.make_document('pear'))
+
     def test_document_attribs(self):
         document = self.make_document('8d75ea29@3')
 
@@ -102,6 +128,38 @@ class ModelAttributesTestCase(BaseModelTestCase):
         self.assertEqual(document.ident_hash, '456@2')
         self.assertEqual(document.metadata['version'], '2')
 
+    def test_metadata_utf8(self):
+        from ..models import utf8
+        authors = [{u'name': u'Jürgen', u'type': u'cnx-id'}]
+        metadata = {u'title': u'Über', u'authors': authors}
+        # Text is left as it is, without copying.
+        self.assertTrue(utf8(metadata) is metadata)
+
+        metadata['summary'] = u'Ça'.encode('utf-8')
+        self.assertEqual(utf8(metadata),
+                         {u'title': u'Über', u'authors': authors,
+                          u'summary': u'Ça'})
+        self.assertEqual(utf8([b'a', u'b']), [u'a', u'b'])
+
+        document = self.make_document('8d75ea29@3', metadata=metadata)
+        self.assertEqual(document.metadata['summary'], u'Ça')
+        # The model has its own copy, which needs no further decoding.
+        self.assertFalse('version' in metadata)
+        self.assertTrue(utf8(document.metadata) is document.metadata)
+        other = self.make_document('e78d4f90', metadata=document.metadata)
+        self.assertFalse(other.metadata is document.metadata)
+        self.assertEqual(other.metadata, document.metadata)
+
+        # Strings set on the model's copy are decoded as they are set.
+        document.metadata['title'] = u'Äpfel'.encode('utf-8')
+        document.metadata.update(language=b'de')
+        self.assertEqual(document.metadata.setdefault('license_url', b''),
+                         u'')
+        other = self.make_document('e78d4f90', metadata=document.metadata)
+        self.assertEqual(other.metadata['title'], u'Äpfel')
+        self.assertEqual(other.metadata['language'], u'de')
+        self.assertEqual(other.metadata['license_url'], u'')
+
 
 class TreeUtilityTestCase(BaseModelTestCase):
 
@@ -309,6 +367,129 @@ class TreeUtilityTestCase(BaseModelTestCase):
                   for d in flatten_to_documents(binder, include_pointers=True)]
         self.assertEqual(titles, expected_titles)
 
+    def test_flatten_model_deep(self):
+        import sys
+        from ..models import flatten_model, flatten_tree_to_ident_hashes
+
+        # Nest deeper than the recursion limit allows.
+        depth = sys.getrecursionlimit() + 10
+        binder = self.make_binder('8d75ea29', metadata={'version': '3'})
+        parent = binder
+        for i in range(depth):
+            child = self.make_binder(None)
+            parent.append(child)
+            parent = child
+        parent.append(self.make_document(id='e78d4f90',
+                                         metadata={'version': '3'}))
+
+        models = list(flatten_model(binder))
+        self.assertEqual(len(models), depth + 2)
+        self.assertEqual(models[-1].ident_hash, 'e78d4f90@3')
+
+        tree = {'id': '8d75ea29@3', 'contents': []}
+        contents = tree['contents']
+        for i in range(depth):
+            contents.append({'id': 'subcol', 'contents': []})
+            contents = contents[0]['contents']
+        contents.append({'id': 'e78d4f90@3'})
+        self.assertEqual(list(flatten_tree_to_ident_hashes(tree, 'subcol')),
+                         ['8d75ea29@3', 'e78d4f90@3'])
+
+    def test_flatten_model_changes(self):
+        from ..models import flatten_model
+
+        chapter = self.make_binder(
+            None, metadata={'title': "Chapter One"},
+            nodes=[self.make_document(
+                'e78d4f90', metadata={'title': "Document One"})])
+        binder = self.make_binder(
+            '8d75ea29', metadata={'version': '3', 'title': "Book One"},
+            nodes=[chapter])
+
+        def titles():
+            return [m.metadata['title'] for m in flatten_model(binder)]
+
+        self.assertEqual(titles(),
+                         ['Book One', 'Chapter One', 'Document One'])
+        # Changes to nested binders are seen from the top.
+        chapter.append(self.make_document(
+                '3c448dc6', metadata={'title': "Document Two"}))
+        self.assertEqual(titles(), ['Book One', 'Chapter One',
+                                    'Document One', 'Document Two'])
+        del chapter[0]
+        self.assertEqual(titles(),
+                         ['Book One', 'Chapter One', 'Document Two'])
+        binder[0] = self.make_document(
+                'ad17c39c', metadata={'title': "Document Three"})
+        self.assertEqual(titles(), ['Book One', 'Document Three'])
+
+    def test_get_node(self):
+        document = self.make_document(
+            'e78d4f90', metadata={'version': '3', 'title': "Document One",
+                                  'cnx-archive-shortid': '541PkH@3'})
+        pointer = self.make_document_pointer('844a99e5@1')
+        chapter = self.make_binder(
+            None, metadata={'title': "Chapter One"},
+            nodes=[document, pointer])
+        binder = self.make_binder(
+            '8d75ea29', metadata={'version': '3', 'title': "Book One"},
+            nodes=[chapter])
+
+        self.assertTrue(binder.get_node('8d75ea29@3') is binder)
+        for key in ('e78d4f90', 'e78d4f90@3', '541PkH@3', '541PkH'):
+            self.assertTrue(binder.get_node(key) is document)
+        self.assertTrue(binder.get_node('844a99e5') is pointer)
+        self.assertEqual(binder.get_node('3c448dc6'), None)
+
+        self.assertTrue(binder.get_parent(document) is chapter)
+        self.assertEqual(binder.get_parent(binder), None)
+        self.assertEqual(binder.get_path(pointer), [binder, chapter])
+        with self.assertRaises(ValueError):
+            chapter.get_path(binder)
+
+        # The lookup follows changes to the binders within.
+        other_document = self.make_document('3c448dc6')
+        chapter.append(other_document)
+        del chapter[0]
+        self.assertTrue(binder.get_node('3c448dc6') is other_document)
+        self.assertEqual(binder.get_node('e78d4f90'), None)
+        self.assertEqual(binder.get_path(other_document), [binder, chapter])
+
+        # Changes are made to the lookup in place, rather than building
+        # it again, unless nodes are found more than once.
+        lookup = binder._lookup
+        appendix = self.make_binder(
+            None, metadata={'title': "Appendix"}, nodes=[document])
+        binder.insert(0, appendix)
+        self.assertTrue(binder.get_node('e78d4f90') is document)
+        self.assertEqual(binder.get_path(document), [binder, appendix])
+        binder[0] = self.make_document('ad17c39c')
+        self.assertEqual(binder.get_node('e78d4f90'), None)
+        with self.assertRaises(ValueError):
+            binder.get_path(document)
+        appendix.append(self.make_document('a4a57cd5'))
+        self.assertEqual(binder.get_node('a4a57cd5'), None)
+        self.assertTrue(binder._lookup is lookup)
+        chapter.append(other_document)
+        self.assertTrue(binder.get_node('3c448dc6') is other_document)
+        self.assertFalse(binder._lookup is lookup)
+        del chapter[0]
+        self.assertTrue(binder.get_node('3c448dc6') is other_document)
+        self.assertEqual(binder.get_path(other_document), [binder, chapter])
+        del binder[0]
+
+        # Copies build lookups of their own.
+        from copy import deepcopy
+        binder_copy = deepcopy(binder)
+        self.assertTrue(binder_copy.get_parent(binder_copy[0][0])
+                        is binder_copy[0])
+        self.assertTrue(binder_copy.get_node('3c448dc6')
+                        is binder_copy[0][-1])
+        with self.assertRaises(ValueError):
+            binder_copy.get_path(other_document)
+        self.assertEqual(binder_copy.get_title_for_node(binder_copy[0]),
+                         binder.get_title_for_node(chapter))
+
 
 class ModelBehaviorTestCase(unittest.TestCase):
 
@@ -389,6 +570,28 @@ class ModelBehaviorTestCase(unittest.TestCase):
             ]
         self.assertEqual(expected_uris, [r.uri for r in document.references])
 
+    def test_bind_references(self):
+        from ..models import Document, TranslucentBinder
+        content = ('<body><img src="../resources/a.png"/>'
+                   '<img src="../resources/b.png"/>'
+                   '<a href="http://example.org/a.png">a</a></body>')
+        documents = [Document('document', content) for i in range(2)]
+        binder = TranslucentBinder(nodes=documents)
+
+        resource = mock.Mock()
+        resource.id = 'a-1.png'
+        bound = binder.bind_references({'a.png': resource}, 'res/{}')
+        self.assertEqual([r.elm.get('src') for r in bound],
+                         ['../resources/a.png'] * 2)
+        self.assertEqual([r.uri for r in bound], ['res/a-1.png'] * 2)
+        # Reading the uri leaves the tree alone,
+        # which is written to when serialized.
+        self.assertEqual([r.elm.get('src') for r in bound],
+                         ['../resources/a.png'] * 2)
+        resource.id = 'a-2.png'
+        self.assertTrue(b'src="res/a-2.png"' in documents[0].content)
+        self.assertTrue(b'src="../resources/b.png"' in documents[0].content)
+
     def test_document_content(self):
         with open(
             os.path.join(TEST_DATA_DIR,
@@ -399,3 +602,310 @@ class ModelBehaviorTestCase(unittest.TestCase):
         document = Document('document', metadata['content'])
         self.assertTrue(b'To demonstrate the potential of online publishing'
                         in document.content)
+
+    def test_document_from_element(self):
+        from lxml import etree
+        from ..models import Document
+        body = etree.fromstring(
+            b'<body xmlns="http://www.w3.org/1999/xhtml">'
+            b'<a href="#foo">foo</a></body>')
+        document = Document('document', body)
+        # The element is the document's tree, not a copy of it.
+        self.assertIs(document._xml, body)
+        self.assertEqual(['#foo'], [r.uri for r in document.references])
+        body[0].set('href', '#bar')
+        self.assertTrue(b'href="#bar"' in document.content)
+
+    def test_lazy_document(self):
+        from ..models import Document, Resource
+        content = (b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+                   b'<img src="../resources/image.png"/></body></html>')
+        expected_content = Document('document', content).content
+
+        document = Document('document', content, lazy=True)
+        self.assertFalse(document.is_loaded)
+        # Reading the content does not keep the tree.
+        self.assertEqual(document.content, expected_content)
+        self.assertFalse(document.is_loaded)
+        # The references need the tree.
+        self.assertEqual(['../resources/image.png'],
+                         [r.uri for r in document.references])
+        self.assertTrue(document.is_loaded)
+
+        resource = Resource('image.png', io.BytesIO(b''), 'image/png')
+        document.references[0].bind(resource, 'resources/{}')
+        resource.id = 'other.png'
+        document.unload()
+        self.assertFalse(document.is_loaded)
+        # The bound reference was written out.
+        self.assertTrue(b'src="resources/other.png"' in document.content)
+        self.assertEqual(['resources/other.png'],
+                         [r.uri for r in document.references])
+        self.assertFalse(document.references[0].is_bound)
+
+    def test_document_clone(self):
+        from ..models import Document
+        content = (b'<body><p><img src="../resources/a.png"/></p>'
+                   b'<p id="b">b</p></body>')
+        document = Document('document', content,
+                            metadata={'title': 'Document'})
+        resource = mock.Mock()
+        resource.id = 'a-1.png'
+        document.references[0].bind(resource, 'res/{}')
+
+        clone = document.clone()
+        # The tree is shared, with the bound references written to it.
+        self.assertTrue(clone._tree is document._tree)
+        self.assertTrue(b'src="res/a-1.png"' in clone.content)
+        self.assertFalse(clone.references[0].is_bound)
+        self.assertTrue(clone._tree is document._tree)
+
+        clone.metadata['title'] = 'Clone'
+        self.assertEqual(document.metadata['title'], 'Document')
+
+        # Changing either copies the tree.
+        resource.id = 'a-2.png'
+        self.assertTrue(b'src="res/a-2.png"' in document.content)
+        self.assertFalse(clone._tree is document._tree)
+        self.assertTrue(b'src="res/a-1.png"' in clone.content)
+        clone._xml.xpath('//*[@id="b"]')[0].text = 'changed'
+        self.assertTrue(b'>b</p>' in document.content)
+        self.assertTrue(b'>changed</p>' in clone.content)
+
+        # So does changing the uri of a reference, on either of them.
+        document = Document('document', content)
+        reference = document.references[0]
+        clone = document.clone()
+        clone.references[0].uri = '../resources/b.png'
+        self.assertTrue(b'src="../resources/a.png"' in document.content)
+        self.assertTrue(b'src="../resources/b.png"' in clone.content)
+        # The tree is no longer shared, so it is changed in place.
+        tree = document._tree
+        reference.uri = '../resources/c.png'
+        self.assertTrue(document._tree is tree)
+        self.assertTrue(b'src="../resources/c.png"' in document.content)
+        self.assertTrue(b'src="../resources/b.png"' in clone.content)
+
+        # The tree stays shared with the clones that did not change it.
+        first, second = document.clone(), document.clone()
+        document.references[0].uri = '../resources/d.png'
+        self.assertTrue(first._tree is second._tree)
+        first.references[0].uri = '../resources/e.png'
+        self.assertTrue(b'src="../resources/c.png"' in second.content)
+        self.assertTrue(b'src="../resources/d.png"' in document.content)
+        self.assertTrue(b'src="../resources/e.png"' in first.content)
+
+        # The tree is no longer shared once the clones are dropped.
+        import gc
+        document = Document('document', content)
+        document.references[0].bind(resource, 'res/{}')
+        tree = document._tree
+        clone = document.clone()
+        del clone
+        gc.collect()
+        resource.id = 'a-3.png'
+        self.assertTrue(b'src="res/a-3.png"' in document.content)
+        self.assertTrue(document._tree is tree)
+
+        # Copies of clones share the copy of their tree, and only that.
+        from copy import deepcopy
+        clone = document.clone()
+        document_copy, clone_copy = deepcopy([document, clone])
+        self.assertTrue(document_copy._tree is clone_copy._tree)
+        clone_copy.references[0].uri = '../resources/f.png'
+        self.assertTrue(b'src="res/a-3.png"' in document_copy.content)
+        self.assertTrue(b'src="res/a-3.png"' in clone.content)
+        document_copy = deepcopy(document)
+        self.assertFalse(document_copy._is_shared())
+
+    def test_binder_clone(self):
+        from ..models import Binder, Document, TranslucentBinder
+        document = Document('document', b'<body><p>a</p></body>')
+        chapter = TranslucentBinder([document], metadata={'title': 'One'})
+        binder = Binder('book', [chapter], metadata={'title': 'Book'},
+                        title_overrides=['Chapter One'])
+
+        shallow = binder.clone(deep=False)
+        self.assertEqual(shallow.id, 'book')
+        self.assertTrue(shallow[0] is chapter)
+        shallow.metadata['title'] = 'Clone'
+        shallow.set_title_for_index(0, 'Chapter 1')
+        self.assertEqual(binder.metadata['title'], 'Book')
+        self.assertEqual(binder.get_title_for_index(0), 'Chapter One')
+
+        clone = binder.clone()
+        self.assertFalse(clone[0] is chapter)
+        self.assertFalse(clone[0][0] is document)
+        self.assertEqual(clone[0].metadata, chapter.metadata)
+        self.assertEqual(clone[0][0].content, document.content)
+        clone[0].append(Document('other', b'<body/>'))
+        self.assertEqual(len(chapter), 1)
+
+    def test_compact_instances(self):
+        from ..models import Document, DocumentPointer
+        document = Document('document',
+                            b'<body><a href="#foo">foo</a></body>')
+        # No per-instance dictionary is kept.
+        for model in (document, document.references[0],
+                      DocumentPointer('844a99e5@1')):
+            self.assertFalse(hasattr(model, '__dict__'))
+            with self.assertRaises(AttributeError):
+                model.unknown = None
+
+
+class WireTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        import pickle
+        from ..models import (
+            Binder, CompositeDocument, Document, DocumentPointer, Resource,
+            TranslucentBinder, model_from_wire, model_to_wire)
+
+        resource = Resource('a.png', io.BytesIO(b'a'), 'image/png',
+                            filename='a.png')
+        document = Document(
+            'document', b'<body><img src="../resources/a.png"/>'
+                        b'<img src="../resources/b.png"/></body>',
+            metadata={'title': 'Document', 'version': '1'},
+            resources=[resource])
+        document.bind_references({'a.png': resource}, 'res/{}')
+        binder = Binder(
+            'book', metadata={'title': 'Book'},
+            nodes=[TranslucentBinder(
+                       [document, DocumentPointer('844a99e5@1')],
+                       metadata={'title': 'Chapter'}),
+                   CompositeDocument('composite', b'<body><p>c</p></body>')],
+            title_overrides=['Chapter One', None],
+            resources=[Resource('cover.png', io.BytesIO(b'c'), 'image/png')])
+
+        wire = pickle.loads(pickle.dumps(model_to_wire(binder)))
+        clone = model_from_wire(wire)
+
+        self.assertEqual(type(clone), Binder)
+        self.assertEqual(clone.ident_hash, binder.ident_hash)
+        self.assertEqual(clone.metadata, binder.metadata)
+        self.assertEqual(clone.get_title_for_index(0), 'Chapter One')
+        self.assertEqual(type(clone[0]), TranslucentBinder)
+        self.assertEqual(type(clone[1]), CompositeDocument)
+        self.assertEqual(clone[0][1].ident_hash, '844a99e5@1')
+        with clone.resources[0].open() as f:
+            self.assertEqual(f.read(), b'c')
+
+        clone_document = clone[0][0]
+        self.assertEqual(clone_document.ident_hash, 'document@1')
+        self.assertEqual(clone_document.content, document.content)
+        # The reference is bound again, to the resource sent with it.
+        clone_resource = clone_document.resources[0]
+        self.assertTrue(
+            clone_document.references[0].bound_model is clone_resource)
+        self.assertFalse(clone_document.references[1].is_bound)
+        clone_resource.id = 'a-1.png'
+        self.assertTrue(b'src="res/a-1.png"' in clone_document.content)
+
+        # Resources may be sent without their data, keeping their hash.
+        expected_hash = resource.hash
+        wire = model_to_wire(resource, resource_data=False)
+        self.assertEqual(wire[-1], None)
+        resource = model_from_wire(wire)
+        self.assertEqual(resource.hash, expected_hash)
+        self.assertEqual(resource.filename, 'a.png')
+
+
+class ContentToEtreeTestCase(unittest.TestCase):
+
+    def test_body(self):
+        from ..models import content_to_etree
+        xhtml = '{http://www.w3.org/1999/xhtml}'
+        for content, tag in (
+                (b'<body><p>a</p></body>', 'body'),
+                (b'<html xmlns="http://www.w3.org/1999/xhtml"><head/>'
+                 b'<body><p>a</p></body></html>', xhtml + 'body'),
+                (b'<div><section><body><p>a</p></body></section></div>',
+                 'body'),):
+            body = content_to_etree(content)
+            self.assertEqual(body.tag, tag)
+            self.assertEqual(body[0].text, 'a')
+        with self.assertRaises(Exception):
+            content_to_etree(b'<div><p>a</p></div>')
+
+    @unittest.skipUnless(os.environ.get('CNXEPUB_BENCHMARKS'),
+                         'Set CNXEPUB_BENCHMARKS to run benchmarks')
+    def test_benchmark(self):
+        from timeit import timeit
+        from lxml import etree
+        from ..benchmarks import PAGE_CONTENT, PARAGRAPH
+        from ..models import content_to_etree
+
+        paragraphs = u'\n'.join(PARAGRAPH.format(index=i, resource='a.png')
+                                for i in range(20))
+        content = PAGE_CONTENT.format(title='Page', paragraphs=paragraphs)
+        content = content.encode('utf-8')
+
+        def unpooled():
+            # A parser per call, with a search for the body.
+            tree = etree.XML(content, etree.XMLParser(ns_clean=True))
+            return tree.xpath(
+                '//*[self::body|self::x:body]',
+                namespaces={'x': 'http://www.w3.org/1999/xhtml'})[0]
+
+        unpooled_time = timeit(unpooled, number=2000)
+        pooled_time = timeit(lambda: content_to_etree(content), number=2000)
+        self.assertLess(pooled_time, unpooled_time)
+
+
+class ResourceTestCase(BaseModelTestCase):
+
+    def setUp(self):
+        self.data = b'\x89PNG' + b'\x00' * 200000
+        import hashlib
+        self.expected_hash = hashlib.sha1(self.data).hexdigest()
+
+    def test_lazy_hash_from_stream(self):
+        data = io.BytesIO(self.data)
+        resource = self.make_resource('smoo', data, 'image/png')
+        # Nothing has been read yet.
+        self.assertEqual(data.tell(), 0)
+        self.assertIsNone(resource._hash)
+
+        self.assertEqual(resource.hash, self.expected_hash)
+        self.assertEqual(resource.filename,
+                         '{}.png'.format(self.expected_hash))
+        with resource.open() as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_from_filepath(self):
+        import tempfile
+        fd, filepath = tempfile.mkstemp('.png')
+        self.addCleanup(os.remove, filepath)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.data)
+
+        resource = self.make_resource('smoo', filepath, 'image/png',
+                                      filename='smoo.png')
+        self.assertIsNone(resource._data)
+        self.assertEqual(resource.filename, 'smoo.png')
+        self.assertEqual(resource.hash, self.expected_hash)
+        with resource.open() as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(f.closed)
+        self.assertIsNone(resource._data)
+
+    def test_from_unseekable_opener(self):
+        class Unseekable(object):
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+
+            def read(self, *args):
+                return self._data.read(*args)
+
+        resource = self.make_resource(
+            'smoo', lambda: Unseekable(self.data), 'image/png')
+        self.assertEqual(resource.hash, self.expected_hash)
+        with resource.open() as f:
+            self.assertEqual(f.read(), self.data)
+        with resource.open() as f:
+            self.assertEqual(f.read(4), b'\x89PNG')
+
+    def test_invalid_data(self):
+        with self.assertRaises(ValueError):
+            self.make_resource('smoo', 42, 'image/png')